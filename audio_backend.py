@@ -0,0 +1,91 @@
+import logging
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import mido
+
+log = logging.getLogger(__name__)
+
+# MIDI driver fluidsynth should expose its input port through
+MIDI_DRIVERS = {'linux': 'alsa_seq', 'darwin': 'coremidi', 'win32': 'winmidi'}
+
+
+class AudioBackend:
+    """The synthesizer and MIDI output port shared by every play.
+
+    Both are set up once in start() (the main window calls start_background()
+    at startup and close() on exit), so pressing Play only has to send notes.
+    If a SoundFont is given and fluidsynth is installed, a fluidsynth process
+    is kept running with the SoundFont loaded and the port is connected to it.
+    """
+
+    def __init__(self, port_name=None, sound_font=None, sample_rate=44100):
+        self.port_name = port_name
+        self.sound_font = sound_font
+        self.sample_rate = sample_rate
+        self._port = None
+        self._synth_process = None
+        self._fluidsynth = None
+        # start() may run on a background thread while a playback thread asks for port()
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._port is not None:
+                return
+            if self.sound_font and self.port_name is None and shutil.which('fluidsynth'):
+                self._start_synth()
+            try:
+                self._port = mido.open_output(self.port_name)
+            except Exception as e:
+                log.error("Error opening MIDI output: %s", e)
+
+    def start_background(self):
+        """start() on a thread of its own: loading a SoundFont takes a while, the window need not wait."""
+        threading.Thread(target=self.start, name='audio-backend', daemon=True).start()
+
+    def _start_synth(self):
+        before = set(mido.get_output_names())
+        command = ['fluidsynth', '-i', '-r', str(self.sample_rate)]
+        if sys.platform in MIDI_DRIVERS:
+            command += ['-m', MIDI_DRIVERS[sys.platform]]
+        self._synth_process = subprocess.Popen(command + [self.sound_font],
+                                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        # Wait for the synth to load the SoundFont and publish its MIDI port
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and self._synth_process.poll() is None:
+            new_ports = [name for name in mido.get_output_names() if name not in before]
+            if new_ports:
+                self.port_name = new_ports[0]
+                return
+            time.sleep(0.05)
+        log.warning("fluidsynth did not open a MIDI port, using the default output")
+
+    def port(self):
+        """The shared output port, opened on first use if start() was not called."""
+        if self._port is None:
+            self.start()
+        return self._port
+
+    def synth(self):
+        """One midi2audio FluidSynth wrapper, reused for every render/play call."""
+        if self._fluidsynth is None:
+            from midi2audio import FluidSynth
+            if self.sound_font:
+                self._fluidsynth = FluidSynth(self.sound_font, sample_rate=self.sample_rate)
+            else:
+                self._fluidsynth = FluidSynth(sample_rate=self.sample_rate)
+        return self._fluidsynth
+
+    def close(self):
+        with self._lock:
+            if self._port is not None:
+                self._port.close()
+                self._port = None
+            if self._synth_process is not None:
+                self._synth_process.terminate()
+                self._synth_process.wait()
+                self._synth_process = None
@@ -0,0 +1,358 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from PyQt6.QtCore import QCoreApplication, Qt
+
+from catalog import Catalog
+from dataset_index import DatasetIndex, catalog_filenames
+from midi_cache import NOTE_ON, decode_midi
+from mixer import MixerEngine, Stream
+from playback import PlaybackEngine
+from query import FilterIndex, search_rows
+from search_index import SearchIndex
+from table_model import PandasTableModel, RowFilterModel
+
+# Typed one character at a time; every prefix is a search, like SearchPage.on_search
+QUERIES = [
+    'chopin nocturne',
+    'beethoven sonata op 27',
+    'schubrt impromptu',
+    'frederic chopin ballade',
+    'liszt year:2015',
+    'bach split:test duration<5m',
+    'rachmaninoff prelude duration:60..300',
+]
+
+# Cells in a screenful of the table, and screenfuls scrolled through
+VIEW_ROWS = 40
+SCROLL_PAGES = 200
+
+# Performances played at once by the mixer benchmark
+MIXER_STREAMS = 4
+
+# Run in a fresh interpreter for start-up times: imports, catalog load and search indexes
+START_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+from catalog import Catalog
+from query import FilterIndex
+from search_index import SearchIndex
+df = Catalog(sys.argv[1]).df
+SearchIndex(df)
+FilterIndex(df)
+print(time.perf_counter() - start)
+"""
+
+
+def percentiles(samples):
+    """Summary of a list of durations in seconds, in milliseconds."""
+    if not samples:
+        return {'count': 0}
+    ordered = np.sort(np.asarray(samples)) * 1000
+    return {
+        'count': len(ordered),
+        'mean_ms': float(ordered.mean()),
+        'p50_ms': float(np.percentile(ordered, 50)),
+        'p90_ms': float(np.percentile(ordered, 90)),
+        'p99_ms': float(np.percentile(ordered, 99)),
+        'max_ms': float(ordered[-1]),
+    }
+
+
+def scaled_catalog(metadata, scale, directory):
+    """Write the catalog repeated scale times to directory, with every copy's titles and files told apart."""
+    df = pd.read_csv(metadata)
+    if scale == 1:
+        path = os.path.join(directory, 'catalog-1x.csv')
+        df.to_csv(path, index=False)
+        return path
+    copies = []
+    for copy in range(scale):
+        part = df.copy()
+        if copy:
+            part['canonical_title'] = part['canonical_title'] + f' ({copy})'
+            for column in ('midi_filename', 'audio_filename'):
+                part[column] = part[column].str.replace('/', f'/copy{copy}-', n=1, regex=False)
+        copies.append(part)
+    path = os.path.join(directory, f'catalog-{scale}x.csv')
+    pd.concat(copies, ignore_index=True).to_csv(path, index=False)
+    return path
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def bench_start(path, cache_dir, repeat=3):
+    """Seconds from a fresh interpreter to a searchable catalog, with an empty and a filled cache,
+    and from starting main.py to its window being painted and its catalog loaded."""
+    env = dict(os.environ, PIANO_PLAYLIST_CACHE=cache_dir)
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def run():
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', START_SCRIPT, path], cwd=here, env=env,
+                                check=True, capture_output=True, text=True).stdout
+        return time.perf_counter() - start, float(output.split()[-1])
+
+    def run_window():
+        # main.py itself, drawing offscreen: (first paint, catalog ready) in seconds
+        output = subprocess.run([sys.executable, 'main.py', path, '--startup-time'], cwd=here,
+                                env=dict(env, QT_QPA_PLATFORM='offscreen'),
+                                check=True, capture_output=True, text=True).stdout
+        first_paint, ready = output.split()[-2:]
+        return float(first_paint), float(ready)
+
+    cold, warm, window = [], [], []
+    for _ in range(repeat):
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        cold.append(run())
+        warm.append(run())
+        window.append(run_window())
+    return {
+        'read_csv_s': min(timed(pd.read_csv, path)[0] for _ in range(repeat)),
+        'cold_process_s': min(total for total, _ in cold),
+        'cold_load_s': min(load for _, load in cold),
+        'warm_process_s': min(total for total, _ in warm),
+        'warm_load_s': min(load for _, load in warm),
+        'first_paint_s': min(first_paint for first_paint, _ in window),
+        'window_catalog_ready_s': min(ready for _, ready in window),
+    }
+
+
+def bench_search(df, queries=QUERIES):
+    """Index build time and the latency of every keystroke of every query."""
+    index_s, search_index = timed(SearchIndex, df)
+    filter_s, filter_index = timed(FilterIndex, df)
+    latencies = []
+    for query in queries:
+        for end in range(1, len(query) + 1):
+            start = time.perf_counter()
+            search_rows(search_index, filter_index, query[:end])
+            latencies.append(time.perf_counter() - start)
+    return {'search_index_s': index_s, 'filter_index_s': filter_s, 'keystroke': percentiles(latencies)}
+
+
+def bench_model(df):
+    """data() calls per second while scrolling (formatting cells) and repainting (cached cells)."""
+    build_s, model = timed(PandasTableModel, df)
+    columns = model.columnCount()
+    role = Qt.ItemDataRole.DisplayRole
+    rows = min(model.total_rows(), VIEW_ROWS * SCROLL_PAGES)
+    model._loaded_rows = model.total_rows()  # as if the view had fetched them all
+
+    start = time.perf_counter()
+    cells = 0
+    for top in range(0, rows, VIEW_ROWS):
+        for row in range(top, min(top + VIEW_ROWS, rows)):
+            for column in range(columns):
+                model.data(model.index(row, column), role)
+                cells += 1
+    scroll_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    repaints = 0
+    for _ in range(SCROLL_PAGES):
+        for row in range(min(VIEW_ROWS, rows)):
+            for column in range(columns):
+                model.data(model.index(row, column), role)
+                repaints += 1
+    repaint_s = time.perf_counter() - start
+
+    proxy = RowFilterModel(model)
+    sorts = {}
+    for name in ('canonical_title', 'duration'):
+        if name in df.columns:
+            column = list(df.columns).index(name)
+            sorts[f'sort_{name}_s'] = timed(proxy.sort, column, Qt.SortOrder.AscendingOrder)[0]
+    return {'build_s': build_s, 'scroll_cells_per_s': cells / scroll_s,
+            'repaint_cells_per_s': repaints / repaint_s, **sorts}
+
+
+def midi_files(metadata, dataset_path, limit):
+    index = DatasetIndex(dataset_path, catalog_filenames(pd.read_csv(metadata)))
+    infos = [index.lookup(name) for name in index.filenames if name.endswith(('.mid', '.midi'))]
+    return [info for info in infos if info is not None][:limit]
+
+
+def bench_midi(files):
+    """mido parsing speed over real files, in MB of MIDI per second."""
+    total_bytes = 0
+    seconds = 0.0
+    events = 0
+    for info in files:
+        elapsed, decoded = timed(decode_midi, info.path)
+        total_bytes += info.size
+        seconds += elapsed
+        events += len(decoded)
+    if not seconds:
+        return {'files': 0}
+    return {'files': len(files), 'mb_per_s': total_bytes / seconds / 1e6, 'events_per_s': events / seconds}
+
+
+class _NullPort:
+    # Accepts messages and drops them, so the scheduler can be timed without a synthesizer
+
+    def send(self, msg):
+        pass
+
+    def close(self):
+        pass
+
+
+class _NullBackend:
+    def __init__(self):
+        self._port = _NullPort()
+
+    def port(self):
+        return self._port
+
+
+def bench_playback(events, seconds):
+    """How late the scheduler sends messages while playing the densest stretch of a piece."""
+    times = events['time']
+    notes = times[events['kind'] == NOTE_ON]
+    start = 0.0
+    if len(notes):
+        # Start where the most notes fall within the window
+        counts = np.searchsorted(notes, notes + seconds) - np.arange(len(notes))
+        start = float(notes[int(np.argmax(counts))])
+    window = events[(times >= start) & (times < start + seconds)].copy()
+    window['time'] -= start
+    engine = PlaybackEngine(_NullBackend())
+    engine.play(window)
+    # The engine reports 'stopped' again once the window has played out
+    deadline = time.perf_counter() + seconds + 5
+    time.sleep(0.1)
+    while engine.state != 'stopped' and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    summary = engine.jitter.summary()
+    engine.shutdown()
+    summary['start_latency_ms'] = (engine.start_latency or 0.0) * 1000
+    return summary
+
+
+def bench_mixer(performances, seconds):
+    """How late the mixer sends messages while playing several long performances at once, aligned."""
+    engine = MixerEngine(_NullBackend())
+    streams = engine.load([Stream(events) for events in performances])
+    # Let the seek indexes finish building, they would compete for the GIL
+    while any(stream.time_index is None for stream in streams):
+        time.sleep(0.05)
+    engine.seek(min(stream.duration for stream in streams) / 2)
+    engine.play()
+    time.sleep(seconds)
+    engine.pause()
+    summary = engine.jitter.summary()
+    engine.shutdown()
+    summary['streams'] = len(streams)
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{name}.'))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def compare(baseline, results):
+    """Print every metric next to the baseline's, with the change in percent."""
+    old, new = flatten(baseline['results']), flatten(results['results'])
+    print(f"{'metric':56} {'baseline':>12} {'now':>12} {'change':>8}")
+    for name in sorted(set(old) & set(new)):
+        change = f'{(new[name] - old[name]) / old[name] * 100:+.1f}%' if old[name] else ''
+        print(f'{name:56} {old[name]:12.4g} {new[name]:12.4g} {change:>8}')
+
+
+def run(metadata, dataset_path=None, scales=(1, 10, 100), midi_limit=20, playback_seconds=5.0, repeat=3):
+    dataset_path = dataset_path or os.path.dirname(os.path.abspath(metadata))
+    app = QCoreApplication.instance() or QCoreApplication([])  # the table models are QObjects
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix='piano-playlist-bench-')
+    try:
+        for scale in scales:
+            print(f"Catalog x{scale}...", file=sys.stderr)
+            path = scaled_catalog(metadata, scale, work_dir)
+            df = Catalog(path, cache_dir=os.path.join(work_dir, 'cache')).df
+            results[f'catalog_{scale}x'] = {
+                'rows': len(df),
+                'start': bench_start(path, os.path.join(work_dir, f'start-{scale}x'), repeat),
+                'search': bench_search(df),
+                'model': bench_model(df),
+            }
+        print("MIDI...", file=sys.stderr)
+        files = midi_files(metadata, dataset_path, midi_limit)
+        results['midi_parse'] = bench_midi(files)
+        if files and playback_seconds:
+            densest = max(files, key=lambda info: info.size)
+            results['playback'] = bench_playback(decode_midi(densest.path), playback_seconds)
+            longest = sorted(files, key=lambda info: info.size)[-MIXER_STREAMS:]
+            if len(longest) > 1:
+                results['mixer'] = bench_mixer([decode_midi(info.path) for info in longest], playback_seconds)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    del app
+    return {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time catalog loading, search, the table model, MIDI parsing "
+                                                 "and playback scheduling, without a window.")
+    parser.add_argument('metadata', help="path to maestro-v3.0.0.csv")
+    parser.add_argument('--dataset-path', help="folder holding the year folders (default: next to the CSV)")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100],
+                        help="catalog sizes to test, as multiples of the real one (default: 1 10 100)")
+    parser.add_argument('--midi-files', type=int, default=20, help="MIDI files to parse (default: 20)")
+    parser.add_argument('--playback-seconds', type=float, default=5.0,
+                        help="seconds of playback (and of the mixer) to time, 0 to skip (default: 5)")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per start-up time, the best is kept")
+    parser.add_argument('--output', help="write the results as JSON to this file (default: print them)")
+    parser.add_argument('--compare', help="results JSON of an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    results = run(args.metadata, args.dataset_path, args.scales, args.midi_files, args.playback_seconds,
+                  args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
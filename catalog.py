@@ -0,0 +1,135 @@
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from settings import CACHE_DIR  # Also imported from here by the other modules
+
+log = logging.getLogger(__name__)
+
+# Bump when the on-disk layout changes so old caches are rebuilt
+CACHE_VERSION = 1
+
+# Columns with few distinct values, stored as integer codes plus a category table
+CATEGORICAL_COLUMNS = ('canonical_composer', 'canonical_title', 'split', 'year')
+
+_catalogs = {}
+
+
+def file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+class Catalog:
+    """The metadata CSV as a DataFrame, backed by a columnar cache on disk.
+
+    Every column is saved as its own .npy file. Text columns are stored as
+    integer codes plus a table of distinct values, so loading is a memory map
+    of the code arrays and a small read of the categories.
+    """
+
+    def __init__(self, path, cache_dir=None):
+        self.path = os.path.abspath(path)
+        key = hashlib.sha1(self.path.encode('utf-8')).hexdigest()[:16]
+        self.cache_dir = os.path.join(cache_dir or CACHE_DIR, 'catalog', key)
+        self.df = self._load()
+
+    def _stat(self):
+        stat = os.stat(self.path)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def _read_meta(self):
+        try:
+            with open(os.path.join(self.cache_dir, 'meta.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if meta.get('version') == CACHE_VERSION else None
+
+    def _load(self):
+        stat = self._stat()
+        meta = self._read_meta()
+        if meta is not None:
+            try:
+                if meta['source'] == stat:
+                    return self._load_cache(meta)
+                # Touched but not edited: the hash still matches, keep the cache
+                if meta['sha1'] == file_hash(self.path):
+                    meta['source'] = stat
+                    self._write_meta(meta)
+                    return self._load_cache(meta)
+            except (OSError, ValueError) as e:
+                log.info("Rebuilding catalog cache: %s", e)
+
+        df = pd.read_csv(self.path)
+        try:
+            self._write_cache(df, stat)
+        except OSError as e:
+            log.warning("Could not write catalog cache: %s", e)
+            return df
+        return self._load_cache(self._read_meta())
+
+    def _column_path(self, index, suffix):
+        return os.path.join(self.cache_dir, f'{index}.{suffix}.npy')
+
+    def _load_cache(self, meta):
+        columns = {}
+        for index, column in enumerate(meta['columns']):
+            # mmap_mode='r' maps the file instead of reading it
+            values = np.load(self._column_path(index, 'values'), mmap_mode='r')
+            if column['categorical']:
+                categories = np.load(self._column_path(index, 'categories'), allow_pickle=False)
+                if categories.dtype.kind == 'U':
+                    categories = categories.astype(object)
+                values = pd.Categorical.from_codes(values, categories=pd.Index(categories))
+            columns[column['name']] = values
+        return pd.DataFrame(columns, copy=False)
+
+    def _write_cache(self, df, stat):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        meta_path = os.path.join(self.cache_dir, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        columns = []
+        for index, name in enumerate(df.columns):
+            series = df[name]
+            categorical = name in CATEGORICAL_COLUMNS or not pd.api.types.is_numeric_dtype(series)
+            if categorical:
+                codes, categories = pd.factorize(series, sort=True)
+                if categories.dtype.kind in 'iuf':
+                    categories = np.asarray(categories)
+                else:
+                    categories = np.asarray(categories.astype(str), dtype=str)
+                np.save(self._column_path(index, 'categories'), categories)
+                # int32 codes are plenty even for million-row catalogs
+                np.save(self._column_path(index, 'values'), codes.astype(np.int32))
+            else:
+                np.save(self._column_path(index, 'values'), series.to_numpy())
+            columns.append({'name': name, 'categorical': categorical})
+
+        # meta.json is written last, so a half-written cache is never picked up
+        self._write_meta({'version': CACHE_VERSION, 'source': stat,
+                          'sha1': file_hash(self.path), 'columns': columns})
+
+    def _write_meta(self, meta):
+        path = os.path.join(self.cache_dir, 'meta.json')
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, path)
+
+
+def load_catalog(path):
+    """Return the shared Catalog for this CSV, loading it on first use."""
+    key = os.path.abspath(path)
+    catalog = _catalogs.get(key)
+    if catalog is None:
+        catalog = _catalogs[key] = Catalog(path)
+    return catalog
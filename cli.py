@@ -0,0 +1,159 @@
+"""Search, export, render and play the catalog from the command line, without the GUI.
+
+    python3 cli.py search "chopin nocturne year:2015"
+    python3 cli.py export "split:test duration<5m" test_short.csv
+    python3 cli.py render wav --split test
+    python3 cli.py play "schubert impromptu" --port "FluidSynth"
+
+Every command imports what it needs when it runs (PyQt6 never), so a
+command that only plays a MIDI file does not pay for pandas.
+"""
+import argparse
+import logging
+import os
+import sys
+
+# The catalog used when --catalog is not given
+DEFAULT_CATALOG = os.environ.get('PIANO_PLAYLIST_CATALOG', 'maestro-v3.0.0.csv')
+
+# Columns printed by search unless --columns is given
+SEARCH_COLUMNS = ['canonical_composer', 'canonical_title', 'year', 'split', 'duration']
+
+
+def open_library(args):
+    from library import Library
+    return Library(args.catalog, args.dataset_path)
+
+
+def search(args):
+    library = open_library(args)
+    df = library.find(args.query)
+    columns = args.columns.split(',') if args.columns else [c for c in SEARCH_COLUMNS if c in df.columns]
+    shown = df[columns].head(args.limit) if args.limit else df[columns]
+    if args.json:
+        print(shown.to_json(orient='records', indent=2, force_ascii=False))
+    else:
+        print(shown.to_string(index=False))
+        print(f"{len(df)} of {len(library.df)} pieces")
+
+
+def export(args):
+    library = open_library(args)
+    df = library.find(args.query)
+    library.export(df, args.output)
+    print(f"Wrote {len(df)} pieces to {args.output}")
+
+
+def render(args):
+    from play import render_batch, render_rows
+    if args.query:
+        library = open_library(args)
+        render_rows(library.find(args.query), args.output_dir, library.dataset_path, args.jobs,
+                    args.sound_font, args.sample_rate)
+    else:
+        render_batch(args.catalog, args.output_dir, args.dataset_path, args.split, args.year, args.composer,
+                     args.jobs, args.sound_font, args.sample_rate)
+
+
+def play(args):
+    import threading
+
+    import mido
+    if args.list_ports:
+        print("\n".join(mido.get_output_names()))
+        return 0
+    if not args.target:
+        print("Give a MIDI file or a search to play", file=sys.stderr)
+        return 2
+
+    title = args.target
+    path = args.target if os.path.isfile(args.target) else None
+    if path is None:
+        library = open_library(args)
+        for midi_filename, piece in library.titles(library.find(args.target)).items():
+            path = library.midi_path(midi_filename)
+            if path is not None:
+                title = piece
+                break
+        else:
+            print(f"Nothing to play for {args.target!r}", file=sys.stderr)
+            return 1
+
+    from midi_cache import load_midi
+    from playback import PlaybackEngine
+    events = load_midi(path)
+    stopped = threading.Event()
+    engine = PlaybackEngine(port_name=args.port,
+                            on_state=lambda state: state == 'stopped' and stopped.set())
+    print(f"Playing {title} ({format_duration(events)})")
+    engine.play(events)
+    if args.start:
+        engine.seek(args.start)
+    try:
+        while not stopped.wait(0.2):
+            pass
+    except KeyboardInterrupt:
+        engine.stop()
+    finally:
+        engine.shutdown()
+    return 0
+
+
+def format_duration(events):
+    seconds = int(events['time'][-1]) if len(events) else 0
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def features(args):
+    from features import extract_features
+    extract_features(args.catalog, args.dataset_path, args.jobs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search, export, render and play the MAESTRO catalog.")
+    parser.add_argument('--catalog', default=DEFAULT_CATALOG,
+                        help=f"metadata CSV (default: $PIANO_PLAYLIST_CATALOG or {DEFAULT_CATALOG})")
+    parser.add_argument('--dataset-path', help="folder holding the year folders (default: next to the CSV)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('search', help="print the pieces matching a search, best first")
+    command.add_argument('query', nargs='?', default='', help='e.g. "chopin year:2015 duration<5m"')
+    command.add_argument('--limit', type=int, default=20, help="rows to print, 0 for all (default: 20)")
+    command.add_argument('--columns', help="comma-separated columns to print")
+    command.add_argument('--json', action='store_true', help="print JSON records instead of a table")
+    command.set_defaults(run=search)
+
+    command = commands.add_parser('export', help="write the pieces matching a search to a file")
+    command.add_argument('query')
+    command.add_argument('output', help="file to write: .csv, .json or .m3u (a playlist of the MIDI files)")
+    command.set_defaults(run=export)
+
+    command = commands.add_parser('render', help="render MIDI files to WAV with FluidSynth")
+    command.add_argument('output_dir')
+    command.add_argument('--query', help="render the pieces matching this search")
+    command.add_argument('--split', choices=['train', 'validation', 'test'])
+    command.add_argument('--year', type=int)
+    command.add_argument('--composer', help="substring of canonical_composer")
+    command.add_argument('--jobs', type=int, help="worker processes (default: CPU count)")
+    command.add_argument('--sound-font', help="SoundFont (.sf2) to render with")
+    command.add_argument('--sample-rate', type=int, default=44100)
+    command.set_defaults(run=render)
+
+    command = commands.add_parser('play', help="play a MIDI file, or the best match of a search, to a MIDI port")
+    command.add_argument('target', nargs='?', help="MIDI file or search")
+    command.add_argument('--port', help="MIDI output port (default: the system's default)")
+    command.add_argument('--start', type=float, help="seconds into the piece to start at")
+    command.add_argument('--list-ports', action='store_true', help="list the MIDI output ports and exit")
+    command.set_defaults(run=play)
+
+    command = commands.add_parser('features', help="compute the MIDI feature columns (see features.py)")
+    command.add_argument('--jobs', type=int, help="worker processes (default: CPU count, 1 works in this process)")
+    command.set_defaults(run=features)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    return args.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+import logging
+import threading
+
+import mido
+from PyQt6.QtCore import QObject, Qt, pyqtSignal
+from PyQt6.QtWidgets import (QCheckBox, QComboBox, QGridLayout, QHBoxLayout, QLabel, QPushButton, QSlider,
+                             QVBoxLayout, QWidget)
+
+from midi_cache import load_midi
+from mixer import STREAM_CHANNELS, MixerEngine, Stream
+from music_page import format_time
+
+log = logging.getLogger(__name__)
+
+# Choices of the Align box: (label, align argument of MixerEngine.load)
+ALIGN_CHOICES = [("Note by note", 'notes'), ("Overall tempo", 'duration'), ("As played", None)]
+
+
+class MixerSignals(QObject):
+    # The mixer and the loading thread call these from their threads, Qt queues them to the GUI
+    positionChanged = pyqtSignal(float)
+    stateChanged = pyqtSignal(str)
+    loaded = pyqtSignal(int, list, list)  # generation, items, decoded events
+
+
+class ComparePage(QWidget):
+    """Several performances of a piece playing together, in sync, for A/B listening.
+
+    Every performance is put on the first one's timeline (see
+    mixer.tempo_anchors), so at any moment they are at the same place in the
+    music; Solo flips to one of them without a gap. Each one has its own
+    mute, level and output port.
+    """
+
+    def __init__(self, audio_backend=None):
+        super().__init__()
+        self.items = []  # {'midi', 'title'} of each performance, in stream order
+        self.events = []  # Their decoded events, as loaded
+        self.generation = 0  # Bumped by every compare(), stale loads are dropped
+        self.duration = 0.0
+        self.signals = MixerSignals()
+        self.engine = MixerEngine(audio_backend,
+                                  on_position=self.signals.positionChanged.emit,
+                                  on_state=self.signals.stateChanged.emit)
+        self.initUI()
+        self.signals.positionChanged.connect(self.updatePosition)
+        self.signals.stateChanged.connect(self.updateState)
+        self.signals.loaded.connect(self.on_loaded)
+
+    def initUI(self):
+        layout = QVBoxLayout(self)
+
+        self.title_label = QLabel("Select performances on the Search page and press Compare Performances.")
+        self.title_label.setWordWrap(True)
+        layout.addWidget(self.title_label)
+
+        self.align_box = QComboBox()
+        for label, _ in ALIGN_CHOICES:
+            self.align_box.addItem(label)
+        self.align_box.currentIndexChanged.connect(self.realign)
+        align_hbox = QHBoxLayout()
+        align_hbox.addWidget(QLabel("Align:"))
+        align_hbox.addWidget(self.align_box, 1)
+        layout.addLayout(align_hbox)
+
+        # One row per performance, rebuilt by on_loaded
+        self.stream_grid = QGridLayout()
+        layout.addLayout(self.stream_grid)
+        self.stream_widgets = []
+
+        self.position_slider = QSlider(Qt.Orientation.Horizontal)
+        self.position_slider.sliderReleased.connect(
+            lambda: self.engine.seek(self.position_slider.value() / 1000))
+        self.position_label = QLabel('0:00 / 0:00')
+        position_hbox = QHBoxLayout()
+        position_hbox.addWidget(self.position_slider)
+        position_hbox.addWidget(self.position_label)
+        layout.addLayout(position_hbox)
+
+        self.playButton = QPushButton("Play")
+        self.playButton.clicked.connect(self.engine.play)
+        self.pauseButton = QPushButton("Pause")
+        self.pauseButton.clicked.connect(self.engine.pause)
+        self.stopButton = QPushButton("Stop")
+        self.stopButton.clicked.connect(self.engine.stop)
+        hbox = QHBoxLayout()
+        hbox.addWidget(self.playButton)
+        hbox.addWidget(self.pauseButton)
+        hbox.addWidget(self.stopButton)
+        layout.addLayout(hbox)
+        layout.addStretch(1)
+
+    def compare(self, items):
+        """Load playlist-style items ({'midi', 'title'}) to play side by side."""
+        if len(items) > len(STREAM_CHANNELS):
+            log.warning("Comparing the first %d of %d performances", len(STREAM_CHANNELS), len(items))
+            items = items[:len(STREAM_CHANNELS)]
+        self.generation += 1
+        self.title_label.setText(f"Loading {len(items)} performances...")
+        # Decoding several long files takes a while the first time, keep it off the GUI thread
+        threading.Thread(target=self._load, args=(self.generation, items), daemon=True).start()
+
+    def _load(self, generation, items):
+        loaded, events = [], []
+        for item in items:
+            try:
+                events.append(load_midi(item['midi']))
+                loaded.append(item)
+            except Exception as e:
+                log.error("Error loading MIDI file: %s", e)
+        self.signals.loaded.emit(generation, loaded, events)
+
+    def on_loaded(self, generation, items, events):
+        if generation != self.generation:
+            return
+        self.items = items
+        self.events = events
+        self.title_label.setText("\n".join(f"{label}: {item['title']}" for label, item in
+                                           zip(stream_labels(len(items)), items)) or "Nothing to compare.")
+        self.build_stream_rows()
+        self.load_streams(0.0)
+
+    def load_streams(self, position):
+        align = ALIGN_CHOICES[self.align_box.currentIndex()][1]
+        previous = {number: widgets for number, widgets in enumerate(self.stream_widgets)}
+        streams = []
+        for number, events in enumerate(self.events):
+            stream = Stream(events, name=self.items[number]['title'])
+            widgets = previous.get(number)
+            if widgets is not None:
+                # Realigning keeps each performance's mute, level and port
+                stream.muted = widgets['mute'].isChecked()
+                stream.gain = widgets['gain'].value() / 100
+                stream.port = widgets['port'].currentData()
+            streams.append(stream)
+        streams = self.engine.load(streams, align=align, position=position)
+        self.duration = max((stream.duration for stream in streams), default=0.0)
+        self.position_slider.setRange(0, int(self.duration * 1000))
+        self.updatePosition(position)
+
+    def realign(self):
+        if self.events:
+            playing = self.engine.state == 'playing'
+            self.load_streams(self.engine.position())
+            if playing:
+                self.engine.play()
+
+    def build_stream_rows(self):
+        while self.stream_grid.count():
+            item = self.stream_grid.takeAt(0)
+            if item.widget() is not None:
+                item.widget().deleteLater()
+        try:
+            port_names = mido.get_output_names()
+        except Exception as e:
+            log.error("Could not list the MIDI output ports: %s", e)
+            port_names = []
+        self.stream_widgets = []
+        for number, label in enumerate(stream_labels(len(self.items))):
+            solo = QPushButton(f"Solo {label}")
+            solo.clicked.connect(lambda checked, number=number: self.solo(number))
+            mute = QCheckBox("Mute")
+            mute.toggled.connect(lambda muted, number=number: self.engine.set_muted(number, muted))
+            gain = QSlider(Qt.Orientation.Horizontal)
+            gain.setRange(0, 100)
+            gain.setValue(100)
+            gain.valueChanged.connect(lambda value, number=number: self.engine.set_gain(number, value / 100))
+            port = QComboBox()
+            port.addItem("Default output", None)
+            for name in port_names:
+                port.addItem(name, name)
+            port.currentIndexChanged.connect(
+                lambda index, number=number, port=port: self.engine.set_port(number, port.itemData(index)))
+            for column, widget in enumerate([solo, mute, gain, port]):
+                self.stream_grid.addWidget(widget, number, column)
+            self.stream_widgets.append({'mute': mute, 'gain': gain, 'port': port})
+
+    def solo(self, number):
+        # The mute boxes follow, without each sending its own command
+        self.engine.solo(number)
+        for other, widgets in enumerate(self.stream_widgets):
+            widgets['mute'].blockSignals(True)
+            widgets['mute'].setChecked(other != number)
+            widgets['mute'].blockSignals(False)
+
+    def updatePosition(self, seconds):
+        if not self.position_slider.isSliderDown():
+            self.position_slider.setValue(int(seconds * 1000))
+        self.position_label.setText(f'{format_time(seconds)} / {format_time(self.duration)}')
+
+    def updateState(self, state):
+        self.pauseButton.setEnabled(state == 'playing')
+
+    def shutdown(self):
+        self.engine.shutdown()
+
+
+def stream_labels(count):
+    # A, B, C, ... for the performances, in stream order
+    return [chr(ord('A') + number) for number in range(count)]
@@ -0,0 +1,93 @@
+from PyQt6.QtCore import QObject, QThread, pyqtSignal
+
+from csv_store import load_csv
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class CsvLoader(QObject):
+    """Reads a CSV into a CsvStore on a background thread.
+
+    progress(store, rows, bytes read, file size) is emitted after every chunk
+    so the page can show rows as they arrive, then finished(store) or
+    failed(message). Loading another file cancels the one in progress.
+    """
+
+    progress = pyqtSignal(object, int, int, int)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    _requested = pyqtSignal(int, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.generation = 0
+        self._thread = QThread()
+        self._runner = _Runner(self)
+        self._runner.moveToThread(self._thread)
+        self._requested.connect(self._runner.run)
+        self._runner.progress.connect(self._on_progress)
+        self._runner.finished.connect(self._on_finished)
+        self._runner.failed.connect(self._on_failed)
+        self._thread.start()
+
+    def load(self, path):
+        self.generation += 1
+        self._requested.emit(self.generation, path)
+
+    def cancel(self):
+        self.generation += 1
+
+    def is_current(self, generation):
+        return generation == self.generation
+
+    def _on_progress(self, generation, store, rows, done, total):
+        if self.is_current(generation):
+            self.progress.emit(store, rows, done, total)
+
+    def _on_finished(self, generation, store):
+        if self.is_current(generation):
+            self.finished.emit(store)
+        else:
+            store.close()  # Finished just as another file was opened
+
+    def _on_failed(self, generation, message):
+        if self.is_current(generation):
+            self.failed.emit(message)
+
+    def shutdown(self):
+        self.cancel()
+        self._thread.quit()
+        self._thread.wait()
+
+
+class _Runner(QObject):
+    progress = pyqtSignal(int, object, int, int, int)
+    finished = pyqtSignal(int, object)
+    failed = pyqtSignal(int, str)
+
+    def __init__(self, loader):
+        super().__init__()
+        self._loader = loader
+
+    def run(self, generation, path):
+        loader = self._loader
+        if not loader.is_current(generation):
+            return
+
+        def check():
+            if not loader.is_current(generation):
+                raise _Cancelled()
+
+        store = None
+        try:
+            for store, done, total in load_csv(path, check=check):
+                if not store.finished:
+                    self.progress.emit(generation, store, store.rows, done, total)
+        except _Cancelled:
+            return  # load_csv has removed the store's files
+        except Exception as e:
+            self.failed.emit(generation, f"Could not load {path}: {e}")
+            return
+        self.finished.emit(generation, store)
@@ -0,0 +1,117 @@
+import os
+
+from PyQt6.QtCore import Qt
+from PyQt6.QtWidgets import QFileDialog, QLabel, QLineEdit, QProgressBar, QPushButton, QTableView, QVBoxLayout, QWidget
+
+from csv_loader import CsvLoader
+from search_index import scan_frames
+from search_worker import SearchWorker
+from table_model import RowFilterModel, StoreTableModel, resize_columns_from_sample
+
+
+class CSVPage(QWidget):
+    def __init__(self):
+        super().__init__()
+        layout = QVBoxLayout(self)
+        
+        self.open_csv_button = QPushButton("Open CSV")
+        self.open_csv_button.clicked.connect(self.openFileDialog)
+
+        # Files load in the background, a chunk at a time; rows show up as they arrive
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.hide()
+        self.status_label = QLabel()
+        self.loader = CsvLoader(parent=self)
+        self.loader.progress.connect(self.on_chunk_loaded)
+        self.loader.finished.connect(self.on_load_finished)
+        self.loader.failed.connect(self.on_load_failed)
+
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Search...")
+        self.search_input.textChanged.connect(self.on_search)
+
+        self.table_view = QTableView()
+        self.store = None
+        self.source_model = None
+        self.proxy_model = None
+        # No index here: files can have millions of rows, so the search scans
+        # them in chunks on a background thread and is cut short by the next keystroke
+        self.search_worker = SearchWorker(parent=self)
+        self.search_worker.finished.connect(self.on_search_finished)
+
+        layout.addWidget(self.open_csv_button)
+        layout.addWidget(self.progress_bar)
+        layout.addWidget(self.status_label)
+        layout.addWidget(self.search_input)
+        layout.addWidget(self.table_view)
+        
+    def openFileDialog(self):
+        filePath, _ = QFileDialog.getOpenFileName(self, "Open CSV", "", "CSV Files (*.csv)")
+        if filePath:
+            self.loadCsv(filePath)
+    
+    def loadCsv(self, filePath):
+        self.search_worker.cancel()
+        self.close_store()
+        self.table_view.setModel(None)
+        self.progress_bar.setValue(0)
+        self.progress_bar.show()
+        self.status_label.setText(f"Loading {os.path.basename(filePath)}...")
+        self.loader.load(filePath)
+
+    def on_chunk_loaded(self, store, rows, bytes_read, bytes_total):
+        if store is not self.store:
+            # First chunk of a new file: show it straight away
+            self.store = store
+            self.source_model = StoreTableModel(store)
+            self.proxy_model = RowFilterModel(self.source_model)
+            self.table_view.setSortingEnabled(False)  # Sorting waits for the whole file
+            self.table_view.setModel(self.proxy_model)
+            resize_columns_from_sample(self.table_view, self.proxy_model)
+        else:
+            self.source_model.refresh()
+            self.proxy_model.source_grew()
+        self.progress_bar.setValue(int(100 * bytes_read / max(bytes_total, 1)))
+        self.status_label.setText(f"Loaded {rows:,} rows...")
+
+    def on_load_finished(self, store):
+        if store is not self.store:
+            self.on_chunk_loaded(store, store.rows, 1, 1)
+        self.source_model.refresh()
+        self.proxy_model.source_grew()
+        self.progress_bar.hide()
+        where = " (columns kept on disk)" if store.spill_dir else ""
+        self.status_label.setText(f"{store.rows:,} rows{where}")
+        self.table_view.horizontalHeader().setSortIndicator(-1, Qt.SortOrder.AscendingOrder)
+        self.table_view.setSortingEnabled(True)
+        self.on_search(self.search_input.text())
+
+    def on_load_failed(self, message):
+        self.progress_bar.hide()
+        self.status_label.setText(message)
+
+    def on_search(self, text):
+        if self.store is None:
+            return
+        if not text:
+            self.search_worker.cancel()
+            self.proxy_model.set_rows(None)
+            return
+        # While loading, this searches the rows read so far
+        self.search_worker.submit(scan_frames, self.store.frames(), text)
+
+    def on_search_finished(self, generation, rows):
+        self.proxy_model.set_rows(rows)
+
+    def close_store(self):
+        # A store still loading is cleaned up by the loader once it notices the cancel
+        self.loader.cancel()
+        if self.store is not None and self.store.finished:
+            self.store.close()
+        self.store = None
+
+    def shutdown(self):
+        self.search_worker.shutdown()
+        self.loader.shutdown()
+        self.close_store()
@@ -0,0 +1,358 @@
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+from catalog import CACHE_DIR
+
+# Rows read to decide each column's type, and rows parsed per chunk after that
+SAMPLE_ROWS = 10000
+CHUNK_ROWS = 100000
+
+# A text column whose sample has at most this share of distinct values is
+# stored as integer codes plus a table of labels
+CATEGORY_RATIO = 0.5
+
+# Block size when rewriting a spilled column
+COPY_ROWS = 1 << 20
+
+
+def physical_memory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None  # not available on this platform
+
+
+def should_spill(path):
+    """True if the CSV is big enough that its columns should live on disk."""
+    memory = physical_memory()
+    return memory is not None and os.path.getsize(path) > memory // 4
+
+
+def infer_dtypes(path, sample_rows=SAMPLE_ROWS):
+    """{column: kind} from the first sample_rows rows.
+
+    kind is the smallest NumPy dtype holding the sample for numeric columns,
+    'category' for repetitive text and 'text' for everything else.
+    """
+    sample = pd.read_csv(path, nrows=sample_rows)
+    dtypes = {}
+    for name in sample.columns:
+        series = sample[name]
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            if pd.api.types.is_integer_dtype(series):
+                dtypes[name] = pd.to_numeric(series, downcast='integer').dtype
+            else:
+                dtypes[name] = np.dtype(np.float64)
+        elif series.nunique() <= len(series) * CATEGORY_RATIO:
+            dtypes[name] = 'category'
+        else:
+            dtypes[name] = 'text'
+    return dtypes
+
+
+def read_chunks(path, dtypes, chunk_rows=CHUNK_ROWS):
+    """Yield (DataFrame chunk, bytes read so far) for the whole file."""
+    text_columns = {name: str for name, kind in dtypes.items() if isinstance(kind, str)}
+    with open(path, 'rb') as f:
+        for chunk in pd.read_csv(f, chunksize=chunk_rows, dtype=text_columns):
+            yield chunk, f.tell()
+
+
+class _Buffer:
+    # A growing 1-D array: in memory, or appended to a raw file and memory-mapped.
+    # The array is replaced, never changed in place, so views handed out stay valid.
+
+    def __init__(self, dtype, path=None):
+        self.dtype = np.dtype(dtype)
+        self.path = path
+        self.size = 0
+        self._array = np.empty(0, dtype=self.dtype)
+        self._view = None
+        self._version = 0
+        # The loader thread widens the array while the GUI thread reads it
+        self._lock = threading.Lock()
+        if path is not None:
+            open(path, 'wb').close()
+
+    def append(self, values):
+        values = np.asarray(values)
+        dtype = np.result_type(self.dtype, values.dtype)
+        if dtype != self.dtype:
+            # A value the sample did not prepare for, e.g. a NaN in an int column
+            self.map(lambda block: block.astype(dtype), dtype)
+        values = values.astype(self.dtype, copy=False)
+        if self.path is None:
+            if self.size + len(values) > len(self._array):
+                grown = np.empty(max(2 * len(self._array), self.size + len(values)), dtype=self.dtype)
+                grown[:self.size] = self._array[:self.size]
+                self._array = grown
+            self._array[self.size:self.size + len(values)] = values
+        else:
+            with open(self.path, 'ab') as f:
+                f.write(values.tobytes())
+        self.size += len(values)
+        self._view = None
+
+    def map(self, function, dtype=None):
+        """Replace the contents with function(contents), a block at a time on disk."""
+        dtype = np.dtype(dtype or self.dtype)
+        old = self.array()
+        if self.path is None:
+            array, path = np.asarray(function(old), dtype=dtype), None
+        else:
+            # Write a new file: a memory map of the old one may still be on screen
+            self._version += 1
+            array, path = np.empty(0, dtype=dtype), f'{self.path.rsplit(".", 1)[0]}.{self._version}'
+            with open(path, 'wb') as f:
+                for start in range(0, self.size, COPY_ROWS):
+                    f.write(np.asarray(function(old[start:start + COPY_ROWS]), dtype=dtype).tobytes())
+            os.remove(self.path)
+        with self._lock:
+            self._array, self.path, self.dtype = array, path, dtype
+            self._view = None
+
+    def array(self):
+        with self._lock:
+            view = self._view
+            if view is None:
+                if self.path is None or self.size == 0:
+                    view = self._array[:self.size]
+                else:
+                    view = np.memmap(self.path, dtype=self.dtype, mode='r', shape=(self.size,))
+                self._view = view
+            return view
+
+
+def _whole_numbers(values):
+    # Every value (NaN aside) an integer small enough to be exact as a float
+    values = values[~np.isnan(values)]
+    return bool(np.all((values == np.round(values)) & (np.abs(values) < 2 ** 53)))
+
+
+class _NumericColumn:
+    def __init__(self, dtype, path=None):
+        self.buffer = _Buffer(dtype, path and f'{path}.0')
+
+    @staticmethod
+    def parses(series):
+        # False if the chunk holds text the sample did not show, e.g. "n/a" or "12b"
+        if pd.api.types.is_numeric_dtype(series):
+            return True
+        return pd.to_numeric(series, errors='coerce').isna().sum() <= series.isna().sum()
+
+    def as_text(self, path=None):
+        """The rows so far as a category or text column (chosen like infer_dtypes), to carry on as text."""
+        array = self.buffer.array()
+        sample = pd.Series(array[:SAMPLE_ROWS])
+        column = _CategoryColumn(path) if sample.nunique() <= len(sample) * CATEGORY_RATIO else _TextColumn(path)
+        # An int column with gaps is parsed as float; its cells read 12, as in the file, not 12.0
+        blocks = [array[start:start + COPY_ROWS] for start in range(0, len(array), COPY_ROWS)]
+        whole = array.dtype.kind == 'f' and all(_whole_numbers(block) for block in blocks)
+        for block in blocks:
+            series = pd.Series(block)
+            if whole:
+                series = series.astype('Int64')
+            column.append(series.astype(str).where(series.notna(), 'nan'))
+        return column
+
+    def append(self, series):
+        values = pd.to_numeric(series, errors='coerce').to_numpy()
+        dtype = self.buffer.dtype
+        if values.dtype.kind in 'iu' and dtype.kind in 'iu' and len(values):
+            # pandas parses every int column as int64; keep the narrow type while values fit
+            info = np.iinfo(dtype)
+            if info.min <= values.min() and values.max() <= info.max:
+                values = values.astype(dtype)
+        self.buffer.append(values)
+
+    def values(self):
+        return self.buffer.array(), None
+
+    def frame_column(self, start, stop):
+        return self.buffer.array()[start:stop]
+
+
+class _CategoryColumn:
+    # Labels get codes in the order they are first seen, so earlier codes never
+    # change while the file loads (StoreTableModel sorts them by label instead)
+
+    def __init__(self, path=None):
+        self.codes = _Buffer(np.int32, path and f'{path}.0')
+        self.labels = []
+        self._lookup = {}
+        self._dtype = None
+
+    def append(self, series):
+        codes, uniques = pd.factorize(series)
+        mapping = np.empty(len(uniques) + 1, dtype=np.int32)
+        mapping[-1] = -1  # missing values keep code -1
+        for index, label in enumerate(uniques.astype(str)):
+            code = self._lookup.get(label)
+            if code is None:
+                code = self._lookup[label] = len(self.labels)
+                self.labels.append(label)
+            mapping[index] = code
+        self.codes.append(mapping[codes])
+
+    def values(self):
+        return self.codes.array(), self.labels + ['nan']
+
+    def frame_column(self, start, stop):
+        # One dtype for every frame, so searches can match each label once
+        dtype = self._dtype
+        if dtype is None or len(dtype.categories) != len(self.labels):
+            dtype = self._dtype = pd.CategoricalDtype(list(self.labels))
+        return pd.Categorical.from_codes(self.codes.array()[start:stop], dtype=dtype)
+
+
+class _TextColumn:
+    # Strings of a column with mostly distinct values. Held as a list in
+    # memory; on disk as one UTF-8 blob plus the offset where every row ends,
+    # so a cell is a slice of a memory map
+
+    def __init__(self, path=None):
+        self.path = path
+        self._strings = []
+        if path is not None:
+            self._ends = _Buffer(np.int64, f'{path}.ends')
+            self._blob_path = f'{path}.blob'
+            open(self._blob_path, 'wb').close()
+            self._blob_size = 0
+            self._blob = None
+
+    def __len__(self):
+        return len(self._strings) if self.path is None else self._ends.size
+
+    def __getitem__(self, row):
+        if self.path is None:
+            return self._strings[row]
+        ends = self._ends.array()
+        start = ends[row - 1] if row else 0
+        return bytes(self._blob_view()[start:ends[row]]).decode('utf-8')
+
+    def __array__(self, dtype=None, copy=None):
+        # Used when a column header is clicked to sort on this column
+        return np.array(self.frame_column(0, len(self)), dtype=object)
+
+    def _blob_view(self):
+        blob = self._blob
+        if not self._blob_size:
+            return np.empty(0, dtype=np.uint8)
+        if blob is None or len(blob) != self._blob_size:
+            blob = self._blob = np.memmap(self._blob_path, dtype=np.uint8, mode='r', shape=(self._blob_size,))
+        return blob
+
+    def append(self, series):
+        # Missing cells read as NaN, which astype(str) leaves a float
+        texts = series.where(series.notna(), 'nan').astype(str).tolist()
+        if self.path is None:
+            self._strings.extend(texts)
+            return
+        encoded = [text.encode('utf-8') for text in texts]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        with open(self._blob_path, 'ab') as f:
+            f.write(b''.join(encoded))
+        ends = self._blob_size + np.cumsum(lengths)
+        # Rows only become visible through _ends, after the bytes they point at
+        self._blob_size += int(lengths.sum())
+        self._ends.append(ends)
+
+    def values(self):
+        return self, None
+
+    def frame_column(self, start, stop):
+        if self.path is None:
+            return self._strings[start:stop]
+        # One read of the chunk's bytes, then split at the row ends
+        ends = self._ends.array()[start:stop].tolist()
+        first = int(self._ends.array()[start - 1]) if start else 0
+        data = bytes(self._blob_view()[first:ends[-1]]) if ends else b''
+        starts = [first] + ends[:-1]
+        return [data[begin - first:end - first].decode('utf-8') for begin, end in zip(starts, ends)]
+
+
+class CsvStore:
+    """A CSV file parsed into compact columns, filled a chunk at a time.
+
+    Numeric columns keep the dtype inferred from a sample (widened if a later
+    value needs it, turned into text if a later value is not a number),
+    repetitive text becomes integer codes, other text is kept as strings.
+    With spill=True every column is written to files under CACHE_DIR/csv and
+    read back through memory maps, so a file larger than RAM can still be
+    browsed; close() deletes them.
+    """
+
+    def __init__(self, dtypes, spill=False):
+        self.columns = list(dtypes)
+        self.rows = 0
+        self.finished = False
+        self.spill_dir = None
+        if spill:
+            os.makedirs(os.path.join(CACHE_DIR, 'csv'), exist_ok=True)
+            self.spill_dir = tempfile.mkdtemp(dir=os.path.join(CACHE_DIR, 'csv'))
+        self._columns = []
+        for index, name in enumerate(self.columns):
+            path = os.path.join(self.spill_dir, str(index)) if spill else None
+            kind = dtypes[name]
+            if kind == 'category':
+                self._columns.append(_CategoryColumn(path))
+            elif kind == 'text':
+                self._columns.append(_TextColumn(path))
+            else:
+                self._columns.append(_NumericColumn(kind, path))
+
+    def append(self, chunk):
+        for index, name in enumerate(self.columns):
+            column, series = self._columns[index], chunk[name]
+            if isinstance(column, _NumericColumn) and not column.parses(series):
+                # Swapped in whole: the GUI thread sees the old column or the full new one
+                path = os.path.join(self.spill_dir, f'{index}.text') if self.spill_dir is not None else None
+                column = self._columns[index] = column.as_text(path)
+            column.append(series)
+        self.rows += len(chunk)
+
+    def finish(self):
+        self.finished = True
+
+    def values(self, column):
+        """(values, labels) like table_model.column_values, for the rows loaded so far."""
+        return self._columns[column].values()
+
+    def frames(self, chunk_rows=CHUNK_ROWS):
+        """Yield (first row, DataFrame) for the rows loaded so far, chunk_rows at a time."""
+        rows = self.rows
+        for start in range(0, rows, chunk_rows):
+            stop = min(start + chunk_rows, rows)
+            yield start, pd.DataFrame({name: column.frame_column(start, stop)
+                                       for name, column in zip(self.columns, self._columns)})
+
+    def close(self):
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+
+
+def load_csv(path, spill=None, chunk_rows=CHUNK_ROWS, check=None):
+    """Read a CSV into a CsvStore, yielding (store, bytes read, file size) after every chunk."""
+    if spill is None:
+        spill = should_spill(path)
+    total = os.path.getsize(path)
+    dtypes = infer_dtypes(path)
+    store = CsvStore(dtypes, spill=spill)
+    try:
+        for chunk, done in read_chunks(path, dtypes, chunk_rows):
+            if check is not None:
+                check()
+            store.append(chunk)
+            yield store, done, total
+        store.finish()
+        yield store, total, total
+    except BaseException:
+        store.close()
+        raise
+
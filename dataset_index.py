@@ -0,0 +1,176 @@
+import copy
+import os
+import threading
+from collections import namedtuple
+
+from catalog import load_catalog
+
+FileInfo = namedtuple('FileInfo', ['path', 'size', 'mtime_ns'])
+
+_indexes = {}
+
+
+def catalog_filenames(df):
+    # Every file the catalog refers to, as written in the CSV (e.g. 2004/....midi)
+    names = []
+    for column in ('midi_filename', 'audio_filename'):
+        if column in df.columns:
+            names.extend(name for name in df[column] if isinstance(name, str))
+    return names
+
+
+class DatasetIndex:
+    """Where every file under the dataset folder is, with its size and mtime.
+
+    The folder tree (hidden folders aside) is walked once with os.scandir, so
+    looking a catalog entry up is a dict lookup instead of a stat. Every
+    folder's mtime is kept too: refresh() only lists again the folders whose
+    mtime changed, which is where files were added, removed or renamed.
+    Scans and refreshes hold a lock; a thread other than the one refreshing
+    reads a snapshot().
+    """
+
+    def __init__(self, root, filenames=()):
+        self.root = os.path.abspath(root)
+        self.filenames = list(dict.fromkeys(filenames))
+        self._catalogs = set()  # Metadata CSVs whose filenames are in self.filenames
+        self._files = {}  # 'year/name.midi' -> FileInfo
+        self._directories = {}  # 'year' -> mtime_ns ('' is the root)
+        self._lock = threading.Lock()
+        self.scan()
+
+    def scan(self):
+        with self._lock:
+            self._files = {}
+            self._directories = {}
+            self._scan_directory('')
+
+    def snapshot(self):
+        """A copy of the index as it is now, which later refreshes leave alone."""
+        with self._lock:
+            snapshot = copy.copy(self)
+            snapshot._files = dict(self._files)
+            snapshot._directories = dict(self._directories)
+            snapshot._catalogs = set(self._catalogs)
+        snapshot._lock = threading.Lock()
+        return snapshot
+
+    def _scan_directory(self, relative):
+        path = os.path.join(self.root, relative) if relative else self.root
+        try:
+            self._directories[relative] = os.stat(path).st_mtime_ns
+            entries = list(os.scandir(path))
+        except OSError:
+            self._directories.pop(relative, None)
+            return
+        for entry in entries:
+            name = f'{relative}/{entry.name}' if relative else entry.name
+            try:
+                if entry.is_dir():
+                    if not entry.name.startswith('.'):  # .git and the like
+                        self._scan_directory(name)
+                elif entry.is_file():
+                    # On Windows this stat comes with the directory listing
+                    stat = entry.stat()
+                    self._files[name] = FileInfo(entry.path, stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                continue
+
+    def _forget(self, relative):
+        # Drop the files of a folder (not its subfolders) before listing it again
+        prefix = f'{relative}/' if relative else ''
+        for name in [name for name in self._files if name.startswith(prefix) and '/' not in name[len(prefix):]]:
+            del self._files[name]
+
+    def refresh(self):
+        """List again the folders that changed since the last scan; returns how many did."""
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self):
+        changed = []
+        for relative, mtime_ns in list(self._directories.items()):
+            path = os.path.join(self.root, relative) if relative else self.root
+            try:
+                if os.stat(path).st_mtime_ns == mtime_ns:
+                    continue
+            except OSError:
+                pass
+            changed.append(relative)
+        for relative in changed:
+            if relative not in self._directories:
+                continue  # already rescanned as part of its parent
+            self._forget(relative)
+            path = os.path.join(self.root, relative) if relative else self.root
+            try:
+                self._directories[relative] = os.stat(path).st_mtime_ns
+                entries = list(os.scandir(path))
+            except OSError:
+                # The folder is gone, and everything in it
+                prefix = f'{relative}/' if relative else ''
+                for name in [name for name in self._files if name.startswith(prefix)]:
+                    del self._files[name]
+                for name in [name for name in self._directories if name == relative or name.startswith(prefix)]:
+                    del self._directories[name]
+                continue
+            for entry in entries:
+                name = f'{relative}/{entry.name}' if relative else entry.name
+                try:
+                    if entry.is_dir():
+                        if name not in self._directories and not entry.name.startswith('.'):
+                            self._scan_directory(name)  # new folder
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        self._files[name] = FileInfo(entry.path, stat.st_size, stat.st_mtime_ns)
+                except OSError:
+                    continue
+        return len(changed)
+
+    def directories(self):
+        """Full paths of every folder scanned, e.g. for a file system watcher."""
+        return [os.path.join(self.root, relative) if relative else self.root for relative in self._directories]
+
+    def lookup(self, filename):
+        """FileInfo for a catalog filename, or None if it is not on disk."""
+        return self._files.get(str(filename).replace('\\', '/'))
+
+    def path(self, filename):
+        info = self.lookup(filename)
+        return info.path if info is not None else None
+
+    def filename(self, path):
+        """The catalog filename (year/name.midi) of a path under the dataset folder, or None."""
+        relative = os.path.relpath(os.path.abspath(path), self.root)
+        if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+            return None
+        return relative.replace(os.sep, '/')
+
+    def midi_files(self):
+        """Filenames (year/name.midi) of every MIDI file on disk, in the catalog or not."""
+        return sorted(name for name in self._files if name.lower().endswith(('.mid', '.midi')))
+
+    def add_catalog(self, metadata):
+        """Include a metadata CSV's filenames in missing(); once per CSV."""
+        key = os.path.abspath(metadata)
+        if key not in self._catalogs:
+            self._catalogs.add(key)
+            self.filenames = list(dict.fromkeys(self.filenames + catalog_filenames(load_catalog(metadata).df)))
+
+    def missing(self):
+        """Catalog filenames with no file on disk."""
+        return [name for name in self.filenames if self.lookup(name) is None]
+
+
+def load_dataset_index(root, metadata=None):
+    """The shared DatasetIndex for this dataset folder, scanned on first use.
+
+    With the metadata CSV, missing() reports the catalog entries not found.
+    """
+    key = os.path.abspath(root)
+    index = _indexes.get(key)
+    if index is None:
+        index = _indexes[key] = DatasetIndex(root)
+    if metadata is not None:
+        # The folder is scanned once whoever asks first; a catalog given later still counts for missing()
+        index.add_catalog(metadata)
+    return index
@@ -0,0 +1,205 @@
+import logging
+import time
+
+from PyQt6.QtCore import QObject, QRectF, Qt, QTimer
+from PyQt6.QtGui import QPainter
+from PyQt6.QtWidgets import (QFileDialog, QHBoxLayout, QLabel, QPlainTextEdit, QPushButton, QTableWidget,
+                             QTableWidgetItem, QVBoxLayout, QWidget)
+
+from instrumentation import BUCKET_COUNT, Profiler, bucket_bound, metrics, recent_logs
+
+log = logging.getLogger(__name__)
+
+# How often the stall detector's timer fires, and how late it must be to count as a stall
+STALL_INTERVAL_MS = 20
+STALL_SECONDS = 0.1
+
+SUMMARY_COLUMNS = ['count', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms']
+
+
+class StallDetector(QObject):
+    """Notices when the GUI thread stops handling events.
+
+    A timer is due every STALL_INTERVAL_MS; how late it fires is the time the
+    event loop spent on something else. Lateness goes into the
+    event_loop.lag histogram, and a gap over STALL_SECONDS is counted and
+    logged as a stall.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._timer = QTimer(self)
+        self._timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self._timer.setInterval(STALL_INTERVAL_MS)
+        self._timer.timeout.connect(self._tick)
+        self._last = None
+
+    def start(self):
+        self._last = time.perf_counter()
+        self._timer.start()
+
+    def stop(self):
+        self._timer.stop()
+
+    def _tick(self):
+        now = time.perf_counter()
+        lag = max(now - self._last - STALL_INTERVAL_MS / 1000, 0.0)
+        self._last = now
+        metrics.record('event_loop.lag', lag, now - lag)
+        if lag > STALL_SECONDS:
+            metrics.count('event_loop.stalls')
+            log.warning("GUI thread stalled for %.0f ms", lag * 1000)
+
+
+class HistogramView(QWidget):
+    """Bars of one histogram's buckets, log-spaced from left to right."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setMinimumHeight(120)
+        self.name = None
+
+    def set_histogram(self, name):
+        self.name = name
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), self.palette().base())
+        histogram = metrics.histograms.get(self.name)
+        if histogram is None or not histogram.count:
+            painter.end()
+            return
+        counts = list(histogram.counts)
+        used = [index for index, count in enumerate(counts) if count]
+        first, last = used[0], used[-1]
+        tallest = max(counts)
+        label_height = self.fontMetrics().height()
+        height = self.height() - label_height
+        width = self.width() / (last - first + 1)
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(self.palette().highlight())
+        for index in range(first, last + 1):
+            bar = counts[index] / tallest * height
+            painter.drawRect(QRectF((index - first) * width, height - bar, max(width - 1, 1), bar))
+        painter.setPen(self.palette().text().color())
+        painter.drawText(0, self.height() - 2, f"{bucket_bound(first - 1) * 1000:.3g} ms")
+        right = f"{bucket_bound(min(last, BUCKET_COUNT - 1)) * 1000:.3g} ms"
+        painter.drawText(self.width() - self.fontMetrics().horizontalAdvance(right), self.height() - 2, right)
+        painter.end()
+
+
+class DiagnosticsPage(QWidget):
+    """Live timings and counters, with a Chrome trace and a cProfile dump on demand."""
+
+    REFRESH_MS = 500
+
+    def __init__(self):
+        super().__init__()
+        self.profiler = Profiler()
+        layout = QVBoxLayout(self)
+
+        self.table = QTableWidget(0, len(SUMMARY_COLUMNS) + 1)
+        self.table.setHorizontalHeaderLabels(['timer'] + SUMMARY_COLUMNS)
+        self.table.verticalHeader().hide()
+        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
+        self.table.itemSelectionChanged.connect(self.on_histogram_selected)
+        layout.addWidget(self.table, 3)
+
+        self.histogram_view = HistogramView()
+        layout.addWidget(self.histogram_view, 1)
+
+        self.counters_label = QLabel()
+        self.counters_label.setWordWrap(True)
+        layout.addWidget(self.counters_label)
+
+        self.trace_button = QPushButton("Start Trace")
+        self.trace_button.clicked.connect(self.toggle_trace)
+        self.profile_button = QPushButton("Start Profile")
+        self.profile_button.clicked.connect(self.toggle_profile)
+        self.reset_button = QPushButton("Reset")
+        self.reset_button.clicked.connect(self.reset)
+        hbox = QHBoxLayout()
+        hbox.addWidget(self.trace_button)
+        hbox.addWidget(self.profile_button)
+        hbox.addWidget(self.reset_button)
+        layout.addLayout(hbox)
+
+        self.log_view = QPlainTextEdit()
+        self.log_view.setReadOnly(True)
+        self.log_view.setMaximumBlockCount(recent_logs.maxlen)
+        layout.addWidget(self.log_view, 1)
+        self._last_log_line = None
+
+        # Refreshed only while the page is on screen
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(self.REFRESH_MS)
+        self.refresh_timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.refresh_timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.refresh_timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        summaries, counters = metrics.snapshot()
+        names = sorted(summaries)
+        self.table.setRowCount(len(names))
+        for row, name in enumerate(names):
+            cells = [name] + [summaries[name][column] for column in SUMMARY_COLUMNS]
+            for column, value in enumerate(cells):
+                text = value if isinstance(value, str) else (f"{value:,}" if isinstance(value, int)
+                                                             else f"{value:.3f}")
+                item = self.table.item(row, column)
+                if item is None:
+                    item = QTableWidgetItem()
+                    if column:
+                        item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+                    self.table.setItem(row, column, item)
+                item.setText(text)
+        self.counters_label.setText("   ".join(f"{name}: {count:,}" for name, count in sorted(counters.items())))
+        self.histogram_view.update()
+
+        lines = list(recent_logs)
+        # Every record is a new string, so a different last line means new records
+        if lines and lines[-1] is not self._last_log_line:
+            self._last_log_line = lines[-1]
+            self.log_view.setPlainText("\n".join(lines))
+            self.log_view.verticalScrollBar().setValue(self.log_view.verticalScrollBar().maximum())
+
+    def on_histogram_selected(self):
+        row = self.table.currentRow()
+        item = self.table.item(row, 0) if row >= 0 else None
+        self.histogram_view.set_histogram(item.text() if item is not None else None)
+
+    def reset(self):
+        metrics.reset()
+        self.refresh()
+
+    def toggle_trace(self):
+        if not metrics.tracing:
+            metrics.start_trace()
+            self.trace_button.setText("Save Trace...")
+            return
+        spans = metrics.stop_trace()
+        self.trace_button.setText("Start Trace")
+        path, _ = QFileDialog.getSaveFileName(self, "Save Trace", "trace.json", "Chrome Trace (*.json)")
+        if path:
+            metrics.save_trace(path, spans)
+            log.info("Saved %d trace events to %s", len(spans), path)
+
+    def toggle_profile(self):
+        if not self.profiler.running:
+            self.profiler.start()
+            self.profile_button.setText("Save Profile...")
+            return
+        self.profile_button.setText("Start Profile")
+        path, _ = QFileDialog.getSaveFileName(self, "Save Profile", "profile.pstats", "pstats (*.pstats *.prof)")
+        self.profiler.stop(path or None)
+        if path:
+            log.info("Saved profile to %s", path)
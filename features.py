@@ -0,0 +1,224 @@
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from catalog import CACHE_DIR, load_catalog
+from dataset_index import load_dataset_index
+
+log = logging.getLogger(__name__)
+
+PITCH_CLASSES = ['C', 'Cs', 'D', 'Ds', 'E', 'F', 'Fs', 'G', 'Gs', 'A', 'As', 'B']
+
+# Octaves of the piano keyboard, A0 (MIDI 21) to C8 (108), numbered like C4 = middle C
+OCTAVES = list(range(9))
+
+# Velocity histogram bands, each VELOCITY_BAND values wide
+VELOCITY_BAND = 16
+VELOCITY_BANDS = list(range(128 // VELOCITY_BAND))
+
+# Notes struck this close together count as one onset (a chord, or a rolled chord)
+CHORD_SECONDS = 0.03
+
+FEATURE_COLUMNS = (
+    ['note_count', 'notes_per_second', 'pitch_min', 'pitch_max', 'pitch_mean',
+     'velocity_mean', 'velocity_std', 'velocity_p10', 'velocity_p90',
+     'pedal_fraction', 'polyphony_mean', 'polyphony_max',
+     'onsets_per_second', 'ioi_median', 'ioi_cv']
+    + [f'pitch_class_{name}' for name in PITCH_CLASSES]
+    + [f'pitch_octave_{octave}' for octave in OCTAVES]
+    + [f'velocity_band_{band}' for band in VELOCITY_BANDS]
+)
+
+
+def compute_features(events):
+    """Per-performance statistics from a decoded event array (see midi_cache).
+
+    Note count and rates, pitch range with the share of notes in each pitch
+    class and each octave, velocity spread with the share of notes in each
+    band of VELOCITY_BAND, sustain pedal use, polyphony, and the spacing of
+    onsets (tempo and rubato).
+    """
+    # Imported here: the catalog search joins the saved features and should not load the MIDI parser
+    from midi_cache import CONTROL_CHANGE, NOTE_OFF, NOTE_ON, SUSTAIN_PEDAL
+    features = dict.fromkeys(FEATURE_COLUMNS, np.nan)
+    kinds = events['kind']
+    times = events['time']
+    notes = events[kinds == NOTE_ON]
+    duration = float(times[-1]) if len(times) else 0.0
+    features['note_count'] = len(notes)
+    if not len(notes):
+        return features
+
+    pitches = notes['note'].astype(np.float64)
+    velocities = notes['velocity'].astype(np.float64)
+    features['notes_per_second'] = len(notes) / duration if duration else np.nan
+    features['pitch_min'] = pitches.min()
+    features['pitch_max'] = pitches.max()
+    features['pitch_mean'] = pitches.mean()
+    features['velocity_mean'] = velocities.mean()
+    features['velocity_std'] = velocities.std()
+    features['velocity_p10'], features['velocity_p90'] = np.percentile(velocities, [10, 90])
+
+    # Time between onsets: its median follows the tempo, its spread the rubato
+    onset_times = notes['time'][np.append(True, np.diff(notes['time']) > CHORD_SECONDS)]
+    intervals = np.diff(onset_times)
+    features['onsets_per_second'] = len(onset_times) / duration if duration else np.nan
+    if len(intervals):
+        features['ioi_median'] = float(np.median(intervals))
+        features['ioi_cv'] = float(intervals.std() / intervals.mean())
+
+    histogram = np.bincount(notes['note'] % 12, minlength=12) / len(notes)
+    for name, share in zip(PITCH_CLASSES, histogram):
+        features[f'pitch_class_{name}'] = share
+    # Register: where on the keyboard the notes are, not just their extremes
+    octaves = np.clip(notes['note'].astype(np.int64) // 12 - 1, OCTAVES[0], OCTAVES[-1])
+    for octave, share in zip(OCTAVES, np.bincount(octaves, minlength=len(OCTAVES)) / len(notes)):
+        features[f'pitch_octave_{octave}'] = share
+    bands = np.bincount(notes['velocity'] // VELOCITY_BAND, minlength=len(VELOCITY_BANDS)) / len(notes)
+    for band, share in zip(VELOCITY_BANDS, bands):
+        features[f'velocity_band_{band}'] = share
+
+    if duration:
+        # Share of the piece with the sustain pedal down
+        pedal = events[(kinds == CONTROL_CHANGE) & (events['control'] == SUSTAIN_PEDAL)]
+        if len(pedal):
+            down = (pedal['value'] >= 64).astype(np.float64)
+            spans = np.diff(np.append(pedal['time'], duration))
+            features['pedal_fraction'] = float((down * spans).sum() / duration)
+        else:
+            features['pedal_fraction'] = 0.0
+
+        # Keys held down over time: +1 per note on, -1 per note off
+        note_events = events[(kinds == NOTE_ON) | (kinds == NOTE_OFF)]
+        steps = np.where(note_events['kind'] == NOTE_ON, 1, -1)
+        polyphony = np.maximum(np.cumsum(steps), 0)
+        spans = np.diff(np.append(note_events['time'], duration))
+        features['polyphony_mean'] = float((polyphony * spans).sum() / duration)
+        features['polyphony_max'] = int(polyphony.max())
+    return features
+
+
+def _extract_one(midi_path):
+    # Runs in a worker process
+    from midi_cache import load_midi
+    try:
+        return compute_features(load_midi(midi_path))
+    except Exception as e:
+        log.error("Error extracting features from %s: %s", midi_path, e)
+        return None
+
+
+def features_path(metadata):
+    key = hashlib.sha1(os.path.abspath(metadata).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, 'features', f'{key}.npz')
+
+
+def load_features(metadata):
+    """The cached feature table for this catalog, indexed by midi_filename, or None."""
+    try:
+        with np.load(features_path(metadata), allow_pickle=False) as table:
+            columns = {name: table[name] for name in table.files}
+    except (OSError, ValueError):
+        return None
+    df = pd.DataFrame(columns)
+    return df.set_index('midi_filename')
+
+
+def _save_features(metadata, df):
+    path = features_path(metadata)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    columns = {'midi_filename': np.asarray(df.index.astype(str), dtype=str)}
+    for name in df.columns:
+        columns[name] = df[name].to_numpy()
+    tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez(tmp_path, **columns)
+    os.replace(tmp_path, path)
+
+
+def extract_features(metadata, dataset_path=None, jobs=None):
+    """Compute features for every MIDI file whose contents changed since the last run.
+
+    That is every catalog entry, and also MIDI files in the dataset folder
+    the catalog does not list (e.g. ones added while the app is open): they
+    have no catalog row for join_features(), but SimilarityIndex uses them.
+    """
+    dataset_path = dataset_path or os.path.dirname(os.path.abspath(metadata))
+    midi_filenames = load_catalog(metadata).df['midi_filename'].astype(str).tolist()
+
+    previous = load_features(metadata)
+    if previous is not None and not set(FEATURE_COLUMNS) <= set(previous.columns):
+        previous = None  # Saved before a feature was added, so every file is processed again
+    rows = {}
+    todo = []
+    # Sizes and mtimes come from one scan of the dataset folder, not a stat per file
+    # A snapshot: in the app this runs on a worker thread while the file watcher refreshes the index
+    dataset_index = load_dataset_index(dataset_path).snapshot()
+    midi_filenames = list(dict.fromkeys(midi_filenames + dataset_index.midi_files()))
+    for midi_filename in midi_filenames:
+        info = dataset_index.lookup(midi_filename)
+        if info is None:
+            continue
+        if previous is not None and midi_filename in previous.index:
+            row = previous.loc[midi_filename]
+            if row['size'] == info.size and row['mtime_ns'] == info.mtime_ns:
+                rows[midi_filename] = row.to_dict()
+                continue
+        todo.append((midi_filename, info))
+
+    log.info("%d files to process, %d unchanged", len(todo), len(rows))
+    start = time.perf_counter()
+    if todo:
+        # Sorted paths keep each year folder together, chunks go out to every core
+        todo.sort()
+        paths = [info.path for _, info in todo]
+        if jobs == 1:
+            # In this thread, e.g. a few new files picked up while the app is open
+            _collect(rows, todo, map(_extract_one, paths))
+        else:
+            with ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as executor:
+                _collect(rows, todo, executor.map(_extract_one, paths, chunksize=8))
+
+    df = pd.DataFrame.from_dict(rows, orient='index', columns=FEATURE_COLUMNS + ['size', 'mtime_ns'])
+    df.index.name = 'midi_filename'
+    _save_features(metadata, df)
+    log.info("Processed %d files in %.1f s", len(todo), time.perf_counter() - start)
+    return df
+
+
+def _collect(rows, todo, results):
+    for (midi_filename, info), features in zip(todo, results):
+        if features is None:
+            continue
+        features['size'] = info.size
+        features['mtime_ns'] = info.mtime_ns
+        rows[midi_filename] = features
+
+
+def join_features(df, features):
+    """Catalog rows with their feature columns added (NaN where missing)."""
+    if features is None:
+        return df
+    features = features[FEATURE_COLUMNS].reindex(df['midi_filename'].astype(str))
+    features.index = df.index
+    return pd.concat([df, features], axis=1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract per-performance MIDI features for the catalog.")
+    parser.add_argument('metadata', help="path to maestro-v3.0.0.csv")
+    parser.add_argument('--dataset-path', help="folder holding the year folders (default: next to the CSV)")
+    parser.add_argument('--jobs', type=int, help="worker processes (default: CPU count, 1 works in this process)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    extract_features(args.metadata, args.dataset_path, args.jobs)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+import atexit
+import cProfile
+import collections
+import json
+import logging
+import logging.handlers
+import math
+import os
+import queue
+import sys
+import threading
+import time
+from functools import wraps
+
+# Histogram buckets: BUCKETS_PER_OCTAVE per doubling, from MIN_SECONDS up to about a minute
+MIN_SECONDS = 1e-6
+BUCKETS_PER_OCTAVE = 4
+BUCKET_COUNT = 26 * BUCKETS_PER_OCTAVE
+
+# Trace events kept while tracing; the oldest are dropped past this
+TRACE_EVENTS = 200000
+
+# Log lines kept for the diagnostics page
+RECENT_LOG_LINES = 500
+
+
+def bucket_bound(index):
+    """Upper bound in seconds of a histogram bucket."""
+    return MIN_SECONDS * 2 ** ((index + 1) / BUCKETS_PER_OCTAVE)
+
+
+class Histogram:
+    """Durations in log-spaced buckets: recording is O(1) and memory is fixed.
+
+    Percentiles are read back as the upper bound of the bucket they fall in,
+    so they are within a quarter octave (about 19%) of the real value.
+    """
+
+    def __init__(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        if seconds <= MIN_SECONDS:
+            index = 0
+        else:
+            index = min(int(math.log2(seconds / MIN_SECONDS) * BUCKETS_PER_OCTAVE), BUCKET_COUNT - 1)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, fraction):
+        with self._lock:
+            counts, count, largest = list(self.counts), self.count, self.max
+        if not count:
+            return 0.0
+        wanted = fraction * count
+        seen = 0
+        for index, bucket in enumerate(counts):
+            seen += bucket
+            if seen >= wanted:
+                return min(bucket_bound(index), largest)
+        return largest
+
+    def summary(self):
+        count = self.count
+        return {
+            'count': count,
+            'mean_ms': self.total / count * 1000 if count else 0.0,
+            'p50_ms': self.percentile(0.5) * 1000,
+            'p90_ms': self.percentile(0.9) * 1000,
+            'p99_ms': self.percentile(0.99) * 1000,
+            'max_ms': self.max * 1000,
+        }
+
+
+class _Timer:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record(self.name, time.perf_counter() - self.start, self.start)
+
+
+class Metrics:
+    """Named duration histograms and counters, safe to update from any thread.
+
+    timer(name) is a context manager, timed(name) a decorator; both record
+    into the histogram called name. While a trace is running every timed
+    span is also kept, to be saved in Chrome's trace format
+    (chrome://tracing or https://ui.perfetto.dev).
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = collections.Counter()
+        self._trace = None
+        self._lock = threading.Lock()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def record(self, name, seconds, start=None):
+        """Add a duration; start (a perf_counter() value) places it in the trace."""
+        self.histogram(name).add(seconds)
+        trace = self._trace
+        if trace is not None and start is not None:
+            trace.append((name, start, seconds, threading.get_ident()))
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def timer(self, name):
+        return _Timer(self, name)
+
+    def timed(self, name):
+        def decorate(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start, start)
+            return wrapper
+        return decorate
+
+    def snapshot(self):
+        """({name: histogram summary}, {name: count})."""
+        with self._lock:
+            histograms = dict(self.histograms)
+            counters = dict(self.counters)
+        return {name: histogram.summary() for name, histogram in histograms.items()}, counters
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.counters = collections.Counter()
+
+    @property
+    def tracing(self):
+        return self._trace is not None
+
+    def start_trace(self, max_events=TRACE_EVENTS):
+        self._trace = collections.deque(maxlen=max_events)
+
+    def stop_trace(self):
+        """Stop tracing; returns the spans recorded, oldest first."""
+        trace, self._trace = self._trace, None
+        return list(trace or ())
+
+    def save_trace(self, path, spans):
+        """Write spans from stop_trace() as a Chrome trace JSON file."""
+        pid = os.getpid()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                   'args': {'name': names.get(tid, str(tid))}}
+                  for tid in {tid for _, _, _, tid in spans}]
+        events += [{'name': name, 'cat': name.split('.', 1)[0], 'ph': 'X', 'pid': pid, 'tid': tid,
+                    'ts': start * 1e6, 'dur': seconds * 1e6}
+                   for name, start, seconds, tid in spans]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+# The process-wide registry the app's modules record into
+metrics = Metrics()
+
+
+class Profiler:
+    """cProfile of the thread that starts it (the GUI thread), saved as a pstats file."""
+
+    def __init__(self):
+        self._profile = None
+
+    @property
+    def running(self):
+        return self._profile is not None
+
+    def start(self):
+        if self._profile is None:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stop(self, path=None):
+        """Stop, writing the stats to path if given (read them with python -m pstats path)."""
+        profile, self._profile = self._profile, None
+        if profile is not None:
+            profile.disable()
+            if path:
+                profile.dump_stats(path)
+
+
+class _RecentHandler(logging.Handler):
+    def __init__(self, lines):
+        super().__init__()
+        self.lines = lines
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+recent_logs = collections.deque(maxlen=RECENT_LOG_LINES)
+_listener = None
+
+
+def start_logging(level=logging.INFO):
+    """Send log records through a queue to a background thread that writes them to stderr.
+
+    A log call then only formats the message and puts it on the queue, so the
+    playback and search threads never wait on the terminal. The last lines
+    are also kept in recent_logs for the diagnostics page.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    records = queue.SimpleQueue()
+    formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s', '%H:%M:%S')
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(formatter)
+    recent = _RecentHandler(recent_logs)
+    recent.setFormatter(formatter)
+    _listener = logging.handlers.QueueListener(records, stream, recent)
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level)
+    _listener.start()
+    atexit.register(_listener.stop)  # Flushes what is still queued
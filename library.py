@@ -0,0 +1,111 @@
+import os
+
+from catalog import load_catalog
+from dataset_index import load_dataset_index
+from query import FilterIndex, search_rows
+from search_index import SearchIndex
+
+# File types export() can write, by extension
+EXPORT_FORMATS = ('.csv', '.json', '.m3u')
+
+
+def piece_title(composer, title):
+    return f"{composer} - {title}"
+
+
+class Library:
+    """The catalog and what can be done with it, without Qt.
+
+    Shared by the GUI and cli.py: the catalog with the feature columns of
+    features.py, where each MIDI file is, search (the indexes are built on
+    the first one), and playlist items or exported files for a set of rows.
+    Everything is loaded on first use, so a script only pays for what it
+    touches.
+    """
+
+    def __init__(self, metadata, dataset_path=None):
+        self.metadata = metadata
+        self.dataset_path = dataset_path or os.path.dirname(os.path.abspath(metadata))
+        self._df = None
+        self._search_index = None
+        self._filter_index = None
+
+    @property
+    def df(self):
+        if self._df is None:
+            # features pulls in the MIDI parser, a search should not wait for that import
+            from features import join_features, load_features
+            # Add the MIDI statistics columns if features.py has been run on this catalog
+            self._df = join_features(load_catalog(self.metadata).df, load_features(self.metadata))
+        return self._df
+
+    @property
+    def dataset_index(self):
+        # Resolved path of every file in the catalog, from one scan of the dataset folder
+        return load_dataset_index(self.dataset_path, self.metadata)
+
+    @property
+    def search_index(self):
+        if self._search_index is None:
+            # The n-grams are saved next to the catalog cache, so a script run reuses them
+            self._search_index = SearchIndex(self.df, cache_dir=load_catalog(self.metadata).cache_dir)
+        return self._search_index
+
+    @property
+    def filter_index(self):
+        if self._filter_index is None:
+            self._filter_index = FilterIndex(self.df)
+        return self._filter_index
+
+    def load(self):
+        """Load the catalog and build the indexes now instead of on first use; returns self."""
+        for name in ('df', 'dataset_index', 'search_index', 'filter_index'):
+            getattr(self, name)
+        return self
+
+    def search(self, query='', facets=None, check=None):
+        """(row positions best first, or None for every row; facet counts), see query.search_rows."""
+        return search_rows(self.search_index, self.filter_index, query, facets, check)
+
+    def find(self, query='', facets=None):
+        """The catalog rows matching query, best first."""
+        rows, _ = self.search(query, facets)
+        return self.df if rows is None else self.df.iloc[rows]
+
+    def midi_path(self, midi_filename):
+        """Where a catalog entry's MIDI file is, or None if it is not on disk."""
+        return self.dataset_index.path(midi_filename)
+
+    def titles(self, df=None):
+        """{midi_filename: 'composer - title'} for df (default: the whole catalog)."""
+        df = self.df if df is None else df
+        return {str(midi_filename): piece_title(composer, title) for midi_filename, composer, title in
+                zip(df['midi_filename'], df['canonical_composer'], df['canonical_title'])}
+
+    def playlist_items(self, df):
+        """(Playlist items for the rows of df, number of rows skipped because their MIDI file is missing)."""
+        items = []
+        for midi_filename, title in self.titles(df).items():
+            path = self.midi_path(midi_filename)
+            if path is not None:
+                items.append({'midi': path, 'title': title})
+        return items, len(df) - len(items)
+
+    def export(self, df, path):
+        """Write rows to path as .csv, .json (one object per row) or .m3u (their MIDI files)."""
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.csv':
+            df.to_csv(path, index=False)
+        elif extension == '.json':
+            df.to_json(path, orient='records', indent=2, force_ascii=False)
+        elif extension == '.m3u':
+            items, _ = self.playlist_items(df)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('#EXTM3U\n')
+                for item in items:
+                    f.write(f"#EXTINF:-1,{item['title']}\n{item['midi']}\n")
+        else:
+            raise ValueError(f"Cannot export to {extension or 'a file without extension'}, "
+                             f"use one of {', '.join(EXPORT_FORMATS)}")
+        return path
+
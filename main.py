@@ -1,30 +1,30 @@
-from PyQt6.QtWidgets import QApplication, QMainWindow, QWidget, QPushButton, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QStackedWidget, QSlider, QFileDialog, QTableView
-import pandas as pd
+import time
 
-from PyQt6.QtCore import Qt, QAbstractTableModel
-import mido
+# Startup times are measured from here, before Qt and the rest are imported
+STARTED = time.perf_counter()
+
+from PyQt6.QtWidgets import QApplication, QMainWindow, QWidget, QPushButton, QVBoxLayout, QHBoxLayout, QLabel, QStackedWidget
+from PyQt6.QtCore import Qt, QFileSystemWatcher, QThread, QTimer, pyqtSignal
+import logging
 import os
+import sys
+import threading
 
+from diagnostics import DiagnosticsPage, StallDetector
+from instrumentation import metrics, start_logging
+from settings import SOUND_FONT
 
-import sys
-from glob import glob
+# Everything that needs pandas, mido or numpy (the catalog, search, playback) is
+# imported when the page or background job using it first runs, so the window
+# shows up before any of it is loaded
 
-# Create a dictionary to store the audio files for each year
-audio_files = {
-    2004: '/maestro-v3.0.0/2004',
-    2006: '/maestro-v3.0.0/2006',
-    2008: '/maestro-v3.0.0/2008',
-    2009: '/maestro-v3.0.0/2009',
-    2011: '/maestro-v3.0.0/2011',
-    2013: '/maestro-v3.0.0/2013',
-    2014: '/maestro-v3.0.0/2014',
-    2015: '/maestro-v3.0.0/2015',
-    2017: '/maestro-v3.0.0/2017',
-    2018: '/maestro-v3.0.0/2018'
-}
+log = logging.getLogger(__name__)
 
+# Default location of the metadata CSV; the year folders sit next to it
+metadata = '/maestro-v3.0.0/maestro-v3.0.0.csv'
 
-metadata = '/maestro-v3.0.0.csv'
+# Pages of the stack, in sidebar order
+INTRODUCTION, MUSIC, SEARCH, CHANGE_MODE, DIAGNOSTICS, COMPARE = range(6)
 
 class IntroductionPage(QWidget):
     def __init__(self):
@@ -35,160 +35,33 @@ class IntroductionPage(QWidget):
         layout.addWidget(introduction_label)
         self.setLayout(layout)
 
-class MusicPage(QWidget):
-    def __init__(self):
-        super().__init__()
-        self.initUI()
-        self.midi_output_port = None
-        
-
-    def initUI(self):
-        layout = QVBoxLayout(self)
-
-        self.sld = QSlider(Qt.Orientation.Vertical)
-        self.sld.setFocusPolicy(Qt.FocusPolicy.NoFocus)
-        self.sld.setFixedSize(30, 100)
-        self.sld.valueChanged.connect(self.changeValue)
-        self.label = QLabel('Volume: 0')
-
-        slider_hbox = QHBoxLayout()
-        slider_hbox.addWidget(self.sld)
-        slider_hbox.addWidget(self.label)
-        layout.addLayout(slider_hbox)
-
-        playButton = QPushButton("Play")
-        playButton.clicked.connect(self.playMidiFile)
-        stopButton = QPushButton("Stop")
-        pauseButton = QPushButton("Pause")
-    
-        hbox = QHBoxLayout()
-        hbox.addWidget(playButton)
-        hbox.addWidget(stopButton)
-        hbox.addWidget(pauseButton)
-        
-        layout.addLayout(hbox)
-
-    def changeValue(self, value):
-        self.label.setText(f'Volume: {value}')
-
-    def playMidiFile(self):
-        # Ensure that the selected_midi_file attribute is set by the selection changed method
-        
-        midi_file_path = self.selected_midi_file
-
-        if midi_file_path is None:
-            print("MIDI file has not been selected.")
-            return
-
-        if not os.path.exists(midi_file_path):
-            print(f"MIDI file does not exist: {midi_file_path}")
-            return
+class CatalogLoader(QThread):
+    """Loads the catalog, its search indexes and the similarity fingerprints off the GUI thread.
 
-        try:
-            # Load the MIDI file
-            mid = mido.MidiFile(midi_file_path)
-            # You need to choose an available port
-            with mido.open_output() as port:
-                for msg in mid.play():
-                    port.send(msg)
-                    if msg.type == 'note_on':
-                        print(f"Playing note: {msg.note}")
-        except Exception as e:
-            print(f"Error playing MIDI file: {e}")
-            # Here, the audio playback will be asynchronous. You might want to keep track of the playback state.
-            
-        
+    pandas and the other modules this needs are imported here as well.
+    Emits loaded(library, similarity index or None) or failed(message).
+    """
 
-    def closeEvent(self, event):
-        if self.stream:
-            self.stream.stop_stream()
-            self.stream.close()
-        self.pyaudio_instance.terminate()
-        super().closeEvent(event)
+    loaded = pyqtSignal(object, object)
+    failed = pyqtSignal(str)
 
-        
-class SearchPage(QWidget):
-    def __init__(self, dataset_path, metadata):
-        super().__init__()
+    def __init__(self, dataset_path, metadata, parent=None):
+        super().__init__(parent)
         self.dataset_path = dataset_path
         self.metadata = metadata
-        
-        self.df = pd.read_csv(metadata)  # Load the metadata CSV
-        self.selected_midi_file = None  # To store the path of the selected MIDI file
-        self.initUI()
-
-    def initUI(self):
-        layout = QVBoxLayout(self)
-
-        self.search_input = QLineEdit()
-        self.search_input.setPlaceholderText("Enter search query...")
-        self.search_input.textChanged.connect(self.on_search)
-
-        self.search_button = QPushButton("Search")
-        self.search_button.clicked.connect(self.on_search)
-
-        self.table_view = QTableView(self)
-        self.set_dataframe(self.df)  # Display the loaded DataFrame in the QTableView
-
-        hbox = QHBoxLayout()
-        hbox.addWidget(self.search_input)
-        hbox.addWidget(self.search_button)
-
-        layout.addLayout(hbox)
-        layout.addWidget(self.table_view)
-
-        # Connect table view selection change to a new method
-        self.table_view.selectionModel().selectionChanged.connect(self.on_selection_changed)
-
-    def on_selection_changed(self, selected, deselected):
-        # Get the first selected index
-        indexes = selected.indexes()
-        if indexes:
-            selected_row = indexes[0].row()
-            # Assuming 'midi_filename' column contains the MIDI file names
-            midi_filename = self.df.iloc[selected_row]['midi_filename']
-            self.selected_midi_file = f"{self.dataset_path}{midi_filename}"
-            print(f"Selected MIDI file: {self.selected_midi_file}")  # Debugging
-
-    def set_dataframe(self, df):
-        """Call this method to set the DataFrame with your data."""
-        self.df = df
-        self.update_table_view(self.df)  # Initially show all data
-
-    def on_search(self):
-        query = self.search_input.text().lower()
-        if query:
-            # Create a boolean series for rows that match the query across all text columns
-            condition = pd.concat([
-                self.df[col].astype(str).str.lower().str.contains(query) 
-                for col in self.df.select_dtypes(include=[object, "string"]).columns
-            ], axis=1).any(axis=1)
-            filtered_df = self.df[condition]
-            self.update_table_view(filtered_df)
-        else:
-            self.update_table_view(self.df)
-
-
-    def on_selection_changed(self, selected, deselected):
-    # Get the first selected index
-    indexes = selected.indexes()
-    if indexes:
-        selected_row = indexes[0].row()
-        # Get the 'midi_filename' and 'year' of the selected MIDI file
-        midi_filename = self.df.iloc[selected_row]['midi_filename']
-        year = self.df.iloc[selected_row]['year']
-        # Construct the full path to the selected MIDI file
-        self.selected_midi_file = os.path.join(audio_files[year], midi_filename)
-        print(f"Selected MIDI file: {self.selected_midi_file}")  # Debugging
-
-
-
-
-
-    def update_table_view(self, df):
-        model = PandasTableModel(df)
-        self.table_view.setModel(model)
-        self.table_view.resizeColumnsToContents()
+
+    def run(self):
+        try:
+            with metrics.timer('startup.load_catalog'):
+                from library import Library
+                from similarity import load_similarity_index
+                library = Library(self.metadata, self.dataset_path).load()
+                similarity = load_similarity_index(self.metadata)
+        except Exception as e:
+            log.exception("Could not load the catalog")
+            self.failed.emit(f"Could not load {self.metadata}: {e}")
+            return
+        self.loaded.emit(library, similarity)
 
 #class ChangeModePage(QWidget):
  #   def __init__(self):
@@ -206,13 +79,13 @@ class SearchPage(QWidget):
 class MainWindow(QMainWindow):
     def __init__(self, dataset_path, metadata):
         super().__init__()
-        self.search_page = SearchPage(dataset_path, metadata)
+        self.dataset_path = dataset_path
+        self.metadata = metadata
         self.setWindowTitle("Main Application")
         self.setGeometry(300, 300, 600, 400)
 
         main_widget = QWidget()
         main_layout = QHBoxLayout(main_widget)
-        self.metadata = metadata
         sidebar = QWidget()
         sidebar_layout = QVBoxLayout(sidebar)
         sidebar_layout.setAlignment(Qt.AlignmentFlag.AlignTop)
@@ -222,88 +95,210 @@ class MainWindow(QMainWindow):
         music_button = QPushButton('Music Setting')
         search_button = QPushButton('Search')
         change_mode_button = QPushButton('Change Mode')
+        diagnostics_button = QPushButton('Diagnostics')
+        compare_button = QPushButton('Compare')
 
-        introduction_button.clicked.connect(lambda: self.switch_page(0))
-        music_button.clicked.connect(lambda: self.switch_page(1))
-        search_button.clicked.connect(lambda: self.switch_page(2))
-        change_mode_button.clicked.connect(lambda: self.switch_page(3))
+        introduction_button.clicked.connect(lambda: self.switch_page(INTRODUCTION))
+        music_button.clicked.connect(lambda: self.switch_page(MUSIC))
+        search_button.clicked.connect(lambda: self.switch_page(SEARCH))
+        change_mode_button.clicked.connect(lambda: self.switch_page(CHANGE_MODE))
+        diagnostics_button.clicked.connect(lambda: self.switch_page(DIAGNOSTICS))
+        compare_button.clicked.connect(lambda: self.switch_page(COMPARE))
 
         sidebar_layout.addWidget(introduction_button)
         sidebar_layout.addWidget(music_button)
         sidebar_layout.addWidget(search_button)
         sidebar_layout.addWidget(change_mode_button)
-        
+        sidebar_layout.addWidget(diagnostics_button)
+        sidebar_layout.addWidget(compare_button)
+
+        # Pages are built the first time they are needed (see page()); until
+        # then the stack holds an empty placeholder in their place
+        self.page_factories = {INTRODUCTION: IntroductionPage, MUSIC: self.build_music_page,
+                               SEARCH: self.build_search_page, DIAGNOSTICS: DiagnosticsPage,
+                               COMPARE: self.build_compare_page}
+         #self.page_factories[CHANGE_MODE] = ChangeModePage
+        self.pages = {}
+        self.loading_label = QLabel("Loading the catalog...")  # Stands in for the Search page until it is loaded
+        self.loading_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.stacked_widget = QStackedWidget()
-        self.stacked_widget.addWidget(IntroductionPage())
-        self.stacked_widget.addWidget(MusicPage())
-        search_page = SearchPage(dataset_path, metadata)
-        self.stacked_widget.addWidget(self.search_page)  # Pass metadata to SearchPage
-         #self.stacked_widget.addWidget(ChangeModePage())
+        for index in range(COMPARE + 1):
+            self.stacked_widget.addWidget(self.loading_label if index == SEARCH else QWidget())
+        self.switch_page(INTRODUCTION)
+
+        # Timings of the GUI thread's event loop, shown on the Diagnostics page
+        self.stall_detector = StallDetector(self)
+        self.stall_detector.start()
 
         main_layout.addWidget(sidebar, 1)
         main_layout.addWidget(self.stacked_widget, 4)
 
         self.setCentralWidget(main_widget)
 
-        music_page = self.stacked_widget.widget(1)  # Get the MusicPage instance
-        music_page.selected_midi_file = search_page.selected_midi_file  # Pass the selected MIDI file path to MusicPage
+        # One synthesizer and output port for the whole session instead of one per play,
+        # warmed up in the background while the window paints
+        from audio_backend import AudioBackend
+        self.audio_backend = AudioBackend(sound_font=SOUND_FONT)
+        self.audio_backend.start_background()
+        self.library = None  # Catalog, search and file locations, see library.py
+        self.similarity = None  # Fingerprints of every performance for "play something similar"
+        self.dataset_index = None
+        self.dataset_watcher = None
+        self.similarity_thread = None
+        self.similarity_pending = False
+
+        # The catalog is loaded in the background once the window has been painted
+        self.first_paint = None  # Seconds from STARTED
+        self.catalog_loader = CatalogLoader(dataset_path, metadata, self)
+        self.catalog_loader.loaded.connect(self.on_catalog_loaded)
+        self.catalog_loader.failed.connect(self.loading_label.setText)
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.first_paint is None:
+            self.first_paint = time.perf_counter() - STARTED
+            metrics.record('startup.first_paint', self.first_paint)
+            log.info("Window painted %.0f ms after start", self.first_paint * 1000)
+            # Started only now so that loading never competes with showing the window
+            QTimer.singleShot(0, self.catalog_loader.start)
+
+    def on_catalog_loaded(self, library, similarity):
+        ready = time.perf_counter() - STARTED
+        metrics.record('startup.catalog_ready', ready)
+        log.info("Catalog ready %.0f ms after start", ready * 1000)
+        self.library = library
+        self.similarity = similarity
+
+        # Files added to or removed from the dataset folder show up without a restart;
+        # only the folders Qt reports as changed are listed again
+        self.dataset_index = library.dataset_index
+        self.dataset_watcher = QFileSystemWatcher(self.dataset_index.directories(), self)
+        self.dataset_watcher.directoryChanged.connect(self.refresh_dataset)
+
+        if MUSIC in self.pages:
+            self.pages[MUSIC].set_similarity(similarity, self.dataset_index, library.titles())
+        if self.stacked_widget.currentIndex() == SEARCH:
+            self.page(SEARCH)  # Asked for while loading
+
+    def page(self, index):
+        """The page at index, built on first use; None if it cannot be built yet."""
+        page = self.pages.get(index)
+        if page is not None or index not in self.page_factories:
+            return page
+        with metrics.timer('startup.build_page'):
+            page = self.page_factories[index]()
+        if page is None:
+            return None
+        self.pages[index] = page
+        placeholder = self.stacked_widget.widget(index)
+        current = self.stacked_widget.currentIndex()
+        self.stacked_widget.removeWidget(placeholder)
+        self.stacked_widget.insertWidget(index, page)
+        self.stacked_widget.setCurrentIndex(current)
+        placeholder.deleteLater()
+        return page
+
+    def build_music_page(self):
+        from music_page import MusicPage
+        music_page = MusicPage(self.audio_backend)
+        if self.library is not None:
+            music_page.set_similarity(self.similarity, self.dataset_index, self.library.titles())
+        music_page.signals.stateChanged.connect(lambda state: self.on_playback_state(MUSIC, state))
+        return music_page
+
+    def build_search_page(self):
+        if self.library is None:
+            return None  # Still loading, the placeholder says so
+        from search_page import SearchPage
+        search_page = SearchPage(self.library)
+        search_page.midi_file_selected.connect(self.set_music_page_midi_file)
+        search_page.add_to_playlist.connect(lambda items: self.page(MUSIC).addToPlaylist(items))
+        search_page.compare_requested.connect(self.compare)
+        return search_page
+
+    def build_compare_page(self):
+        from compare_page import ComparePage
+        compare_page = ComparePage(self.audio_backend)
+        compare_page.signals.stateChanged.connect(lambda state: self.on_playback_state(COMPARE, state))
+        return compare_page
+
+    def on_playback_state(self, index, state):
+        # Both pages play through the same port, and the player's volume is
+        # every channel's: only one of them plays at a time
+        if state == 'playing':
+            other = self.pages.get(COMPARE if index == MUSIC else MUSIC)
+            if other is not None:
+                other.engine.pause()
+
+    def compare(self, items):
+        self.page(COMPARE).compare(items)
+        self.switch_page(COMPARE)
+
+    def refresh_dataset(self, path):
+        if self.dataset_index.refresh():
+            watched = set(self.dataset_watcher.directories())
+            new = [path for path in self.dataset_index.directories() if path not in watched]
+            if new:
+                self.dataset_watcher.addPaths(new)
+            if SEARCH in self.pages:
+                self.pages[SEARCH].update_missing()
+            self.update_similarity()
+
+    def update_similarity(self):
+        # New or changed MIDI files get their features and fingerprints in the background
+        if self.similarity is None:
+            return
+        self.similarity_pending = True
+        if self.similarity_thread is None or not self.similarity_thread.is_alive():
+            self.similarity_thread = threading.Thread(target=self._update_similarity, daemon=True)
+            self.similarity_thread.start()
+
+    def _update_similarity(self):
+        from features import extract_features
+        while self.similarity_pending:
+            self.similarity_pending = False
+            try:
+                # Only files whose size or mtime changed are read
+                features = extract_features(self.metadata, self.dataset_path, jobs=1)
+            except Exception:
+                log.exception("Could not update the features")
+                return
+            self.similarity.update(features)
 
     def switch_page(self, page_index):
+        self.page(page_index)
         self.stacked_widget.setCurrentIndex(page_index)
 
-class CSVPage(QWidget):
-    def __init__(self):
-        super().__init__()
-        layout = QVBoxLayout(self)
-        
-        self.open_csv_button = QPushButton("Open CSV")
-        self.open_csv_button.clicked.connect(self.openFileDialog)
-        
-        self.table_view = QTableView()
-        
-        layout.addWidget(self.open_csv_button)
-        layout.addWidget(self.table_view)
-        
-    def openFileDialog(self):
-        options = QFileDialog.Options()
-        filePath, _ = QFileDialog.getOpenFileName(self, "Open CSV", "", "CSV Files (*.csv)", options=options)
-        if filePath:
-            self.loadCsv(filePath)
-    
-    def loadCsv(self, filePath):
-        df = pd.read_csv(filePath)
-        print(df.head())  # Add this line to check if the DataFrame is loaded correctly
-        model = PandasTableModel(df)
-        self.table_view.setModel(model)
-
-class PandasTableModel(QAbstractTableModel):
-    def __init__(self, data):
-        super().__init__()  # Properly initialize the parent class
-        self._data = data
-
-    def rowCount(self, parent=None):
-        return self._data.shape[0]
-
-    def columnCount(self, parent=None):
-        return self._data.shape[1]
-
-    def data(self, index, role=Qt.ItemDataRole.DisplayRole):  # Corrected enum access
-        if index.isValid():
-            if role == Qt.ItemDataRole.DisplayRole:  # Corrected enum access
-                return str(self._data.iloc[index.row(), index.column()])
-        return None
-
-    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):  # Corrected enum access
-        if role == Qt.ItemDataRole.DisplayRole:  # Corrected enum access
-            if orientation == Qt.Orientation.Horizontal:
-                return str(self._data.columns[section])
-            elif orientation == Qt.Orientation.Vertical:
-                return str(self._data.index[section])
-        return None
-    
+    def closeEvent(self, event):
+        if MUSIC in self.pages:
+            self.pages[MUSIC].shutdown()
+        if SEARCH in self.pages:
+            self.pages[SEARCH].shutdown()
+        if COMPARE in self.pages:
+            self.pages[COMPARE].shutdown()
+        self.audio_backend.close()
+        self.catalog_loader.wait()  # A QThread must not be destroyed while running
+        super().closeEvent(event)
+
+    def set_music_page_midi_file(self, midi_file):
+        music_page = self.page(MUSIC)  # Get the MusicPage instance
+        music_page.selected_midi_file = midi_file  # Pass the selected MIDI file path to MusicPage
 
 if __name__ == "__main__":
+    # python3 main.py [path/to/maestro-v3.0.0.csv] [dataset folder, default: next to the CSV]
+    # With --startup-time, prints the seconds to the first paint and to the catalog being ready, then quits
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('-')]
+    if args:
+        metadata = args[0]
+    dataset_path = args[1] if len(args) > 1 else os.path.dirname(os.path.abspath(metadata))
+    start_logging()
     app = QApplication(sys.argv)
     main_window = MainWindow(dataset_path, metadata)
     main_window.show()
+    if '--startup-time' in sys.argv[1:]:
+        def report_startup(*_):
+            print(f"{main_window.first_paint:.4f} {time.perf_counter() - STARTED:.4f}")
+            app.quit()
+        main_window.catalog_loader.loaded.connect(report_startup)
+        main_window.catalog_loader.failed.connect(lambda message: app.exit(1))
     sys.exit(app.exec())
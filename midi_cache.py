@@ -0,0 +1,262 @@
+import glob
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import mido
+import numpy as np
+
+from settings import CACHE_DIR
+from instrumentation import metrics
+
+log = logging.getLogger(__name__)
+
+# One row per channel message. kind is the MIDI status nibble (0x8 note off,
+# 0x9 note on, 0xB control change, ...), so kind << 4 | channel is the status byte.
+EVENT_DTYPE = np.dtype([
+    ('tick', np.int64),      # absolute tick in the merged track
+    ('time', np.float64),    # absolute seconds, tempo changes applied
+    ('kind', np.uint8),
+    ('channel', np.uint8),
+    ('note', np.uint8),
+    ('velocity', np.uint8),
+    ('control', np.uint8),
+    ('value', np.int16),     # control value, program, pitch bend or aftertouch
+])
+
+NOTE_OFF = 0x8
+NOTE_ON = 0x9
+POLYTOUCH = 0xA
+CONTROL_CHANGE = 0xB
+PROGRAM_CHANGE = 0xC
+AFTERTOUCH = 0xD
+PITCHWHEEL = 0xE
+
+SUSTAIN_PEDAL = 64
+
+
+def decode_midi(midi_file_path):
+    """Parse a MIDI file into an EVENT_DTYPE array sorted by time."""
+    mid = mido.MidiFile(midi_file_path)
+    tempo = 500000  # MIDI default, 120 bpm
+    tick = 0
+    seconds = 0.0
+    rows = []
+    for msg in mido.merge_tracks(mid.tracks):
+        if msg.time:
+            tick += msg.time
+            seconds += mido.tick2second(msg.time, mid.ticks_per_beat, tempo)
+        if msg.type == 'set_tempo':
+            tempo = msg.tempo
+        elif msg.type == 'note_on':
+            # note_on with velocity 0 is a note off, store it as one
+            kind = NOTE_ON if msg.velocity else NOTE_OFF
+            rows.append((tick, seconds, kind, msg.channel, msg.note, msg.velocity, 0, 0))
+        elif msg.type == 'note_off':
+            rows.append((tick, seconds, NOTE_OFF, msg.channel, msg.note, msg.velocity, 0, 0))
+        elif msg.type == 'control_change':
+            rows.append((tick, seconds, CONTROL_CHANGE, msg.channel, 0, 0, msg.control, msg.value))
+        elif msg.type == 'program_change':
+            rows.append((tick, seconds, PROGRAM_CHANGE, msg.channel, 0, 0, 0, msg.program))
+        elif msg.type == 'pitchwheel':
+            rows.append((tick, seconds, PITCHWHEEL, msg.channel, 0, 0, 0, msg.pitch))
+        elif msg.type == 'aftertouch':
+            rows.append((tick, seconds, AFTERTOUCH, msg.channel, 0, 0, 0, msg.value))
+        elif msg.type == 'polytouch':
+            rows.append((tick, seconds, POLYTOUCH, msg.channel, msg.note, 0, 0, msg.value))
+    return np.array(rows, dtype=EVENT_DTYPE)
+
+
+def event_bytes(event):
+    """Raw MIDI bytes for one EVENT_DTYPE row."""
+    tick, seconds, kind, channel, note, velocity, control, value = event.item()
+    status = kind << 4 | channel
+    if kind in (NOTE_ON, NOTE_OFF):
+        return [status, note, velocity]
+    if kind == CONTROL_CHANGE:
+        return [status, control, value]
+    if kind in (PROGRAM_CHANGE, AFTERTOUCH):
+        return [status, value]
+    if kind == PITCHWHEEL:
+        value += 8192
+        return [status, value & 0x7F, value >> 7]
+    return [status, note, value]  # polytouch
+
+
+def event_message(event):
+    return mido.Message.from_bytes(event_bytes(event))
+
+
+class MidiCache:
+    """Decoded MIDI files, kept in memory (LRU) and as .npy sidecars on disk.
+
+    Entries are keyed by path, size and mtime, so editing a file invalidates
+    it; the disk copy saves re-parsing it with mido on the next run.
+    """
+
+    def __init__(self, cache_dir=None, max_entries=8):
+        self.cache_dir = os.path.join(cache_dir or CACHE_DIR, 'midi')
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # Playlist prefetching loads files from a background thread
+        self._lock = threading.Lock()
+
+    def _sidecar_prefix(self, path):
+        return os.path.join(self.cache_dir, hashlib.sha1(path.encode('utf-8')).hexdigest())
+
+    @metrics.timed('midi.load')
+    def load(self, midi_file_path):
+        path = os.path.abspath(midi_file_path)
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+
+        with self._lock:
+            events = self._entries.get(key)
+            if events is not None:
+                self._entries.move_to_end(key)
+                metrics.count('midi.memory_hits')
+                return events
+
+        prefix = self._sidecar_prefix(path)
+        sidecar = f'{prefix}-{stat.st_size}-{stat.st_mtime_ns}.npy'
+        try:
+            events = np.load(sidecar, allow_pickle=False)
+            metrics.count('midi.disk_hits')
+        except (OSError, ValueError, EOFError):
+            with metrics.timer('midi.decode'):
+                events = decode_midi(path)
+            self._save(prefix, sidecar, events)
+
+        with self._lock:
+            self._entries[key] = events
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return events
+
+    def _save(self, prefix, sidecar, events):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Drop sidecars of older versions of this file. Temporary files are
+            # named sha1.*.tmp, so another process's half-written one never matches
+            for old in glob.glob(f'{prefix}-*.npy'):
+                if old != sidecar:
+                    try:
+                        os.remove(old)
+                    except FileNotFoundError:
+                        pass  # Another process dropped it first
+            with tempfile.NamedTemporaryFile(dir=self.cache_dir, prefix=f'{os.path.basename(prefix)}.',
+                                             suffix='.tmp', delete=False) as f:
+                tmp_path = f.name
+                np.save(f, events)
+            os.replace(tmp_path, sidecar)
+        except OSError as e:
+            log.warning("Could not write MIDI cache: %s", e)
+
+
+_cache = None
+
+
+def load_midi(midi_file_path):
+    """Decoded events for a MIDI file, from the shared in-process cache."""
+    global _cache
+    if _cache is None:
+        _cache = MidiCache()
+    return _cache.load(midi_file_path)
+
+
+class TimeIndex:
+    """Finds the resume point in an event array and what was sounding there.
+
+    events['time'] is already the cumulative time of each event, so the resume
+    point is a binary search. The controller/pedal state and the notes still
+    sounding are snapshotted every CHECKPOINT_EVERY events; the state at any
+    event is its checkpoint plus at most that many events replayed.
+    """
+
+    CHECKPOINT_EVERY = 512
+
+    def __init__(self, events):
+        self.events = events
+        self.times = events['time']
+        self._checkpoints = []
+        state = _PlayState()
+        for start in range(0, len(events), self.CHECKPOINT_EVERY):
+            self._checkpoints.append(state.copy())
+            for event in events[start:start + self.CHECKPOINT_EVERY].tolist():
+                state.apply(event)
+
+    def index_at(self, seconds):
+        """Index of the first event at or after seconds."""
+        return int(np.searchsorted(self.times, seconds, side='left'))
+
+    def state_at(self, index):
+        if not self._checkpoints:
+            return _PlayState()
+        checkpoint = min(index // self.CHECKPOINT_EVERY, len(self._checkpoints) - 1)
+        state = self._checkpoints[checkpoint].copy()
+        for event in self.events[checkpoint * self.CHECKPOINT_EVERY:index].tolist():
+            state.apply(event)
+        return state
+
+    def resume(self, seconds):
+        """(index, messages): where to continue and what to send first so it sounds right."""
+        index = self.index_at(seconds)
+        return index, self.state_at(index).messages()
+
+
+class _PlayState:
+    # Controllers, programs and pitch bend per channel, plus the notes that
+    # are sounding: held down, or released while the sustain pedal was down
+
+    def __init__(self):
+        self.controls = {}
+        self.programs = {}
+        self.pitch = {}
+        self.held = {}
+        self.sustained = {}
+
+    def copy(self):
+        state = _PlayState()
+        state.controls = dict(self.controls)
+        state.programs = dict(self.programs)
+        state.pitch = dict(self.pitch)
+        state.held = dict(self.held)
+        state.sustained = dict(self.sustained)
+        return state
+
+    def apply(self, event):
+        tick, seconds, kind, channel, note, velocity, control, value = event
+        if kind == NOTE_ON:
+            self.held[channel, note] = velocity
+            self.sustained.pop((channel, note), None)
+        elif kind == NOTE_OFF:
+            velocity = self.held.pop((channel, note), None)
+            if velocity is not None and self.controls.get((channel, SUSTAIN_PEDAL), 0) >= 64:
+                self.sustained[channel, note] = velocity
+        elif kind == CONTROL_CHANGE:
+            self.controls[channel, control] = value
+            if control == SUSTAIN_PEDAL and value < 64:
+                for key in [key for key in self.sustained if key[0] == channel]:
+                    del self.sustained[key]
+        elif kind == PROGRAM_CHANGE:
+            self.programs[channel] = value
+        elif kind == PITCHWHEEL:
+            self.pitch[channel] = value
+
+    def messages(self):
+        messages = [mido.Message('program_change', channel=channel, program=program)
+                    for channel, program in self.programs.items()]
+        messages += [mido.Message('pitchwheel', channel=channel, pitch=pitch)
+                     for channel, pitch in self.pitch.items()]
+        messages += [mido.Message('control_change', channel=channel, control=control, value=value)
+                     for (channel, control), value in self.controls.items()]
+        # Strike everything that should be sounding; notes only the pedal was
+        # holding are released again straight away and ring on through the pedal
+        for (channel, note), velocity in list(self.held.items()) + list(self.sustained.items()):
+            messages.append(mido.Message('note_on', channel=channel, note=note, velocity=velocity))
+        for channel, note in self.sustained:
+            messages.append(mido.Message('note_off', channel=channel, note=note))
+        return messages
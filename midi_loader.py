@@ -0,0 +1,76 @@
+import logging
+
+from PyQt6.QtCore import QObject, QThread, pyqtSignal
+
+from midi_cache import load_midi
+
+log = logging.getLogger(__name__)
+
+
+class MidiLoader(QObject):
+    """Decodes MIDI files (through midi_cache) on a background thread, newest request wins.
+
+    load(path, context) hands the file to the worker thread tagged with a
+    generation number; loaded(events, context) is emitted on the GUI thread
+    for the latest request only, or failed(message). A long file decoding for
+    the first time takes seconds, this keeps that off the event loop.
+    """
+
+    loaded = pyqtSignal(object, object)
+    failed = pyqtSignal(str)
+    _requested = pyqtSignal(int, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.generation = 0
+        self._context = None  # Of the latest request
+        self._thread = QThread()
+        self._runner = _Runner(self)
+        self._runner.moveToThread(self._thread)
+        self._requested.connect(self._runner.run)  # Queued: the runner lives on the worker thread
+        self._runner.finished.connect(self._on_finished)
+        self._runner.failed.connect(self._on_failed)
+        self._thread.start()
+
+    def load(self, path, context=None):
+        self.generation += 1
+        self._context = context
+        self._requested.emit(self.generation, path)
+
+    def cancel(self):
+        self.generation += 1
+
+    def is_current(self, generation):
+        return generation == self.generation
+
+    def _on_finished(self, generation, events):
+        if self.is_current(generation):
+            self.loaded.emit(events, self._context)
+
+    def _on_failed(self, generation, message):
+        if self.is_current(generation):
+            self.failed.emit(message)
+
+    def shutdown(self):
+        self.cancel()
+        self._thread.quit()
+        self._thread.wait()
+
+
+class _Runner(QObject):
+    finished = pyqtSignal(int, object)
+    failed = pyqtSignal(int, str)
+
+    def __init__(self, loader):
+        super().__init__()
+        self._loader = loader
+
+    def run(self, generation, path):
+        if not self._loader.is_current(generation):
+            return  # Another file was asked for while this one was queued
+        try:
+            events = load_midi(path)
+        except Exception as e:
+            self.failed.emit(generation, f"Error loading MIDI file: {e}")
+            return
+        self.finished.emit(generation, events)
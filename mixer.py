@@ -0,0 +1,311 @@
+import heapq
+import threading
+import time
+
+import mido
+import numpy as np
+
+from midi_cache import NOTE_ON, TimeIndex, event_message
+from playback import DEFAULT_CHANNEL_VOLUME, ScheduledEngine
+
+# MIDI channel of each stream, in load order; channel 10 (9 counting from 0)
+# is the drum kit on General MIDI synthesizers
+STREAM_CHANNELS = [channel for channel in range(16) if channel != 9]
+
+# How load() can put the streams on the reference stream's timeline, see tempo_anchors()
+ALIGN_MODES = ('notes', 'duration', None)
+
+# Points matched between two performances with align='notes'
+ALIGN_ANCHORS = 64
+
+_CLOSED = object()  # A port that failed to open, not retried until the next load
+
+
+def onset_times(events):
+    return events['time'][events['kind'] == NOTE_ON]
+
+
+def tempo_anchors(events, reference, align='notes', anchors=ALIGN_ANCHORS):
+    """(times in events, matching times in reference) of a piecewise-linear time map.
+
+    'notes' maps the moment a given fraction of the notes has been played in
+    one performance to the moment the same fraction has been played in the
+    other, at anchors evenly spaced fractions. Performances of one piece play
+    (nearly) the same notes, so this follows rubato and tempo changes, not
+    just the overall tempo. 'duration' only stretches first to last note onto
+    the reference's; None leaves the timing alone.
+    """
+    own, target = onset_times(events), onset_times(reference)
+    if align is None or len(own) < 2 or len(target) < 2:
+        return np.array([0.0, 1.0]), np.array([0.0, 1.0])
+    fractions = np.linspace(0.0, 1.0, (anchors if align == 'notes' else 1) + 1)
+    source = np.quantile(own, fractions)
+    target = np.maximum.accumulate(np.quantile(target, fractions))
+    # Chords give equal onset times, np.interp needs them increasing
+    keep = np.concatenate([[True], np.diff(source) > 1e-6])
+    return source[keep], target[keep]
+
+
+def warp_times(times, source, target):
+    """times mapped through the anchors; outside them time runs at normal speed."""
+    warped = np.interp(times, source, target)
+    warped = np.where(times < source[0], target[0] + (times - source[0]), warped)
+    warped = np.where(times > source[-1], target[-1] + (times - source[-1]), warped)
+    return np.maximum(warped, 0.0)
+
+
+def channel_silence(channel, cut=False):
+    # Sustain pedal up and all notes off on one channel; cut also stops the
+    # sound at once (all sound off) instead of letting notes ring out
+    return [mido.Message('control_change', channel=channel, control=64, value=0),
+            mido.Message('control_change', channel=channel, control=120 if cut else 123, value=0)]
+
+
+class Stream:
+    """One performance in a mix.
+
+    source is the decoded EVENT_DTYPE array; events is the copy the mixer
+    plays, moved to the stream's own channel and, once aligned, with its
+    times on the common timeline. port is an output port name, None for the
+    default one (or the backend's).
+    """
+
+    def __init__(self, events, name='', port=None, gain=1.0, muted=False):
+        self.source = events
+        self.name = name
+        self.port = port
+        self.gain = gain
+        self.muted = muted
+        self.channel = 0
+        self.events = events
+        self.times = events['time']
+        self.index = 0
+        self.time_index = None
+        self.channel_volume = DEFAULT_CHANNEL_VOLUME  # Last CC7 of the performance, before gain
+
+    @property
+    def duration(self):
+        return float(self.times[-1]) if len(self.times) else 0.0
+
+    def prepare(self, channel, source=None, target=None):
+        """Move to channel and onto the common timeline through the anchors of tempo_anchors()."""
+        events = self.source.copy()
+        events['channel'] = channel
+        if source is not None:
+            events['time'] = warp_times(events['time'], source, target)
+        self.channel = channel
+        self.events = events
+        self.times = events['time']
+        self.index = 0
+        self.time_index = None
+        self.channel_volume = DEFAULT_CHANNEL_VOLUME
+
+
+def prepare_streams(streams, align='notes', reference=0):
+    """Give every stream its channel and align it to streams[reference]; see tempo_anchors()."""
+    if align not in ALIGN_MODES:
+        raise ValueError(f"align must be one of {ALIGN_MODES}, not {align!r}")
+    if len(streams) > len(STREAM_CHANNELS):
+        raise ValueError(f"At most {len(STREAM_CHANNELS)} streams can be mixed, one per MIDI channel")
+    for number, stream in enumerate(streams):
+        if align is None or number == reference:
+            stream.prepare(STREAM_CHANNELS[number])
+        else:
+            stream.prepare(STREAM_CHANNELS[number], *tempo_anchors(stream.source, streams[reference].source, align))
+    return streams
+
+
+class MixerEngine(ScheduledEngine):
+    """Plays several performances at once, in sync, from a dedicated thread.
+
+    Each stream keeps its own event array; the next event of every stream
+    sits in a heap keyed by its time, so the schedule is a k-way merge that
+    pops the earliest event, sends it and pushes that stream's next one.
+    Streams can be muted, turned up or down and moved to another port while
+    playing without rebuilding anything. Each stream has a MIDI channel of
+    its own, so streams sharing a port never cut off each other's notes, and
+    gain is that channel's volume (CC7). Commands, pause, seek and stop are
+    ScheduledEngine's.
+    """
+
+    THREAD_NAME = 'midi-mixer'
+
+    def __init__(self, backend=None, on_position=None, on_state=None, position_interval=0.05):
+        super().__init__(backend, on_position, on_state, position_interval)
+        self.streams = []  # The streams playing, replaced by the playback thread on load
+        self._ports = {}  # port name -> open port, or _CLOSED
+        self._heap = []  # (time on the common timeline, stream number), one per stream with events left
+
+    # Commands, safe to call from any thread
+
+    def load(self, streams, align='notes', reference=0, position=0.0):
+        """Replace the mix with streams aligned to streams[reference] (see tempo_anchors()), paused at position.
+
+        Returns the streams; stream numbers in the other commands are positions in this list.
+        """
+        streams = prepare_streams(list(streams), align, reference)
+        for stream in streams:
+            # Building the index walks every event once, keep that off the scheduler
+            threading.Thread(target=self._build_time_index, args=(stream, stream.events), daemon=True).start()
+        self._send_command('load', (streams, position))
+        return streams
+
+    def play(self):
+        self._send_command('play')
+
+    def set_volume(self, volume):
+        """Master gain, 0.0 to 1.0, applied on top of every stream's."""
+        self._send_command('volume', volume)
+
+    def set_gain(self, number, gain):
+        self._send_command('gain', (number, gain))
+
+    def set_muted(self, number, muted):
+        self._send_command('mute', (number, muted))
+
+    def solo(self, number):
+        """Mute every stream but one: flipping between them is an A/B comparison in sync."""
+        self._send_command('solo', number)
+
+    def set_port(self, number, port_name):
+        """Send a stream to another output port (None for the default) from where it is now."""
+        self._send_command('route', (number, port_name))
+
+    @property
+    def duration(self):
+        return max((stream.duration for stream in self.streams), default=0.0)
+
+    @staticmethod
+    def _build_time_index(stream, events):
+        time_index = TimeIndex(events)
+        if stream.events is events:
+            stream.time_index = time_index
+
+    # Playback thread
+
+    def _port(self, name):
+        port = self._ports.get(name)
+        if port is None:
+            port = self._open_port(name)
+            self._ports[name] = port = port if port is not None else _CLOSED
+        return None if port is _CLOSED else port
+
+    def _close(self):
+        for name, port in self._ports.items():
+            if port is not _CLOSED:
+                self._close_port(name, port)
+        self._ports = {}
+
+    def _send(self, stream, msg):
+        port = self._port(stream.port)
+        if port is None:
+            return
+        if msg.type == 'note_on' and stream.muted:
+            return
+        if msg.type == 'control_change' and msg.control == 7:
+            # The file's own channel volume is scaled rather than replaced
+            stream.channel_volume = msg.value
+            msg.value = round(msg.value * stream.gain * self.volume)
+        port.send(msg)
+
+    def _send_gain(self, stream):
+        # The performance's own level again, scaled by the gains in _send
+        self._send(stream, mido.Message('control_change', channel=stream.channel, control=7,
+                                        value=stream.channel_volume))
+
+    def _send_volume(self):
+        for stream in self.streams:
+            self._send_gain(stream)
+
+    def _silence_stream(self, stream, cut=False):
+        port = self._port(stream.port)
+        if port is not None:
+            for msg in channel_silence(stream.channel, cut):
+                port.send(msg)
+
+    def _silence(self):
+        for stream in self.streams:
+            self._silence_stream(stream)
+
+    def _resume_at(self, seconds, restore=True):
+        # Every stream continues from seconds
+        for stream in self.streams:
+            time_index = stream.time_index
+            if restore:
+                if time_index is None or time_index.events is not stream.events:
+                    time_index = stream.time_index = TimeIndex(stream.events)
+                stream.index, messages = time_index.resume(seconds)
+                for msg in messages:
+                    self._send(stream, msg)
+            else:
+                stream.index = int(np.searchsorted(stream.times, seconds))
+        self._reschedule()
+
+    def _reschedule(self):
+        self._heap = [(float(stream.times[stream.index]), number) for number, stream in enumerate(self.streams)
+                      if stream.index < len(stream.times)]
+        heapq.heapify(self._heap)
+
+    def _next_time(self):
+        return self._heap[0][0] if self._heap else None
+
+    def _send_due(self, now):
+        # Everything due by now goes out in time order, across all streams
+        while self._heap and self._origin + self._heap[0][0] <= now:
+            seconds, number = self._heap[0]
+            stream = self.streams[number]
+            self._record_lateness('mixer.lateness', now - (self._origin + seconds))
+            self._send(stream, event_message(stream.events[stream.index]))
+            stream.index += 1
+            if stream.index < len(stream.times):
+                heapq.heapreplace(self._heap, (float(stream.times[stream.index]), number))
+            else:
+                heapq.heappop(self._heap)
+            now = time.perf_counter()
+
+    def _handle_command(self, name, argument, issued):
+        if name == 'load':
+            self._silence()
+            self._close()
+            self.streams, self._offset = argument
+            self.jitter.clear()
+            self._send_volume()
+            self._resume_at(self._offset, restore=False)
+            if self.state == 'playing':
+                self._set_state('paused')
+            self._report_position()
+        elif name == 'play':
+            if self.state != 'playing' and self.streams:
+                self._resume_at(self._offset, restore=self._offset > 0)
+                self._origin = time.perf_counter() - self._offset
+                self._set_state('playing')
+        elif name == 'gain':
+            number, gain = argument
+            if number < len(self.streams):
+                self.streams[number].gain = min(max(gain, 0.0), 1.0)
+                self._send_gain(self.streams[number])
+        elif name in ('mute', 'solo'):
+            for number, stream in enumerate(self.streams):
+                if name == 'mute':
+                    if number != argument[0]:
+                        continue
+                    muted = argument[1]
+                else:
+                    muted = number != argument
+                if muted and not stream.muted:
+                    self._silence_stream(stream, cut=True)
+                stream.muted = muted
+        elif name == 'route':
+            number, port_name = argument
+            if number < len(self.streams) and self.streams[number].port != port_name:
+                stream = self.streams[number]
+                self._silence_stream(stream, cut=True)
+                stream.port = port_name
+                self._send_gain(stream)
+                if self.state == 'playing' and stream.time_index is not None:
+                    # Pick up on the new port with what is sounding now
+                    stream.index, messages = stream.time_index.resume(self.position())
+                    for msg in messages:
+                        self._send(stream, msg)
+                    self._reschedule()
+        return True
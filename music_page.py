@@ -0,0 +1,325 @@
+import logging
+import threading
+
+from PyQt6.QtCore import QObject, Qt, pyqtSignal
+from PyQt6.QtWidgets import QCheckBox, QHBoxLayout, QLabel, QListWidget, QPushButton, QSlider, QVBoxLayout, QWidget
+
+from midi_cache import load_midi
+from midi_loader import MidiLoader
+from piano_roll import PianoRoll
+from playback import PlaybackEngine
+from playlist import Playlist
+
+log = logging.getLogger(__name__)
+
+
+class PlaybackSignals(QObject):
+    # The playback engine calls these from its own thread, Qt queues them to the GUI
+    positionChanged = pyqtSignal(float)
+    stateChanged = pyqtSignal(str)
+    trackChanged = pyqtSignal(object)
+
+
+class MusicPage(QWidget):
+    def __init__(self, audio_backend=None):
+        super().__init__()
+        self.selected_midi_file = None
+        self.playlist = Playlist.load()  # Picks up the last session's queue
+        # Playlist items are tracked by id (see Playlist), rows move when items are removed
+        self.playlist_id = None  # Playlist item being played, None for a single file
+        self.prefetch_id = None  # Playlist item queued to follow it
+        # "Play something similar": see set_similarity
+        self.similarity = None
+        self.dataset_index = None
+        self.titles = {}
+        self.selection_midi = None  # File last started with Play
+        self.current_midi = None  # File playing now, or last played
+        self.played = set()  # Catalog filenames played this session, not suggested again
+        self.signals = PlaybackSignals()
+        # Files are decoded off the GUI thread; the engine is started when they are ready
+        self.midi_loader = MidiLoader(parent=self)
+        self.midi_loader.loaded.connect(self.on_midi_loaded)
+        self.midi_loader.failed.connect(log.error)
+        self.engine = PlaybackEngine(audio_backend,
+                                     on_position=self.signals.positionChanged.emit,
+                                     on_state=self.signals.stateChanged.emit,
+                                     on_track=self.signals.trackChanged.emit)
+        self.initUI()
+        self.signals.positionChanged.connect(self.updatePosition)
+        self.signals.stateChanged.connect(self.updateState)
+        self.signals.trackChanged.connect(self.updateTrack)
+
+    def initUI(self):
+        layout = QVBoxLayout(self)
+
+        self.sld = QSlider(Qt.Orientation.Vertical)
+        self.sld.setFocusPolicy(Qt.FocusPolicy.NoFocus)
+        self.sld.setFixedSize(30, 100)
+        self.sld.setRange(0, 100)
+        self.sld.setValue(100)
+        self.sld.valueChanged.connect(self.changeValue)
+        self.label = QLabel('Volume: 100')
+
+        slider_hbox = QHBoxLayout()
+        slider_hbox.addWidget(self.sld)
+        slider_hbox.addWidget(self.label)
+        layout.addLayout(slider_hbox)
+
+        # Position in the piece, in milliseconds; dragging it seeks
+        self.position_slider = QSlider(Qt.Orientation.Horizontal)
+        self.position_slider.sliderReleased.connect(self.seekMidiFile)
+        self.position_label = QLabel('0:00 / 0:00')
+
+        position_hbox = QHBoxLayout()
+        position_hbox.addWidget(self.position_slider)
+        position_hbox.addWidget(self.position_label)
+        layout.addLayout(position_hbox)
+
+        # Notes of the piece being played; clicking in it seeks there
+        self.piano_roll = PianoRoll()
+        self.piano_roll.seekRequested.connect(self.engine.seek)
+        layout.addWidget(self.piano_roll)
+
+        self.playButton = QPushButton("Play")
+        self.playButton.clicked.connect(self.playMidiFile)
+        self.stopButton = QPushButton("Stop")
+        self.stopButton.clicked.connect(self.stopMidiFile)
+        self.pauseButton = QPushButton("Pause")
+        self.pauseButton.clicked.connect(self.pauseMidiFile)
+
+        hbox = QHBoxLayout()
+        hbox.addWidget(self.playButton)
+        hbox.addWidget(self.stopButton)
+        hbox.addWidget(self.pauseButton)
+
+        layout.addLayout(hbox)
+
+        self.similarButton = QPushButton("Play Something Similar")
+        self.similarButton.clicked.connect(self.playSimilar)
+        self.similarButton.setEnabled(False)
+        self.similarButton.setToolTip("Run features.py on the catalog first")
+        self.similar_check = QCheckBox("Keep playing similar pieces")
+        self.similar_label = QLabel()
+        self.similar_label.setWordWrap(True)
+
+        similar_hbox = QHBoxLayout()
+        similar_hbox.addWidget(self.similarButton)
+        similar_hbox.addWidget(self.similar_check)
+        layout.addLayout(similar_hbox)
+        layout.addWidget(self.similar_label)
+
+        self.playlist_view = QListWidget()
+        self.playlist_view.itemDoubleClicked.connect(lambda item: self.playPlaylistItem(self.playlist_view.row(item)))
+        layout.addWidget(self.playlist_view)
+
+        self.playPlaylistButton = QPushButton("Play Playlist")
+        self.playPlaylistButton.clicked.connect(self.playPlaylist)
+        self.nextButton = QPushButton("Next")
+        self.nextButton.clicked.connect(self.nextTrack)
+        self.removeButton = QPushButton("Remove")
+        self.removeButton.clicked.connect(self.removeFromPlaylist)
+        self.clearButton = QPushButton("Clear")
+        self.clearButton.clicked.connect(self.clearPlaylist)
+
+        playlist_hbox = QHBoxLayout()
+        playlist_hbox.addWidget(self.playPlaylistButton)
+        playlist_hbox.addWidget(self.nextButton)
+        playlist_hbox.addWidget(self.removeButton)
+        playlist_hbox.addWidget(self.clearButton)
+        layout.addLayout(playlist_hbox)
+        self.refreshPlaylist()
+
+    def changeValue(self, value):
+        self.label.setText(f'Volume: {value}')
+        # Applied by the engine at send time, the file's velocities are left alone
+        self.engine.set_volume(value / 100)
+
+    def playMidiFile(self):
+        # Ensure that the selected_midi_file attribute is set by the selection changed method
+        midi_file_path = self.selected_midi_file
+
+        if midi_file_path is None:
+            log.info("MIDI file has not been selected.")
+            return
+
+        # Decoded once, then served from the cache
+        self.midi_loader.load(midi_file_path, ('selection', midi_file_path, 0.0))
+
+    def on_midi_loaded(self, events, context):
+        tag, midi_file_path, position = context
+        if tag == 'selection':
+            self.selection_midi = midi_file_path
+        # The engine plays on its own thread, so the window stays responsive
+        self.engine.play(events, tag=tag)
+        if position:
+            self.engine.seek(position)
+
+    def set_similarity(self, similarity, dataset_index, titles):
+        """Enable "play something similar" with a SimilarityIndex; titles maps catalog filenames to names."""
+        self.similarity = similarity
+        self.dataset_index = dataset_index
+        self.titles = titles
+        self.similarButton.setEnabled(similarity is not None)
+        self.similarButton.setToolTip("" if similarity is not None else "Run features.py on the catalog first")
+
+    def playSimilar(self):
+        if self.similarity is None or self.current_midi is None:
+            log.info("Play a piece first, then the most similar one can be found.")
+            return
+        key = self.dataset_index.filename(self.current_midi)
+        for other, score in self.similarity.similar(key, count=20, exclude=self.played):
+            path = self.dataset_index.path(other)
+            if path is None:
+                continue
+            self.similar_label.setText(f"Similar ({score:.0%}): {self.titles.get(other, other)}")
+            self.selected_midi_file = path
+            self.playMidiFile()
+            return
+        log.info("No similar piece left to play.")
+
+    def addToPlaylist(self, items):
+        self.playlist.add(items)
+        self.refreshPlaylist()
+
+    def refreshPlaylist(self):
+        self.playlist_view.clear()
+        self.playlist_view.addItems([item['title'] for item in self.playlist.items])
+        row = self.playlist.row(self.playlist_id)
+        if row is not None:
+            self.playlist_view.setCurrentRow(row)
+
+    def removeFromPlaylist(self):
+        row = self.playlist_view.currentRow()
+        if row < 0:
+            return
+        following = self.playlist.item(row + 1)
+        removed = self.playlist.item(row)['id']
+        self.playlist.remove(row)
+        self.refreshPlaylist()
+        if removed == self.playlist_id:
+            # The piece plays to its end, then the one that came after it
+            self.prefetch(following and following['id'])
+        elif self.playlist_id is not None:
+            self.prefetchNext(self.playlist_id)  # The piece queued next may be the one removed
+
+    def clearPlaylist(self):
+        self.playlist.clear()
+        # What is playing finishes as a single piece, nothing follows it
+        self.playlist_id = None
+        self.prefetch(None)
+        self.refreshPlaylist()
+
+    def playPlaylist(self):
+        if not len(self.playlist):
+            log.info("The playlist is empty.")
+            return
+        # Resume the saved item where it stopped, unless another one is picked
+        row = self.playlist_view.currentRow()
+        if row < 0 or row == self.playlist.current:
+            self.playPlaylistItem(self.playlist.current, self.playlist.position)
+        else:
+            self.playPlaylistItem(row)
+
+    def playPlaylistItem(self, index, position=0.0):
+        item = self.playlist.item(index)
+        if item is None:
+            return
+        self.midi_loader.load(item['midi'], (item['id'], item['midi'], position))
+
+    def nextTrack(self):
+        if self.playlist_id is not None:
+            index = self.playlist.row(self.prefetch_id) if self.prefetch_id is not None else None
+        else:
+            index = self.playlist.next_index()
+        if index is not None:
+            self.playPlaylistItem(index)
+
+    def prefetchNext(self, item_id):
+        # The item after item_id follows it
+        row = self.playlist.row(item_id)
+        next_index = self.playlist.next_index(row) if row is not None else None
+        following = self.playlist.item(next_index) if next_index is not None else None
+        self.prefetch(following and following['id'])
+
+    def prefetch(self, item_id):
+        # Decode the item in the background and queue it in the engine, so it
+        # starts the moment the current one ends; None drops what is queued
+        self.prefetch_id = item_id
+        self.engine.cancel_next()
+        if item_id is not None:
+            item = self.playlist.item(self.playlist.row(item_id))
+            threading.Thread(target=self._prefetch, args=(item_id, item['midi']), daemon=True).start()
+
+    def _prefetch(self, item_id, midi_file_path):
+        try:
+            events = load_midi(midi_file_path)
+        except Exception as e:
+            log.error("Error loading MIDI file: %s", e)
+            return
+        if self.prefetch_id == item_id:
+            self.engine.queue_next(events, tag=item_id)
+
+    def updateTrack(self, tag):
+        if tag is None:
+            # Ran out of queued pieces; if the prefetch was too late, start the next one now
+            row = self.playlist.row(self.prefetch_id) if self.prefetch_id is not None else None
+            if self.playlist_id is not None and row is not None:
+                self.playPlaylistItem(row)
+            elif self.playlist_id is None and self.similar_check.isChecked():
+                # A single piece ended: go on with the closest one not played yet
+                self.playSimilar()
+            return
+        row = self.playlist.row(tag) if tag != 'selection' else None
+        item = self.playlist.item(row) if row is not None else None
+        self.current_midi = self.selection_midi if tag == 'selection' else item and item['midi']
+        if self.dataset_index is not None and self.current_midi:
+            self.played.add(self.dataset_index.filename(self.current_midi))
+        self.position_slider.setRange(0, int(self.engine.duration * 1000))
+        self.piano_roll.set_events(self.engine.events)
+        if tag == 'selection' or row is None:
+            # A single file, or an item removed while it was loading
+            self.playlist_id = None
+            self.prefetch_id = None
+            return
+        self.playlist_id = tag
+        self.playlist.set_current(row)
+        self.playlist_view.setCurrentRow(row)
+        self.prefetchNext(tag)
+
+    def stopMidiFile(self):
+        self.engine.stop()
+
+    def pauseMidiFile(self):
+        if self.engine.state == 'playing':
+            self.engine.pause()
+        elif self.engine.state == 'paused':
+            self.engine.play()
+
+    def seekMidiFile(self):
+        self.engine.seek(self.position_slider.value() / 1000)
+
+    def updatePosition(self, seconds):
+        current = self.playlist.item(self.playlist.current)
+        if current is not None and current['id'] == self.playlist_id:
+            self.playlist.position = seconds  # Saved with the playlist on exit
+        if not self.position_slider.isSliderDown():
+            self.position_slider.setValue(int(seconds * 1000))
+        self.position_label.setText(f'{format_time(seconds)} / {format_time(self.engine.duration)}')
+        self.piano_roll.set_position(seconds)
+
+    def updateState(self, state):
+        self.pauseButton.setText("Resume" if state == 'paused' else "Pause")
+
+    def shutdown(self):
+        self.midi_loader.shutdown()
+        self.engine.shutdown()
+        self.playlist.save()
+
+    def closeEvent(self, event):
+        self.shutdown()
+        super().closeEvent(event)
+
+
+def format_time(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f'{minutes}:{seconds:02d}'
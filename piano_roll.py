@@ -0,0 +1,262 @@
+import numpy as np
+
+from PyQt6.QtCore import QRect, QRectF, Qt, pyqtSignal
+from PyQt6.QtGui import QColor, QImage, QPainter, QPen, QPixmap, qRgb
+from PyQt6.QtWidgets import QWidget
+
+from midi_cache import NOTE_OFF, NOTE_ON
+
+# Seconds per time bucket at the finest level of the density pyramid
+BUCKET_SECONDS = 0.025
+
+NOTE_DTYPE = np.dtype([
+    ('start', np.float64),
+    ('end', np.float64),
+    ('pitch', np.uint8),
+    ('velocity', np.uint8),
+])
+
+
+def note_spans(events):
+    """NOTE_DTYPE array of every note in an EVENT_DTYPE array, sorted by start.
+
+    A note off ends the oldest sounding note of its channel and pitch; notes
+    never released end with the last event.
+    """
+    notes = events[(events['kind'] == NOTE_ON) | (events['kind'] == NOTE_OFF)]
+    end_of_piece = float(events['time'][-1]) if len(events) else 0.0
+    sounding = {}  # (channel, pitch) -> [(start, velocity), ...]
+    spans = []
+    for seconds, kind, channel, pitch, velocity in zip(notes['time'].tolist(), notes['kind'].tolist(),
+                                                      notes['channel'].tolist(), notes['note'].tolist(),
+                                                      notes['velocity'].tolist()):
+        if kind == NOTE_ON:
+            sounding.setdefault((channel, pitch), []).append((seconds, velocity))
+        else:
+            started = sounding.get((channel, pitch))
+            if started:
+                start, velocity = started.pop(0)
+                spans.append((start, seconds, pitch, velocity))
+    for (channel, pitch), started in sounding.items():
+        spans.extend((start, end_of_piece, pitch, velocity) for start, velocity in started)
+    spans = np.array(spans, dtype=NOTE_DTYPE)
+    return spans[np.argsort(spans['start'], kind='stable')]
+
+
+class DensityPyramid:
+    """Where every pitch sounds over time, at halving resolutions.
+
+    Level 0 has one column per BUCKET_SECONDS and only records presence: 255
+    if the pitch sounds at any point in the bucket, 0 if not (a note shorter
+    than a bucket fills it all). Each level above averages pairs of columns
+    of the one below, so its values are the share of level 0 buckets in which
+    the pitch sounds, 0 to 255. Any view of the piece can be drawn from the
+    level with about one column per pixel: the work depends on the width of
+    the widget, not on the length of the piece. Rows are pitches low to high.
+    """
+
+    def __init__(self, spans, bucket_seconds=BUCKET_SECONDS):
+        self.bucket_seconds = bucket_seconds
+        if len(spans):
+            self.low, self.high = int(spans['pitch'].min()), int(spans['pitch'].max())
+            columns = int(np.ceil(spans['end'].max() / bucket_seconds)) + 1
+        else:
+            self.low, self.high, columns = 60, 60, 1
+        # +1 at the bucket a note starts in, -1 after the one it ends in; a running sum is then the
+        # number of notes touching each bucket, of which only "any" is kept
+        rows = spans['pitch'].astype(np.intp) - self.low
+        first = np.floor(spans['start'] / bucket_seconds).astype(np.intp)
+        stop = np.maximum(np.ceil(spans['end'] / bucket_seconds).astype(np.intp), first + 1)
+        steps = np.zeros((self.high - self.low + 1, columns + 1), dtype=np.int16)
+        np.add.at(steps, (rows, first), 1)
+        np.add.at(steps, (rows, stop), -1)
+        level = (np.cumsum(steps, axis=1, dtype=np.int16)[:, :columns] > 0).astype(np.uint8) * 255
+        self.levels = [level]
+        while level.shape[1] > 1:
+            if level.shape[1] % 2:
+                level = np.pad(level, ((0, 0), (0, 1)))
+            level = ((level[:, 0::2].astype(np.uint16) + level[:, 1::2] + 1) // 2).astype(np.uint8)
+            self.levels.append(level)
+
+    @property
+    def pitches(self):
+        return self.high - self.low + 1
+
+    def level_for(self, seconds_per_pixel):
+        """The coarsest level whose buckets are no wider than a pixel."""
+        level = 0
+        while (level + 1 < len(self.levels)
+               and self.bucket_seconds * 2 ** (level + 1) <= seconds_per_pixel):
+            level += 1
+        return level
+
+    def window(self, level, start, stop):
+        """(columns, first column's start in seconds, bucket seconds) covering start..stop."""
+        bucket = self.bucket_seconds * 2 ** level
+        columns = self.levels[level]
+        first = max(int(np.floor(start / bucket)), 0)
+        last = min(int(np.ceil(stop / bucket)), columns.shape[1])
+        return columns[:, first:max(last, first)], first * bucket, bucket
+
+
+class PianoRoll(QWidget):
+    """The notes of the piece being played, with a playhead.
+
+    Zoomed out, the view is drawn from a DensityPyramid level as one image;
+    zoomed in far enough that a bucket is wider than a pixel, the notes in
+    view are drawn one by one. Either way the drawing is cached in a pixmap,
+    so moving the playhead only repaints the columns it left and entered. The
+    view pages forward when the playhead runs off its right edge. The wheel
+    zooms around the pointer; a click asks for a seek.
+    """
+
+    seekRequested = pyqtSignal(float)
+
+    MIN_SECONDS = 2.0
+    PLAYHEAD_WIDTH = 2
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setMinimumHeight(120)
+        self.setAttribute(Qt.WidgetAttribute.WA_OpaquePaintEvent)
+        self.spans = np.zeros(0, dtype=NOTE_DTYPE)
+        self.pyramid = DensityPyramid(self.spans)
+        self.duration = 0.0
+        self.view_start = 0.0
+        self.view_seconds = 30.0
+        self.position = 0.0
+        self._longest = 0.0
+        self._background = None
+        self._colors = None
+
+    def set_events(self, events):
+        self.set_notes(note_spans(events))
+
+    def set_notes(self, spans):
+        self.spans = spans
+        self.pyramid = DensityPyramid(spans)
+        self.duration = float(spans['end'].max()) if len(spans) else 0.0
+        self._longest = float((spans['end'] - spans['start']).max()) if len(spans) else 0.0
+        self.view_start = 0.0
+        self.position = 0.0
+        self._invalidate()
+
+    def clear(self):
+        self.set_notes(np.zeros(0, dtype=NOTE_DTYPE))
+
+    def set_position(self, seconds):
+        old_x = self._x(self.position)
+        self.position = seconds
+        if not self.view_start <= seconds < self.view_start + self.view_seconds:
+            # Page so the playhead comes in near the left edge
+            self.view_start = max(seconds - self.view_seconds * 0.05, 0.0)
+            self._invalidate()
+            return
+        new_x = self._x(seconds)
+        if new_x != old_x:
+            self.update(self._playhead_rect(old_x))
+            self.update(self._playhead_rect(new_x))
+
+    def _x(self, seconds):
+        return int(round((seconds - self.view_start) / self.view_seconds * self.width()))
+
+    def _seconds(self, x):
+        return self.view_start + x / max(self.width(), 1) * self.view_seconds
+
+    def _playhead_rect(self, x):
+        return QRect(x - self.PLAYHEAD_WIDTH, 0, 2 * self.PLAYHEAD_WIDTH + 1, self.height())
+
+    def _invalidate(self):
+        self._background = None
+        self.update()
+
+    def resizeEvent(self, event):
+        self._background = None
+        super().resizeEvent(event)
+
+    def changeEvent(self, event):
+        self._background = None
+        self._colors = None
+        super().changeEvent(event)
+
+    def wheelEvent(self, event):
+        steps = event.angleDelta().y() / 120
+        if not steps:
+            return
+        anchor = self._seconds(event.position().x())
+        longest = max(self.duration, self.MIN_SECONDS)
+        seconds = min(max(self.view_seconds * 0.8 ** steps, self.MIN_SECONDS), longest)
+        # Keep the time under the pointer where it is
+        self.view_start = max(anchor - (anchor - self.view_start) * seconds / self.view_seconds, 0.0)
+        self.view_seconds = seconds
+        self._invalidate()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MouseButton.LeftButton and self.duration:
+            self.seekRequested.emit(min(max(self._seconds(event.position().x()), 0.0), self.duration))
+
+    def paintEvent(self, event):
+        if self._background is None or self._background.size() != self.size():
+            self._background = self._draw_background()
+        painter = QPainter(self)
+        rect = event.rect()
+        painter.drawPixmap(rect, self._background, rect)
+        x = self._x(self.position)
+        if rect.intersects(self._playhead_rect(x)):
+            painter.setPen(QPen(self.palette().highlight().color(), self.PLAYHEAD_WIDTH))
+            painter.drawLine(x, 0, x, self.height())
+        painter.end()
+
+    def _color_table(self):
+        # Density to colour, square-root scaled so sparse passages stay visible when zoomed out
+        if self._colors is None:
+            base = self.palette().base().color()
+            note = self.palette().text().color()
+            table = []
+            for value in range(256):
+                mix = (value / 255) ** 0.5
+                table.append(qRgb(*(round(a + (b - a) * mix) for a, b in
+                                    zip(base.getRgb()[:3], note.getRgb()[:3]))))
+            self._colors = table
+        return self._colors
+
+    def _draw_background(self):
+        pixmap = QPixmap(self.size())
+        pixmap.fill(self.palette().base().color())
+        width, height = self.width(), self.height()
+        if not len(self.spans) or width <= 0:
+            return pixmap
+        painter = QPainter(pixmap)
+        pyramid = self.pyramid
+        row_height = height / pyramid.pitches
+        start, stop = self.view_start, self.view_start + self.view_seconds
+        seconds_per_pixel = self.view_seconds / width
+        if seconds_per_pixel >= pyramid.bucket_seconds:
+            columns, first, bucket = pyramid.window(pyramid.level_for(seconds_per_pixel), start, stop)
+            if columns.shape[1]:
+                # High pitches at the top
+                data = np.ascontiguousarray(columns[::-1])
+                image = QImage(data.data, data.shape[1], data.shape[0], data.strides[0],
+                               QImage.Format.Format_Indexed8)
+                image.setColorTable(self._color_table())
+                left = (first - start) / self.view_seconds * width
+                target = QRectF(left, 0, data.shape[1] * bucket / self.view_seconds * width, height)
+                painter.drawImage(target, image, QRectF(image.rect()))
+        else:
+            # Starts are sorted, so the notes in view are a slice (widened by the longest note)
+            spans = self.spans
+            begin = int(np.searchsorted(spans['start'], start - self._longest, side='left'))
+            end = int(np.searchsorted(spans['start'], stop, side='right'))
+            visible = spans[begin:end]
+            visible = visible[visible['end'] > start]
+            note = QColor(self.palette().text().color())
+            painter.setPen(Qt.PenStyle.NoPen)
+            scale = width / self.view_seconds
+            for note_start, note_end, pitch, velocity in visible.tolist():
+                note.setAlpha(96 + velocity)
+                painter.setBrush(note)
+                top = (pyramid.high - pitch) * row_height
+                painter.drawRect(QRectF((note_start - start) * scale, top,
+                                        max((note_end - note_start) * scale, 1.0), max(row_height - 1, 1.0)))
+        painter.end()
+        return pixmap
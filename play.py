@@ -1,12 +1,145 @@
-from midi2audio import FluidSynth
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 
-# Create a FluidSynth instance
-fs = FluidSynth()
+def render_file(midi_path, wav_path, sound_font=None, sample_rate=44100):
+    """Render one MIDI file to WAV with FluidSynth."""
+    from midi2audio import FluidSynth  # Only rendering needs it, not the modules importing this one
+    # Create a FluidSynth instance
+    if sound_font:
+        fs = FluidSynth(sound_font, sample_rate=sample_rate)
+    else:
+        fs = FluidSynth(sample_rate=sample_rate)
 
+    os.makedirs(os.path.dirname(os.path.abspath(wav_path)), exist_ok=True)
+    # Render next to the target and rename at the end, so an interrupted
+    # render never leaves a file that looks finished
+    tmp_path = f'{wav_path}.{os.getpid()}.part.wav'
+    fs.midi_to_audio(midi_path, tmp_path)
+    if not os.path.exists(tmp_path):
+        raise RuntimeError(f"FluidSynth produced no output for {midi_path}")
+    os.replace(tmp_path, wav_path)
 
-# Convert MIDI to audio
-fs.midi_to_audio('C:/Users/carla/maestro-v3.0.0/2008/MIDI-Unprocessed_01_R1_2008_01-04_ORIG_MID--AUDIO_01_R1_2008_wav--3.midi', 'output_audio.wav')
 
-# Close the FluidSynth instance
-fs.close()
+def is_current(midi_path, wav_path):
+    # Rendered already and not older than its MIDI file
+    try:
+        return os.path.getmtime(wav_path) >= os.path.getmtime(midi_path)
+    except OSError:
+        return False
+
+
+def select_rows(df, split=None, year=None, composer=None):
+    if split:
+        df = df[df['split'].astype(str) == split]
+    if year:
+        df = df[df['year'].astype(int) == int(year)]
+    if composer:
+        df = df[df['canonical_composer'].astype(str).str.lower().str.contains(composer.lower(), regex=False)]
+    return df
+
+
+def _render_job(job):
+    # Runs in a worker process
+    midi_path, wav_path, duration, sound_font, sample_rate = job
+    try:
+        render_file(midi_path, wav_path, sound_font, sample_rate)
+    except Exception as e:
+        return midi_path, duration, str(e)
+    return midi_path, duration, None
+
+
+def render_batch(metadata, output_dir, dataset_path=None, split=None, year=None, composer=None,
+                 jobs=None, sound_font=None, sample_rate=44100):
+    """Render every MIDI in the metadata CSV matching the filters, in parallel."""
+    from catalog import load_catalog  # Only the parent process needs pandas
+
+    dataset_path = dataset_path or os.path.dirname(os.path.abspath(metadata))
+    df = select_rows(load_catalog(metadata).df, split, year, composer)
+    render_rows(df, output_dir, dataset_path, jobs, sound_font, sample_rate)
+
+
+def render_rows(df, output_dir, dataset_path, jobs=None, sound_font=None, sample_rate=44100):
+    """Render the MIDI of every catalog row in df to output_dir, in parallel."""
+    from dataset_index import load_dataset_index
+
+    # Catalog filenames are resolved like everywhere else, Windows separators included
+    dataset_index = load_dataset_index(dataset_path)
+    todo = []
+    skipped = 0
+    missing = 0
+    for midi_filename, audio_filename, duration in zip(df['midi_filename'], df['audio_filename'], df['duration']):
+        midi_path = dataset_index.path(midi_filename)
+        if midi_path is None:
+            missing += 1
+            continue
+        wav_path = os.path.join(output_dir, str(audio_filename))
+        if is_current(midi_path, wav_path):
+            skipped += 1
+            continue
+        todo.append((midi_path, wav_path, float(duration), sound_font, sample_rate))
+
+    print(f"{len(todo)} files to render, {skipped} already up to date"
+          + (f", {missing} not in {dataset_index.root}" if missing else ""))
+    if not todo:
+        return
+
+    jobs = jobs or os.cpu_count() or 1
+    start = time.perf_counter()
+    rendered_seconds = 0.0
+    failures = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_render_job, job) for job in todo]
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                midi_path, duration, error = future.result()
+                if error:
+                    failures += 1
+                    print(f"Error rendering {midi_path}: {error}")
+                else:
+                    rendered_seconds += duration
+                elapsed = time.perf_counter() - start
+                print(f"[{done}/{len(todo)}] {rendered_seconds:.0f} s of audio in {elapsed:.0f} s "
+                      f"({rendered_seconds / elapsed:.1f}x real time)")
+        except KeyboardInterrupt:
+            # Finished files are kept, running again picks up the rest
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    elapsed = time.perf_counter() - start
+    print(f"Rendered {len(todo) - failures} files, {failures} failed, "
+          f"{rendered_seconds / elapsed:.1f} audio seconds per second")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render MAESTRO MIDI files to WAV with FluidSynth.")
+    parser.add_argument('--sound-font', help="SoundFont (.sf2) to render with")
+    parser.add_argument('--sample-rate', type=int, default=44100)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    single = commands.add_parser('file', help="render a single MIDI file")
+    single.add_argument('midi')
+    single.add_argument('wav')
+
+    batch = commands.add_parser('batch', help="render the files listed in the metadata CSV")
+    batch.add_argument('metadata', help="path to maestro-v3.0.0.csv")
+    batch.add_argument('output_dir')
+    batch.add_argument('--dataset-path', help="folder holding the year folders (default: next to the CSV)")
+    batch.add_argument('--split', choices=['train', 'validation', 'test'])
+    batch.add_argument('--year', type=int)
+    batch.add_argument('--composer', help="substring of canonical_composer")
+    batch.add_argument('--jobs', type=int, help="worker processes (default: CPU count)")
+
+    args = parser.parse_args(argv)
+    if args.command == 'file':
+        render_file(args.midi, args.wav, args.sound_font, args.sample_rate)
+    else:
+        render_batch(args.metadata, args.output_dir, args.dataset_path, args.split, args.year,
+                     args.composer, args.jobs, args.sound_font, args.sample_rate)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
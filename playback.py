@@ -0,0 +1,419 @@
+import collections
+import logging
+import threading
+import time
+
+import mido
+import numpy as np
+
+from instrumentation import metrics
+from midi_cache import EVENT_DTYPE, TimeIndex, event_message
+
+log = logging.getLogger(__name__)
+
+
+# Channel volume (CC7) of a General MIDI synthesizer until a file sets its own
+DEFAULT_CHANNEL_VOLUME = 100
+
+
+def volume_messages(volume):
+    # Channel volume (CC7) on every channel; unlike rescaling velocities this
+    # also reaches notes that are already sounding
+    value = max(0, min(127, round(volume * 127)))
+    return [mido.Message('control_change', channel=channel, control=7, value=value)
+            for channel in range(16)]
+
+
+def silence_messages():
+    # All notes off and sustain pedal up on every channel
+    messages = []
+    for channel in range(16):
+        messages.append(mido.Message('control_change', channel=channel, control=64, value=0))
+        messages.append(mido.Message('control_change', channel=channel, control=123, value=0))
+    return messages
+
+
+class JitterStats:
+    """How late each message left the scheduler, in seconds."""
+
+    def __init__(self, size=4096):
+        self.samples = collections.deque(maxlen=size)
+
+    def add(self, lateness):
+        self.samples.append(lateness)
+
+    def clear(self):
+        self.samples.clear()
+
+    def summary(self):
+        if not self.samples:
+            return {'count': 0, 'mean_ms': 0.0, 'p50_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0}
+        ordered = sorted(self.samples)
+        count = len(ordered)
+        return {
+            'count': count,
+            'mean_ms': sum(ordered) / count * 1000,
+            'p50_ms': ordered[count // 2] * 1000,
+            'p99_ms': ordered[min(count - 1, int(count * 0.99))] * 1000,
+            'max_ms': ordered[-1] * 1000,
+        }
+
+
+class ScheduledEngine:
+    """Sends timed MIDI messages to output ports from a dedicated thread.
+
+    The GUI only pushes commands onto a deque (appends and pops are atomic,
+    so no lock is taken) and gets position/state back through the callbacks,
+    which are called from the playback thread. The thread sleeps until just
+    before the next message is due, then spins for precision. Pause, seek,
+    stop and volume are handled here; subclasses say what plays, through the
+    methods below the commands.
+    """
+
+    # The scheduler sleeps until this close to an event, then spins for precision
+    SPIN_SECONDS = 0.002
+    THREAD_NAME = 'midi-playback'
+
+    def __init__(self, backend=None, on_position=None, on_state=None, position_interval=0.05):
+        # The default port (name None) is the backend's shared one if given, see audio_backend
+        self.backend = backend
+        self.on_position = on_position
+        self.on_state = on_state
+        self.position_interval = position_interval
+        self.volume = 1.0
+        self.jitter = JitterStats()
+
+        self._commands = collections.deque()
+        self._wake = threading.Event()
+        self._thread = None
+        self._origin = 0.0  # perf_counter() value at which position 0 plays
+        self._offset = 0.0  # position while paused or stopped
+        self.state = 'stopped'
+
+    # Commands, safe to call from any thread
+
+    def pause(self):
+        self._send_command('pause')
+
+    def seek(self, seconds):
+        self._send_command('seek', seconds)
+
+    def stop(self):
+        self._send_command('stop')
+
+    def set_volume(self, volume):
+        """Set the output gain, 0.0 to 1.0; takes effect at the next scheduler wakeup."""
+        self._send_command('volume', volume)
+
+    def shutdown(self):
+        if self._thread is None:
+            return
+        self._send_command('quit')
+        self._thread.join()
+        self._thread = None
+
+    @property
+    def duration(self):
+        raise NotImplementedError
+
+    def _send_command(self, name, argument=None):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.THREAD_NAME, daemon=True)
+            self._thread.start()
+        self._commands.append((name, argument, time.perf_counter()))
+        self._wake.set()
+
+    # Playback thread, implemented by subclasses
+
+    def _next_time(self):
+        """Position of the next message due, None when there is nothing left to play."""
+        raise NotImplementedError
+
+    def _send_due(self, now):
+        """Send what is due at now, a perf_counter() value."""
+        raise NotImplementedError
+
+    def _resume_at(self, seconds, restore=True):
+        """Continue from seconds; restore sends the pedals, controllers and sounding notes of that moment first."""
+        raise NotImplementedError
+
+    def _silence(self):
+        raise NotImplementedError
+
+    def _send_volume(self):
+        raise NotImplementedError
+
+    def _close(self):
+        """Let go of the output ports."""
+
+    def _handle_command(self, name, argument, issued):
+        """Commands of the subclass; False ends the playback thread."""
+        return True
+
+    def _finished(self):
+        # Out of messages: back to the start, stopped
+        self._offset = 0.0
+        self._resume_at(0.0, restore=False)
+        self._set_state('stopped')
+        self._report_position()
+
+    # Playback thread
+
+    def position(self):
+        if self.state == 'playing':
+            return time.perf_counter() - self._origin
+        return self._offset
+
+    def _set_state(self, state):
+        self.state = state
+        if self.on_state:
+            self.on_state(state)
+
+    def _report_position(self):
+        if self.on_position:
+            self.on_position(self.position())
+
+    def _record_lateness(self, metric, lateness):
+        self.jitter.add(lateness)
+        metrics.record(metric, lateness)
+
+    def _open_port(self, name):
+        # None if the port cannot be opened; the error is logged
+        try:
+            if name is None and self.backend is not None:
+                return self.backend.port()
+            return mido.open_output(name)
+        except Exception as e:
+            log.error("Error opening MIDI output %s: %s", name or "(default)", e)
+            return None
+
+    def _close_port(self, name, port):
+        # A backend's port is shared, the backend closes it
+        if not (name is None and self.backend is not None):
+            port.close()
+
+    def _handle(self, name, argument, issued):
+        if name == 'pause':
+            if self.state == 'playing':
+                self._offset = self.position()
+                self._silence()
+                self._set_state('paused')
+        elif name == 'seek':
+            seconds = min(max(argument, 0.0), self.duration)
+            self._silence()
+            # Paused or stopped: the state is restored when playback resumes
+            self._resume_at(seconds, restore=self.state == 'playing')
+            self._offset = seconds
+            self._origin = time.perf_counter() - seconds
+            self._report_position()
+        elif name == 'stop':
+            self._silence()
+            self._offset = 0.0
+            self._resume_at(0.0, restore=False)
+            if self.state != 'stopped':
+                self._set_state('stopped')
+            self._report_position()
+        elif name == 'volume':
+            self.volume = min(max(argument, 0.0), 1.0)
+            self._send_volume()
+        elif name == 'quit':
+            self._silence()
+            self._close()
+            return False
+        else:
+            return self._handle_command(name, argument, issued)
+        return True
+
+    def _run(self):
+        last_report = 0.0
+        while True:
+            self._wake.clear()
+            while self._commands:
+                name, argument, issued = self._commands.popleft()
+                if not self._handle(name, argument, issued):
+                    return
+
+            if self.state != 'playing':
+                self._wake.wait()
+                continue
+
+            next_time = self._next_time()
+            if next_time is None:
+                self._finished()
+                continue
+
+            due = self._origin + next_time
+            now = time.perf_counter()
+            if now - last_report >= self.position_interval:
+                last_report = now
+                self._report_position()
+
+            wait = due - now - self.SPIN_SECONDS
+            if wait > 0:
+                # Sleep in short slices so commands and position updates stay responsive
+                self._wake.wait(min(wait, self.position_interval))
+                continue
+            while now < due:
+                now = time.perf_counter()
+            self._send_due(now)
+
+
+class PlaybackEngine(ScheduledEngine):
+    """Sends decoded MIDI events (see midi_cache) to an output port from a dedicated thread.
+
+    One piece at a time, with the next one queued to follow without a gap;
+    commands and threading are ScheduledEngine's.
+    """
+
+    def __init__(self, backend=None, port_name=None, on_position=None, on_state=None, on_track=None,
+                 position_interval=0.05):
+        # With a backend (see audio_backend) its shared port is used, otherwise
+        # the engine opens port_name itself
+        super().__init__(backend, on_position, on_state, position_interval)
+        self.port_name = port_name
+        # Called with the tag of each piece as it starts, and with None when
+        # playback runs out of queued pieces
+        self.on_track = on_track
+        self.start_latency = None  # seconds from the last play() call to the clock starting
+        self._port = None
+
+        self._events = np.zeros(0, dtype=EVENT_DTYPE)
+        self._times = self._events['time']
+        self._index = 0
+        self._time_index = None  # TimeIndex of self._events, built in the background
+        self._queued = None  # (events, tag) to continue with, without a gap
+        # Last channel volume (CC7) the music set on each channel, before our
+        # volume is applied; 100 is the General MIDI power-on level
+        self._channel_volume = [DEFAULT_CHANNEL_VOLUME] * 16
+
+    # Commands, safe to call from any thread
+
+    def play(self, events=None, tag=None):
+        self._send_command('play', (events, tag))
+
+    def queue_next(self, events, tag=None):
+        """Continue with these events right after the current ones end."""
+        self._send_command('queue', (events, tag))
+
+    def cancel_next(self):
+        """Drop what queue_next() queued; the current piece plays on."""
+        self._send_command('queue', None)
+
+    @property
+    def duration(self):
+        return float(self._times[-1]) if len(self._times) else 0.0
+
+    @property
+    def events(self):
+        """The EVENT_DTYPE array of the piece loaded now."""
+        return self._events
+
+    # Playback thread
+
+    def _report_track(self, tag):
+        if self.on_track:
+            self.on_track(tag)
+
+    def _silence(self):
+        if self._port is not None:
+            for msg in silence_messages():
+                self._port.send(msg)
+
+    def _send_volume(self):
+        # Every channel's own level again, scaled by the new volume in _send
+        if self._port is not None:
+            for channel, value in enumerate(self._channel_volume):
+                self._send(mido.Message('control_change', channel=channel, control=7, value=value))
+
+    def _send(self, msg):
+        if msg.type == 'control_change' and msg.control == 7:
+            # The file's own channel volume is scaled by ours rather than replacing it
+            self._channel_volume[msg.channel] = msg.value
+            msg.value = round(msg.value * self.volume)
+        self._port.send(msg)
+
+    def _close(self):
+        if self._port is not None:
+            self._close_port(self.port_name, self._port)
+        self._port = None
+
+    def _load(self, events):
+        self._events = events
+        self._times = events['time']
+        self._index = 0
+        self._time_index = None
+        # Channel levels start over with every piece, the last one's CC7 is not this one's base
+        self._channel_volume = [DEFAULT_CHANNEL_VOLUME] * 16
+        self._send_volume()
+        # Building the index walks every event once, keep that off the scheduler
+        threading.Thread(target=self._build_time_index, args=(events,), daemon=True).start()
+
+    def _build_time_index(self, events):
+        time_index = TimeIndex(events)
+        if self._events is events:
+            self._time_index = time_index
+
+    def _resume_at(self, seconds, restore=True):
+        if not restore:
+            self._index = int(np.searchsorted(self._times, seconds))
+            return
+        time_index = self._time_index
+        if time_index is None or time_index.events is not self._events:
+            time_index = self._time_index = TimeIndex(self._events)
+        self._index, messages = time_index.resume(seconds)
+        if self._port is not None:
+            for msg in messages:
+                self._send(msg)
+
+    def _next_time(self):
+        return float(self._times[self._index]) if self._index < len(self._events) else None
+
+    def _send_due(self, now):
+        self._record_lateness('playback.lateness', now - (self._origin + float(self._times[self._index])))
+        self._send(event_message(self._events[self._index]))
+        metrics.record('playback.send', time.perf_counter() - now)
+        self._index += 1
+
+    def _finished(self):
+        if self._queued is not None:
+            # Gapless: the next piece's time 0 is where this one ended
+            events, tag = self._queued
+            self._queued = None
+            self._origin += self.duration
+            self._load(events)
+            self._report_track(tag)
+            return
+        super()._finished()
+        self._report_track(None)
+
+    def _handle(self, name, argument, issued):
+        if name == 'stop':
+            self._queued = None
+        return super()._handle(name, argument, issued)
+
+    def _handle_command(self, name, argument, issued):
+        if name == 'play':
+            events, tag = argument
+            if events is not None:
+                self._silence()
+                self._load(events)
+                self._offset = 0.0
+                self._queued = None
+                self.jitter.clear()
+                self._report_track(tag)
+            if self._port is None:
+                self._port = self._open_port(self.port_name)
+                if self._port is None:
+                    self._set_state('stopped')
+                    return True
+                self._send_volume()
+            if events is None and self.state != 'playing' and self._offset > 0:
+                self._resume_at(self._offset)
+            if events is not None or self.state != 'playing':
+                self._origin = time.perf_counter() - self._offset
+                self.start_latency = time.perf_counter() - issued
+            if self.state != 'playing':
+                self._set_state('playing')
+        elif name == 'queue':
+            self._queued = argument
+        return True
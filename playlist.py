@@ -0,0 +1,93 @@
+import json
+import logging
+import os
+
+from settings import CACHE_DIR
+
+log = logging.getLogger(__name__)
+
+
+class Playlist:
+    """An ordered list of pieces to play, saved to disk after every change.
+
+    Items are dicts with the MIDI path under 'midi' and a display 'title';
+    add() gives each an 'id' that, unlike its row, stays the same when other
+    items are removed. The current item and the position in it are saved
+    too, so a listening session can be picked up where it stopped.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, 'playlist.json')
+        self.items = []
+        self.current = 0
+        self.position = 0.0
+        self.next_id = 0
+
+    @classmethod
+    def load(cls, path=None):
+        playlist = cls(path)
+        try:
+            with open(playlist.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return playlist
+        playlist._append(saved.get('items', []))
+        playlist.current = min(saved.get('current', 0), max(len(playlist.items) - 1, 0))
+        playlist.position = saved.get('position', 0.0)
+        return playlist
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'items': self.items, 'current': self.current, 'position': self.position}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.warning("Could not save playlist: %s", e)
+
+    def __len__(self):
+        return len(self.items)
+
+    def _append(self, items):
+        # Playlists saved before items had ids get them here
+        for item in items:
+            if 'id' not in item:
+                item['id'] = self.next_id
+            self.next_id = max(self.next_id, item['id'] + 1)
+            self.items.append(item)
+
+    def add(self, items):
+        self._append([{'midi': item['midi'], 'title': item['title']} for item in items])
+        self.save()
+
+    def remove(self, index):
+        del self.items[index]
+        if index < self.current or self.current >= len(self.items):
+            self.current = max(self.current - 1, 0)
+        self.save()
+
+    def clear(self):
+        self.items = []
+        self.current = 0
+        self.position = 0.0
+        self.save()
+
+    def set_current(self, index, position=0.0):
+        self.current = index
+        self.position = position
+        self.save()
+
+    def row(self, item_id):
+        """Where the item with item_id is now, None if it was removed."""
+        for index, item in enumerate(self.items):
+            if item['id'] == item_id:
+                return index
+        return None
+
+    def item(self, index):
+        return self.items[index] if 0 <= index < len(self.items) else None
+
+    def next_index(self, index=None):
+        index = self.current if index is None else index
+        return index + 1 if index + 1 < len(self.items) else None
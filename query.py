@@ -0,0 +1,222 @@
+import re
+
+import numpy as np
+
+# duration<300, notes_per_second>=8, duration:60..300, split:validation, year:2015
+CONDITION = re.compile(r'^(\w+)(<=|>=|<|>|=|:)(.+)$')
+NUMBER = re.compile(r'^(-?\d+(?:\.\d*)?)(m|s)?$')
+
+# Shorter names accepted in queries
+ALIASES = {'composer': 'canonical_composer', 'title': 'canonical_title'}
+
+# Columns listed with counts in the search sidebar
+FACET_COLUMNS = ('split', 'year', 'canonical_composer')
+
+
+def parse_number(text):
+    # "5m" is five minutes, handy for duration
+    match = NUMBER.match(text)
+    if match is None:
+        return None
+    value = float(match.group(1))
+    return value * 60 if match.group(2) == 'm' else value
+
+
+def parse_query(text, numeric_columns, categorical_columns):
+    """Split a search into free text and (column, operator, value) conditions.
+
+    Comparisons (<, <=, >, >=, =, and a:b ranges written column:a..b) are
+    taken for numeric columns, column:value for categorical ones. Any other
+    token stays part of the free text search.
+    """
+    words = []
+    conditions = []
+    for token in text.split():
+        match = CONDITION.match(token)
+        if match is None:
+            words.append(token)
+            continue
+        column, operator, value = match.groups()
+        column = ALIASES.get(column, column)
+        if operator == ':' and '..' in value and column in numeric_columns:
+            low, high = (parse_number(part) for part in value.split('..', 1))
+            if low is not None and high is not None:
+                conditions += [(column, '>=', low), (column, '<=', high)]
+                continue
+        elif operator == ':' and column in categorical_columns:
+            conditions.append((column, ':', value.lower()))
+            continue
+        elif operator != ':' and column in numeric_columns and parse_number(value) is not None:
+            conditions.append((column, operator, parse_number(value)))
+            continue
+        words.append(token)
+    return ' '.join(words), conditions
+
+
+# Row sets are Python ints used as bitmaps: bit i is row i. &, | and
+# int.bit_count() then work on 64 rows per machine word.
+
+def rows_to_bitmap(rows, size):
+    mask = np.zeros(size, dtype=bool)
+    mask[np.asarray(rows, dtype=np.int64)] = True
+    return mask_to_bitmap(mask)
+
+
+def mask_to_bitmap(mask):
+    return int.from_bytes(np.packbits(mask, bitorder='little').tobytes(), 'little')
+
+
+def bitmap_to_mask(bitmap, size):
+    data = np.frombuffer(bitmap.to_bytes((size + 7) // 8, 'little'), dtype=np.uint8)
+    return np.unpackbits(data, count=size, bitorder='little').view(bool)
+
+
+def bitmap_to_rows(bitmap, size):
+    return np.flatnonzero(bitmap_to_mask(bitmap, size))
+
+
+class NumericIndex:
+    """Rows sorted by value, so a range is two binary searches."""
+
+    def __init__(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.size = len(values)
+        self.order = np.argsort(values, kind='stable')  # NaN sorts last
+        self.sorted = values[self.order]
+        self.valid = int(np.count_nonzero(~np.isnan(values)))
+
+    def select(self, operator, value):
+        values = self.sorted[:self.valid]
+        if operator == '<':
+            start, stop = 0, np.searchsorted(values, value, 'left')
+        elif operator == '<=':
+            start, stop = 0, np.searchsorted(values, value, 'right')
+        elif operator == '>':
+            start, stop = np.searchsorted(values, value, 'right'), self.valid
+        elif operator == '>=':
+            start, stop = np.searchsorted(values, value, 'left'), self.valid
+        else:
+            start, stop = np.searchsorted(values, value, 'left'), np.searchsorted(values, value, 'right')
+        return rows_to_bitmap(self.order[start:stop], self.size)
+
+
+class BitmapIndex:
+    """One bitmap of rows per category of a categorical column."""
+
+    def __init__(self, codes, labels):
+        size = len(codes)
+        self.labels = [str(label) for label in labels]
+        self.bitmaps = [0] * len(labels)
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(labels) + 1), 'left')
+        for code in range(len(labels)):
+            rows = order[bounds[code]:bounds[code + 1]]
+            if len(rows):
+                self.bitmaps[code] = rows_to_bitmap(rows, size)
+
+    def select(self, value):
+        # An exact (case-insensitive) label match wins, otherwise every label containing value
+        lowered = [label.lower() for label in self.labels]
+        codes = [code for code, label in enumerate(lowered) if label == value]
+        if not codes:
+            codes = [code for code, label in enumerate(lowered) if value in label]
+        return self.union(codes)
+
+    def union(self, codes):
+        bitmap = 0
+        for code in codes:
+            bitmap |= self.bitmaps[code]
+        return bitmap
+
+    def counts(self, bitmap):
+        return [(label, (rows & bitmap).bit_count()) for label, rows in zip(self.labels, self.bitmaps)]
+
+
+class FilterIndex:
+    """Range and facet filters over a DataFrame, answered from prebuilt indexes.
+
+    Bitmap indexes for FACET_COLUMNS are built up front; other columns get
+    theirs the first time a query uses them.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self.size = len(df)
+        self.all_rows = (1 << self.size) - 1
+        self.numeric_columns = set()
+        self.categorical_columns = set()
+        for column in df.columns:
+            dtype = df[column].dtype
+            if str(dtype) == 'category':
+                self.categorical_columns.add(column)
+                if dtype.categories.dtype.kind in 'iuf':
+                    self.numeric_columns.add(column)  # year can be compared too
+            elif dtype.kind in 'iuf':
+                self.numeric_columns.add(column)
+        self._numeric = {}
+        self._bitmaps = {}
+        self.facet_columns = [column for column in FACET_COLUMNS if column in self.categorical_columns]
+        for column in self.facet_columns:
+            self.bitmap_index(column)
+
+    def numeric_index(self, column):
+        index = self._numeric.get(column)
+        if index is None:
+            series = self.df[column]
+            if str(series.dtype) == 'category':
+                categories = series.cat.categories.to_numpy(dtype=np.float64)
+                codes = series.cat.codes.to_numpy()
+                values = np.where(codes < 0, np.nan, categories[codes])
+            else:
+                values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+            index = self._numeric[column] = NumericIndex(values)
+        return index
+
+    def bitmap_index(self, column):
+        index = self._bitmaps.get(column)
+        if index is None:
+            series = self.df[column]
+            index = self._bitmaps[column] = BitmapIndex(series.cat.codes.to_numpy(), series.cat.categories)
+        return index
+
+    def evaluate(self, conditions, facets=None):
+        """Bitmap of rows meeting every condition and, per facet column, one of its chosen labels."""
+        bitmap = self.all_rows
+        for column, operator, value in conditions:
+            if operator == ':':
+                bitmap &= self.bitmap_index(column).select(value)
+            else:
+                bitmap &= self.numeric_index(column).select(operator, value)
+        for column, labels in (facets or {}).items():
+            if labels:
+                index = self.bitmap_index(column)
+                bitmap &= index.union(code for code, label in enumerate(index.labels) if label in labels)
+        return bitmap
+
+    def facet_counts(self, bitmap):
+        return {column: self.bitmap_index(column).counts(bitmap) for column in self.facet_columns}
+
+
+def search_rows(search_index, filter_index, query, facets=None, check=None):
+    """(rows, facet counts) for a search box query plus ticked facets.
+
+    rows is None when nothing filters. Meant to run off the GUI thread (see
+    SearchWorker); check() is called between steps so a newer search can stop it.
+    """
+    check = check or (lambda: None)
+    text, conditions = parse_query(query, filter_index.numeric_columns, filter_index.categorical_columns)
+    if not text and not conditions and not any((facets or {}).values()):
+        return None, filter_index.facet_counts(filter_index.all_rows)
+    # Every filter is a bitmap of rows from a prebuilt index, combined with &
+    bitmap = filter_index.evaluate(conditions, facets)
+    check()
+    if text:
+        # Ranked, typo-tolerant matches from the prebuilt index, best first
+        rows = search_index.rank(text)
+        check()
+        rows = rows[bitmap_to_mask(bitmap, filter_index.size)[rows]]
+        bitmap = rows_to_bitmap(rows, filter_index.size)
+    else:
+        rows = bitmap_to_rows(bitmap, filter_index.size)
+    check()
+    return rows, filter_index.facet_counts(bitmap)
@@ -0,0 +1,175 @@
+import glob
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import mido
+
+from catalog import CACHE_DIR, file_hash
+from play import render_file
+
+log = logging.getLogger(__name__)
+
+# Seconds rendered first, so playback can start while the whole piece renders
+PREVIEW_SECONDS = 20
+
+# Disk space for rendered WAVs; the least recently played are deleted past it
+DEFAULT_BUDGET = int(os.environ.get('PIANO_PLAYLIST_RENDER_BUDGET', 4 << 30))
+
+
+def truncate_midi(midi_path, output_path, seconds):
+    """Write the first seconds of a MIDI file, with every note released at the end."""
+    mid = mido.MidiFile(midi_path)
+    out = mido.MidiFile(ticks_per_beat=mid.ticks_per_beat)
+    track = mido.MidiTrack()
+    out.tracks.append(track)
+    tempo = 500000  # MIDI default, 120 bpm
+    elapsed = 0.0
+    for msg in mido.merge_tracks(mid.tracks):
+        if msg.time:
+            elapsed += mido.tick2second(msg.time, mid.ticks_per_beat, tempo)
+        if elapsed > seconds:
+            break
+        if msg.type == 'set_tempo':
+            tempo = msg.tempo
+        if msg.type != 'end_of_track':
+            track.append(msg)
+    for channel in range(16):
+        track.append(mido.Message('control_change', channel=channel, control=64, value=0))
+        track.append(mido.Message('control_change', channel=channel, control=123, value=0))
+    track.append(mido.MetaMessage('end_of_track'))
+    out.save(output_path)
+
+
+class RenderCache:
+    """WAV renders of MIDI files, kept on disk and looked up by content.
+
+    A render is keyed by the MIDI file's hash, the SoundFont and the sample
+    rate, so a renamed or copied file is still a hit and a different
+    SoundFont is not. request() renders in the background: a short preview
+    first, then the whole piece. Files over budget_bytes are deleted least
+    recently used first (a hit refreshes the file's mtime).
+    """
+
+    def __init__(self, sound_font=None, sample_rate=44100, cache_dir=None, budget_bytes=DEFAULT_BUDGET):
+        self.sound_font = sound_font
+        self.sample_rate = sample_rate
+        self.budget_bytes = budget_bytes
+        self.cache_dir = os.path.join(cache_dir or CACHE_DIR, 'render')
+        # SoundFonts can be hundreds of MB, so they are told apart by path, size and mtime
+        if sound_font:
+            stat = os.stat(sound_font)
+            font = f'{os.path.abspath(sound_font)}|{stat.st_size}|{stat.st_mtime_ns}'
+        else:
+            font = 'default'
+        self._settings = hashlib.sha1(f'{font}|{sample_rate}'.encode('utf-8')).hexdigest()[:16]
+        self._hashes = {}  # (path, size, mtime_ns) -> MIDI sha1
+        self._pending = {}  # key -> Future of the render in progress
+        self._lock = threading.Lock()
+        # fluidsynth does the work in a subprocess; one render at a time keeps the UI machine usable
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def key(self, midi_path):
+        path = os.path.abspath(midi_path)
+        stat = os.stat(path)
+        stat_key = (path, stat.st_size, stat.st_mtime_ns)
+        digest = self._hashes.get(stat_key)
+        if digest is None:
+            digest = self._hashes[stat_key] = file_hash(path)
+        return f'{digest}-{self._settings}'
+
+    def _wav_path(self, key, preview=False):
+        return os.path.join(self.cache_dir, f'{key}.preview.wav' if preview else f'{key}.wav')
+
+    def cached(self, midi_path, preview=False):
+        """Path of the finished render (or preview), or None if there is none yet."""
+        path = self._wav_path(self.key(midi_path), preview)
+        try:
+            os.utime(path)  # Mark as recently used for eviction
+        except OSError:
+            return None
+        return path
+
+    def render(self, midi_path, preview=False):
+        """Render now (blocking) unless already cached; returns the WAV path."""
+        cached = self.cached(midi_path, preview)
+        if cached is not None:
+            return cached
+        key = self.key(midi_path)
+        wav_path = self._wav_path(key, preview)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if preview:
+            clip_path = os.path.join(self.cache_dir, f'{key}.{os.getpid()}.preview.mid')
+            try:
+                truncate_midi(midi_path, clip_path, PREVIEW_SECONDS)
+                render_file(clip_path, wav_path, self.sound_font, self.sample_rate)
+            finally:
+                if os.path.exists(clip_path):
+                    os.remove(clip_path)
+        else:
+            render_file(midi_path, wav_path, self.sound_font, self.sample_rate)
+        self.evict()
+        return wav_path
+
+    def request(self, midi_path, on_preview=None, on_done=None):
+        """Render in the background, preview first; callbacks get the WAV path on the worker thread.
+
+        Renders queued for other files that have not started yet are dropped:
+        the newest selection is the one that will be played.
+        """
+        key = self.key(midi_path)
+        with self._lock:
+            for other, future in list(self._pending.items()):
+                if other != key and future.cancel():
+                    del self._pending[other]
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = self._executor.submit(self._render_job, key, midi_path, on_preview)
+        if on_done is not None:
+            def finished(done):
+                if not done.cancelled() and done.result() is not None:
+                    on_done(done.result())
+            future.add_done_callback(finished)
+        return future
+
+    def _render_job(self, key, midi_path, on_preview):
+        try:
+            if self.cached(midi_path) is None:
+                preview = self.render(midi_path, preview=True)
+                if on_preview is not None:
+                    on_preview(preview)
+            return self.render(midi_path)
+        except Exception as e:
+            log.error("Error rendering %s: %s", midi_path, e)
+            return None
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def evict(self):
+        """Delete the least recently used renders until the cache fits the budget."""
+        entries = []
+        for path in glob.glob(os.path.join(self.cache_dir, '*.wav')):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        with self._lock:
+            busy = set(self._pending)
+        for _, size, path in sorted(entries):
+            if total <= self.budget_bytes:
+                break
+            if os.path.basename(path).split('.', 1)[0] in busy:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
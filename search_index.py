@@ -0,0 +1,332 @@
+import hashlib
+import logging
+import math
+import os
+import re
+import unicodedata
+from array import array
+from bisect import bisect_left
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Columns the fuzzy search ranks on, when the DataFrame has them
+FUZZY_COLUMNS = ('canonical_composer', 'canonical_title')
+
+TOKEN = re.compile(r'[a-z]+|[0-9]+')
+
+# Bump when the saved n-gram index changes layout so old ones are rebuilt
+INDEX_VERSION = 1
+
+
+def fold(text):
+    """Lowercase text with accents removed: 'Frédéric' -> 'frederic'."""
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text):
+    # Letters and digits are separate tokens, so "Op. 9" and "op9" both give op, 9
+    return TOKEN.findall(fold(text))
+
+
+def edit_distance(a, b, limit):
+    """Damerau-Levenshtein distance (adjacent swaps count once), or limit + 1 if above limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if previous2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def typo_limit(token):
+    # Edits allowed for a query token; numbers and short words must match exactly
+    if token.isdigit() or len(token) < 4:
+        return 0
+    return 1 if len(token) < 8 else 2
+
+
+def text_columns(df):
+    # Same columns the old str.contains search looked at: anything holding text
+    columns = []
+    for col in df.columns:
+        dtype = df[col].dtype
+        if dtype == object or str(dtype) in ('string', 'str', 'category'):
+            columns.append(col)
+    return columns
+
+
+class SearchIndex:
+    """Inverted n-gram index over the text columns of a DataFrame.
+
+    Every 1, 2 and 3 character substring of every cell points to the rows it
+    appears in, so a query only has to look at the rows behind its rarest
+    n-gram instead of scanning the whole table.
+
+    rank() adds a forgiving search over the composer and title words:
+    accents folded, word order free, typos allowed, best matches first.
+
+    With cache_dir the n-grams are saved there (search.npz) and loaded back
+    while the indexed text stays the same, instead of being rebuilt every
+    time a script searches.
+    """
+
+    MATCH_CACHE_SIZE = 1024
+
+    def __init__(self, df, columns=None, n=3, fuzzy_columns=None, cache_dir=None):
+        self.columns = list(columns) if columns is not None else text_columns(df)
+        self.n = n
+        self.size = len(df)
+        self._texts = []
+        self._postings = {}
+        self._last_query = None
+        self._last_rows = None
+        self._build(df, cache_dir)
+        if fuzzy_columns is None:
+            fuzzy_columns = [col for col in FUZZY_COLUMNS if col in df.columns] or self.columns
+        self.fuzzy_columns = list(fuzzy_columns)
+        self._build_tokens(df)
+
+    def _build(self, df, cache_dir=None):
+        values = [df[col].astype(str).str.lower().tolist() for col in self.columns]
+        # Cells are joined with a separator no query can contain, so a match
+        # can never span two columns
+        self._texts = ['\x00'.join(cells) for cells in zip(*values)]
+        if cache_dir is not None:
+            sha1 = hashlib.sha1(f'{INDEX_VERSION} {self.n} {len(self.columns)}'.encode('utf-8'))
+            sha1.update('\x01'.join(self._texts).encode('utf-8'))
+            key = sha1.hexdigest()
+            path = os.path.join(cache_dir, 'search.npz')
+            self._postings = self._load_postings(path, key)
+            if self._postings is not None:
+                return
+        postings = {}
+        for row, cells in enumerate(zip(*values)):
+            grams = set()
+            for cell in cells:
+                for size in range(1, self.n + 1):
+                    grams.update(cell[i:i + size] for i in range(len(cell) - size + 1))
+            for gram in grams:
+                rows = postings.get(gram)
+                if rows is None:
+                    rows = postings[gram] = array('I')
+                rows.append(row)
+        self._postings = postings
+        if cache_dir is not None:
+            self._save_postings(path, key)
+
+    @staticmethod
+    def _load_postings(path, key):
+        try:
+            with np.load(path, allow_pickle=False) as saved:
+                if str(saved['key']) != key:
+                    return None
+                grams, offsets, rows = saved['grams'].tolist(), saved['offsets'], saved['rows']
+        except (OSError, KeyError, ValueError):
+            return None
+        postings = {}
+        for gram, start, end in zip(grams, offsets[:-1].tolist(), offsets[1:].tolist()):
+            postings[gram] = array('I', rows[start:end].tobytes())
+        return postings
+
+    def _save_postings(self, path, key):
+        grams = list(self._postings)
+        counts = [len(self._postings[gram]) for gram in grams]
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        rows = np.concatenate([np.frombuffer(self._postings[gram], dtype=np.uint32) for gram in grams]) \
+            if grams else np.zeros(0, dtype=np.uint32)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+            np.savez(tmp_path, key=np.array(key), grams=np.array(grams, dtype=str), offsets=offsets, rows=rows)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.warning("Could not save the search index: %s", e)
+
+    def _build_tokens(self, df):
+        # Accent-folded word tokens -> rows, for the ranked fuzzy search. Each
+        # distinct token is also indexed by its padded trigrams, so a misspelt
+        # query word only gets compared with the few words sharing trigrams
+        # with it, never with every row.
+        token_rows = {}
+        values = [df[col].astype(str).tolist() for col in self.fuzzy_columns]
+        folded = {}
+        for row, cells in enumerate(zip(*values)):
+            tokens = set()
+            for cell in cells:
+                cell_tokens = folded.get(cell)
+                if cell_tokens is None:
+                    cell_tokens = folded[cell] = tokenize(cell)
+                tokens.update(cell_tokens)
+            for token in tokens:
+                rows = token_rows.get(token)
+                if rows is None:
+                    rows = token_rows[token] = array('I')
+                rows.append(row)
+        self.vocabulary = sorted(token_rows)
+        self._token_rows = [np.frombuffer(token_rows[token], dtype=np.uint32) for token in self.vocabulary]
+        self._idf = [math.log(1 + self.size / len(rows)) for rows in self._token_rows]
+        trigrams = {}
+        for token_id, token in enumerate(self.vocabulary):
+            for gram in self._trigrams(token):
+                trigrams.setdefault(gram, []).append(token_id)
+        self._trigram_tokens = trigrams
+        self._matches = {}
+
+    @staticmethod
+    def _trigrams(token):
+        padded = f' {token} '
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def match_token(self, token):
+        """[(vocabulary id, similarity 0..1)] for one folded query token.
+
+        Exact words score 1, words the token starts (it is probably still
+        being typed) a bit less, words within typo_limit() edits less again.
+        """
+        matches = self._matches.get(token)
+        if matches is not None:
+            return matches
+        similarity = {}
+        # Prefixes sit next to each other in the sorted vocabulary
+        start = bisect_left(self.vocabulary, token)
+        for token_id in range(start, len(self.vocabulary)):
+            word = self.vocabulary[token_id]
+            if not word.startswith(token):
+                break
+            if word == token:
+                similarity[token_id] = 1.0
+            elif not token.isdigit():
+                similarity[token_id] = 0.6 + 0.3 * len(token) / len(word)
+        limit = typo_limit(token)
+        if limit:
+            grams = self._trigrams(token)
+            shared = {}
+            for gram in grams:
+                for token_id in self._trigram_tokens.get(gram, ()):
+                    shared[token_id] = shared.get(token_id, 0) + 1
+            # A word within limit edits keeps most of the trigrams
+            needed = max(1, len(grams) - 3 * limit)
+            for token_id, count in shared.items():
+                if count < needed or token_id in similarity:
+                    continue
+                distance = edit_distance(token, self.vocabulary[token_id], limit)
+                if distance <= limit:
+                    similarity[token_id] = 0.8 - 0.2 * distance / limit
+        if len(self._matches) >= self.MATCH_CACHE_SIZE:
+            self._matches.clear()
+        matches = self._matches[token] = list(similarity.items())
+        return matches
+
+    def rank(self, query):
+        """Row positions matching query, most relevant first.
+
+        Rows containing the query as typed come first (same as search()),
+        then rows where every recognised query word matches a word of the
+        row exactly, by prefix or within a typo or two. Scores are the
+        similarity of each word weighted by how rare the matched word is.
+        """
+        scores = np.zeros(self.size, dtype=np.float64)
+        matched_all = None
+        for token in dict.fromkeys(tokenize(query)):
+            matches = self.match_token(token)
+            if not matches:
+                continue  # nothing like it in the catalog, don't let it empty the results
+            token_scores = np.zeros(self.size, dtype=np.float64)
+            for token_id, similarity in matches:
+                rows = self._token_rows[token_id]
+                token_scores[rows] = np.maximum(token_scores[rows], similarity * self._idf[token_id])
+            scores += token_scores
+            matched = token_scores > 0
+            matched_all = matched if matched_all is None else matched_all & matched
+        if matched_all is not None:
+            scores[~matched_all] = 0
+        exact = self.search(query)
+        if exact:
+            scores[exact] += scores.max() + 1
+        rows = np.flatnonzero(scores > 0)
+        return rows[np.argsort(-scores[rows], kind='stable')]
+
+    def _grams(self, query):
+        size = min(len(query), self.n)
+        return {query[i:i + size] for i in range(len(query) - size + 1)}
+
+    def search(self, query):
+        """Return the sorted row positions whose text contains query."""
+        query = query.lower()
+        if not query:
+            self._last_query = None
+            self._last_rows = None
+            return list(range(self.size))
+
+        postings = []
+        for gram in self._grams(query):
+            rows = self._postings.get(gram)
+            if rows is None:
+                self._last_query, self._last_rows = query, []
+                return []
+            postings.append(rows)
+        candidates = min(postings, key=len)
+
+        if self._last_query is not None and self._last_query in query \
+                and len(self._last_rows) < len(candidates):
+            # The user kept typing: only rows that matched before can match now
+            candidates = self._last_rows
+        elif len(query) <= self.n:
+            # The query is itself an indexed n-gram, nothing to verify
+            rows = candidates.tolist()
+            self._last_query, self._last_rows = query, rows
+            return rows
+
+        texts = self._texts
+        rows = [row for row in candidates if query in texts[row]]
+        self._last_query, self._last_rows = query, rows
+        return rows
+
+
+def scan_rows(df, query, check=None, chunk_size=65536):
+    """Sorted row positions whose text columns contain query, without an index.
+
+    For tables too big to index (see CSVPage): df is scanned chunk_size rows
+    at a time, calling check() in between so a newer search can cut it short.
+    """
+    frames = ((start, df.iloc[start:start + chunk_size]) for start in range(0, len(df), chunk_size))
+    return scan_frames(frames, query, check, len(df))
+
+
+def scan_frames(frames, query, check=None, size=None):
+    """scan_rows over (first row, DataFrame) pieces of a bigger table, e.g. CsvStore.frames()."""
+    query = query.lower()
+    if not query and size is not None:
+        return np.arange(size)
+    # Categorical columns are matched once per distinct label, not per row
+    matching_codes = {}
+    rows = []
+    for start, chunk in frames:
+        if check is not None:
+            check()
+        mask = np.zeros(len(chunk), dtype=bool)
+        for col in text_columns(chunk):
+            series = chunk[col]
+            if str(series.dtype) == 'category':
+                categories = series.cat.categories
+                cached = matching_codes.get(col)
+                if cached is None or cached[0] is not categories:
+                    labels = categories.astype(str).str.lower()
+                    cached = matching_codes[col] = (categories, np.flatnonzero(labels.str.contains(query, regex=False)))
+                mask |= np.isin(series.cat.codes.to_numpy(), cached[1])
+            else:
+                mask |= series.astype(str).str.lower().str.contains(query, regex=False).to_numpy(dtype=bool)
+        rows.append(np.flatnonzero(mask) + start)
+    return np.concatenate(rows) if rows else np.arange(0)
@@ -0,0 +1,225 @@
+import logging
+import time
+
+from PyQt6.QtCore import Qt, pyqtSignal
+from PyQt6.QtWidgets import (QHBoxLayout, QLabel, QLineEdit, QListWidget, QListWidgetItem, QPushButton, QTableView,
+                             QVBoxLayout, QWidget)
+
+from instrumentation import metrics
+from query import FilterIndex, search_rows
+from search_index import SearchIndex
+from search_worker import SearchWorker
+from table_model import PandasTableModel, RowFilterModel, resize_columns_from_sample
+
+log = logging.getLogger(__name__)
+
+
+class SearchPage(QWidget):
+    midi_file_selected = pyqtSignal(str)  # Define a signal to emit the selected MIDI file path
+    add_to_playlist = pyqtSignal(list)  # Playlist items, see Playlist
+    compare_requested = pyqtSignal(list)  # Playlist items to play side by side, see ComparePage
+
+    def __init__(self, library):
+        super().__init__()
+        # Catalog, feature columns, file locations and search, shared with cli.py;
+        # the main window loads it (indexes included) in the background
+        self.library = library
+        self.dataset_path = library.dataset_path
+        self.metadata = library.metadata
+        self.dataset_index = self.library.dataset_index
+        self.df = self.library.df
+        self.selected_midi_file = None  # To store the path of the selected MIDI file
+        self.selected_row = None  # Row of self.df behind the current selection
+        self.search_started = time.perf_counter()  # When the search being waited for was asked for
+        self.facet_filters = {}  # Facet column -> labels ticked in the sidebar
+        # Searches run on a background thread so typing never waits for them
+        self.search_worker = SearchWorker(parent=self)
+        self.search_worker.finished.connect(self.on_search_finished)
+        self.initUI()
+
+    def initUI(self):
+        layout = QVBoxLayout(self)
+
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Enter search query...")
+        self.search_input.textChanged.connect(lambda: self.on_search())
+        self.search_input.returnPressed.connect(lambda: self.on_search(delay=False))
+
+        self.search_button = QPushButton("Search")
+        self.search_button.clicked.connect(lambda: self.on_search(delay=False))
+
+        self.add_button = QPushButton("Add to Playlist")
+        self.add_button.clicked.connect(self.on_add_to_playlist)
+
+        self.compare_button = QPushButton("Compare Performances")
+        self.compare_button.setToolTip("Play the selected pieces together, or every performance of the selected one")
+        self.compare_button.clicked.connect(self.on_compare)
+
+        self.missing_label = QLabel()
+        self.missing_label.setWordWrap(True)
+        self.update_missing()
+
+        self.table_view = QTableView(self)
+        self.table_view.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.facet_layout = QVBoxLayout()
+        self.facet_lists = {}
+        self.set_dataframe(self.df)  # Display the loaded DataFrame in the QTableView
+
+        hbox = QHBoxLayout()
+        hbox.addWidget(self.search_input)
+        hbox.addWidget(self.search_button)
+        hbox.addWidget(self.add_button)
+        hbox.addWidget(self.compare_button)
+
+        results = QHBoxLayout()
+        results.addLayout(self.facet_layout)
+        results.addWidget(self.table_view, 1)
+
+        layout.addLayout(hbox)
+        layout.addWidget(self.missing_label)
+        layout.addLayout(results)
+
+    def update_missing(self):
+        # Flag catalog entries whose MIDI file is not on disk before anyone tries to play them
+        missing = [name for name in self.dataset_index.missing() if name.endswith(('.mid', '.midi'))]
+        self.missing_label.setText(f"{len(missing)} MIDI files listed in the catalog are not in "
+                                   f"{self.dataset_index.root}" if missing else "")
+        self.missing_label.setVisible(bool(missing))
+
+    def build_facets(self):
+        # One checkable list per facet column, with how many results each value has
+        while self.facet_layout.count():
+            item = self.facet_layout.takeAt(0)
+            if item.widget() is not None:
+                item.widget().deleteLater()
+        self.facet_lists = {}
+        self.facet_filters = {}
+        for column in self.filter_index.facet_columns:
+            self.facet_layout.addWidget(QLabel(column.replace('canonical_', '').capitalize()))
+            facet_list = QListWidget()
+            facet_list.setMaximumWidth(220)
+            for label in self.filter_index.bitmap_index(column).labels:
+                item = QListWidgetItem(label)
+                item.setData(Qt.ItemDataRole.UserRole, label)
+                item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+                item.setCheckState(Qt.CheckState.Unchecked)
+                facet_list.addItem(item)
+            facet_list.itemChanged.connect(lambda item, column=column: self.on_facet_changed(column, item))
+            self.facet_layout.addWidget(facet_list)
+            self.facet_lists[column] = facet_list
+        self.update_facet_counts(self.filter_index.facet_counts(self.filter_index.all_rows))
+
+    def on_facet_changed(self, column, item):
+        labels = self.facet_filters.setdefault(column, set())
+        if item.checkState() == Qt.CheckState.Checked:
+            labels.add(item.data(Qt.ItemDataRole.UserRole))
+        else:
+            labels.discard(item.data(Qt.ItemDataRole.UserRole))
+        self.on_search(delay=False)
+
+    def update_facet_counts(self, facet_counts):
+        # Counts come from ANDing each value's bitmap with the results, only the text changes
+        for column, counts in facet_counts.items():
+            facet_list = self.facet_lists[column]
+            facet_list.blockSignals(True)
+            for row, (label, count) in enumerate(counts):
+                facet_list.item(row).setText(f"{label} ({count})")
+            facet_list.blockSignals(False)
+
+    def on_selection_changed(self, selected, deselected):
+        # Get the first selected index
+        indexes = selected.indexes()
+        if indexes:
+            # The view shows filtered rows, map back to the row in self.df
+            self.selected_row = self.proxy_model.source_row(indexes[0].row())
+            # Assuming 'midi_filename' column contains the MIDI file names
+            midi_filename = self.df.iloc[self.selected_row]['midi_filename']
+            self.selected_midi_file = self.dataset_index.path(midi_filename)
+            if self.selected_midi_file is None:
+                log.warning("MIDI file is not in the dataset folder: %s", midi_filename)
+                return
+            self.midi_file_selected.emit(self.selected_midi_file)
+            log.debug("Selected MIDI file: %s", self.selected_midi_file)
+
+    def on_add_to_playlist(self):
+        # The selected rows, or every search result when nothing is selected
+        selected = self.table_view.selectionModel().selectedRows()
+        if selected:
+            rows = [self.proxy_model.source_row(index.row()) for index in selected]
+        else:
+            rows = self.proxy_model.source_rows()
+        items, skipped = self.library.playlist_items(self.df.iloc[rows])
+        if skipped:
+            log.warning("Skipped %d pieces whose MIDI file is missing", skipped)
+        self.add_to_playlist.emit(items)
+
+    def on_compare(self):
+        rows = [self.proxy_model.source_row(index.row()) for index in self.table_view.selectionModel().selectedRows()]
+        if not rows:
+            log.info("Select the performances to compare first.")
+            return
+        if len(rows) == 1:
+            # Every performance of the selected piece in the catalog
+            piece = self.df.iloc[rows[0]]
+            same = ((self.df['canonical_composer'] == piece['canonical_composer'])
+                    & (self.df['canonical_title'] == piece['canonical_title'])).to_numpy()
+            rows = [rows[0]] + [row for row in same.nonzero()[0].tolist() if row != rows[0]]
+        items, skipped = self.library.playlist_items(self.df.iloc[rows])
+        if skipped:
+            log.warning("Skipped %d pieces whose MIDI file is missing", skipped)
+        if len(items) < 2:
+            log.info("There is only one performance of this piece to play.")
+        self.compare_requested.emit(items)
+
+    def set_dataframe(self, df):
+        """Call this method to set the DataFrame with your data."""
+        self.df = df
+        if df is self.library.df:
+            self.search_index = self.library.search_index  # Built once, queried on every keystroke
+            self.filter_index = self.library.filter_index  # Range and facet indexes, also built once
+        else:
+            self.search_index = SearchIndex(df)
+            self.filter_index = FilterIndex(df)
+        # The source model is built once per DataFrame, searches only change the proxy
+        self.source_model = PandasTableModel(df)
+        self.proxy_model = RowFilterModel(self.source_model)
+        self.selected_row = None
+        self.table_view.setModel(self.proxy_model)
+        self.table_view.selectionModel().selectionChanged.connect(self.on_selection_changed)
+        resize_columns_from_sample(self.table_view, self.proxy_model)
+        # Clicking a header sorts; start unsorted, in catalog order
+        self.table_view.horizontalHeader().setSortIndicator(-1, Qt.SortOrder.AscendingOrder)
+        self.table_view.setSortingEnabled(True)
+        self.build_facets()
+
+    def on_search(self, delay=True):
+        # "duration<5m year:2015 split:validation" filter, the rest is free text.
+        # Keystrokes wait for a pause in typing, buttons and facets search at once
+        facets = {column: set(labels) for column, labels in self.facet_filters.items()}
+        metrics.count('search.requests')
+        self.search_started = time.perf_counter()
+        self.search_worker.submit(search_rows, self.search_index, self.filter_index,
+                                  self.search_input.text(), facets, delay=delay)
+
+    def on_search_finished(self, generation, result):
+        # Results are ranked best first; the proxy keeps that order until a column header is clicked
+        rows, facet_counts = result
+        self.update_table_view(rows)
+        self.update_facet_counts(facet_counts)
+        # From the last keystroke to the results on screen, typing pause included
+        metrics.record('search.latency', time.perf_counter() - self.search_started, self.search_started)
+
+    def shutdown(self):
+        self.search_worker.shutdown()
+
+    @metrics.timed('search.update_table_view')
+    def update_table_view(self, rows):
+        self.proxy_model.set_rows(rows)
+        # Resetting the proxy clears the selection, put it back if the row is still shown
+        if self.selected_row is not None:
+            row = self.proxy_model.proxy_row(self.selected_row)
+            if row is not None:
+                self.proxy_model.ensure_loaded(row)
+                self.table_view.selectionModel().blockSignals(True)
+                self.table_view.selectRow(row)
+                self.table_view.selectionModel().blockSignals(False)
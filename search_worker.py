@@ -0,0 +1,104 @@
+import logging
+from functools import partial
+
+from PyQt6.QtCore import QObject, QThread, QTimer, pyqtSignal
+
+from instrumentation import metrics
+
+log = logging.getLogger(__name__)
+
+
+class SearchCancelled(Exception):
+    """Raised by the check() a search job gets once a newer search was submitted."""
+
+
+class SearchWorker(QObject):
+    """Runs searches on a background thread, newest request wins.
+
+    submit() waits until typing pauses for delay_ms (restarting the wait on
+    every keystroke), then hands the job to the worker thread tagged with a
+    generation number. A job is skipped if a newer one arrived while it sat in
+    the queue, and can stop part way by calling the check() it is given.
+    finished(generation, result) is only emitted for the latest generation, so
+    the page never shows results for text that is no longer in the box.
+    """
+
+    finished = pyqtSignal(int, object)
+    _requested = pyqtSignal(int, object)
+
+    def __init__(self, delay_ms=150, parent=None):
+        super().__init__(parent)
+        self.generation = 0
+        self._pending = None
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(delay_ms)
+        self._timer.timeout.connect(self._dispatch)
+        self._thread = QThread()
+        self._runner = _Runner(self)
+        self._runner.moveToThread(self._thread)
+        self._requested.connect(self._runner.run)  # Queued: the runner lives on the worker thread
+        self._runner.done.connect(self._on_done)  # Queued back to the GUI thread
+        self._thread.start()
+
+    def submit(self, job, *args, delay=True):
+        """Run job(*args, check) in the background; check() raises SearchCancelled once superseded."""
+        self.generation += 1
+        self._pending = (self.generation, partial(job, *args))
+        if delay:
+            self._timer.start()
+        else:
+            self._timer.stop()
+            self._dispatch()
+
+    def cancel(self):
+        # Anything running or queued is now stale
+        self.generation += 1
+        self._pending = None
+        self._timer.stop()
+
+    def is_current(self, generation):
+        return generation == self.generation
+
+    def _dispatch(self):
+        if self._pending is not None:
+            generation, job = self._pending
+            self._pending = None
+            self._requested.emit(generation, job)
+
+    def _on_done(self, generation, result):
+        if self.is_current(generation):
+            self.finished.emit(generation, result)
+
+    def shutdown(self):
+        self.cancel()
+        self._thread.quit()
+        self._thread.wait()
+
+
+class _Runner(QObject):
+    done = pyqtSignal(int, object)
+
+    def __init__(self, worker):
+        super().__init__()
+        self._worker = worker
+
+    def run(self, generation, job):
+        worker = self._worker
+        if not worker.is_current(generation):
+            return  # Another keystroke came in while this one was queued
+
+        def check():
+            if not worker.is_current(generation):
+                raise SearchCancelled()
+
+        try:
+            with metrics.timer('search.run'):
+                result = job(check)
+        except SearchCancelled:
+            metrics.count('search.cancelled')
+            return
+        except Exception:
+            log.exception("Error while searching")
+            return
+        self.done.emit(generation, result)
@@ -0,0 +1,17 @@
+import os
+
+# Where parsed catalogs (and other derived data) are kept between runs
+CACHE_DIR = os.environ.get('PIANO_PLAYLIST_CACHE',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'piano_playlist'))
+
+# SoundFont the synthesizer plays with: PIANO_PLAYLIST_SOUND_FONT, else the first
+# General MIDI one a fluidsynth package installs; None uses the default MIDI output
+SOUND_FONT_PATHS = [
+    '/usr/share/sounds/sf2/FluidR3_GM.sf2',
+    '/usr/share/soundfonts/FluidR3_GM.sf2',
+    '/usr/share/soundfonts/default.sf2',
+    '/usr/local/share/soundfonts/default.sf2',
+    '/opt/homebrew/share/soundfonts/default.sf2',
+]
+SOUND_FONT = os.environ.get('PIANO_PLAYLIST_SOUND_FONT') or next(
+    (path for path in SOUND_FONT_PATHS if os.path.isfile(path)), None)
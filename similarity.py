@@ -0,0 +1,158 @@
+import threading
+
+import numpy as np
+
+from features import OCTAVES, PITCH_CLASSES, VELOCITY_BANDS, load_features
+
+# Feature columns that make up a fingerprint, in groups. Each group gets the
+# same weight however many columns it has, so the twelve pitch classes do not
+# drown out tempo or dynamics
+FINGERPRINT_GROUPS = {
+    'pitch_classes': [f'pitch_class_{name}' for name in PITCH_CLASSES],
+    'register': [f'pitch_octave_{octave}' for octave in OCTAVES],
+    'tempo': ['notes_per_second', 'onsets_per_second', 'ioi_median', 'ioi_cv'],
+    'dynamics': (['velocity_mean', 'velocity_std', 'velocity_p10', 'velocity_p90']
+                 + [f'velocity_band_{band}' for band in VELOCITY_BANDS]),
+    'texture': ['pitch_mean', 'pitch_min', 'pitch_max', 'pedal_fraction', 'polyphony_mean'],
+}
+
+FINGERPRINT_COLUMNS = [column for columns in FINGERPRINT_GROUPS.values() for column in columns]
+
+# Rates and durations are compared as ratios: 4 vs 8 notes a second is as far apart as 8 vs 16
+LOG_COLUMNS = {'notes_per_second', 'onsets_per_second', 'ioi_median'}
+
+# Queries scored per matrix product in similar_to_many(); the scores take
+# BLOCK_QUERIES x catalog rows floats
+BLOCK_QUERIES = 64
+
+
+def raw_fingerprints(features):
+    """(rows, FINGERPRINT_COLUMNS) float64 array from a feature table; missing values stay NaN."""
+    columns = []
+    for column in FINGERPRINT_COLUMNS:
+        if column in features.columns:
+            values = features[column].to_numpy(dtype=np.float64)
+        else:
+            values = np.full(len(features), np.nan)
+        if column in LOG_COLUMNS:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                values = np.log(values)
+            values[~np.isfinite(values)] = np.nan
+        columns.append(values)
+    return np.column_stack(columns) if columns else np.empty((len(features), 0))
+
+
+class SimilarityIndex:
+    """Fingerprints of every performance in one float32 matrix, for cosine similarity.
+
+    A fingerprint is the performance's features (pitch-class profile,
+    register, tempo and onset density, dynamics, texture), each column standardised
+    with the catalog's mean and spread, weighted by group and scaled to unit
+    length. Similarity to one performance is then a single matrix-vector
+    product over the whole catalog, a few milliseconds even at 100,000 rows.
+
+    update() takes a newer feature table and only fingerprints the rows that
+    are new or whose file changed; the column statistics are kept from the
+    build, so existing rows never need recomputing.
+    """
+
+    def __init__(self, features):
+        raw = raw_fingerprints(features)
+        with np.errstate(invalid='ignore'):
+            self.mean = np.nan_to_num(np.nanmean(raw, axis=0)) if len(raw) else np.zeros(raw.shape[1])
+            scale = np.nanstd(raw, axis=0) if len(raw) else np.ones(raw.shape[1])
+        self.scale = np.where(np.isfinite(scale) & (scale > 0), scale, 1.0)
+        self.weights = np.concatenate([np.full(len(columns), 1 / np.sqrt(len(columns)))
+                                       for columns in FINGERPRINT_GROUPS.values()])
+        self.keys = []
+        self._rows = {}  # midi_filename -> row of the matrix
+        self._stamps = {}  # midi_filename -> (size, mtime_ns) it was fingerprinted at
+        self._matrix = np.empty((0, len(FINGERPRINT_COLUMNS)), dtype=np.float32)
+        self._size = 0
+        # update() may run on a background thread while the GUI asks for recommendations
+        self._lock = threading.Lock()
+        self.update(features)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def matrix(self):
+        return self._matrix[:self._size]
+
+    def fingerprint(self, raw):
+        """Unit-length float32 fingerprints of raw_fingerprints() rows."""
+        normalized = np.nan_to_num((raw - self.mean) / self.scale) * self.weights
+        norms = np.linalg.norm(normalized, axis=1, keepdims=True)
+        return (normalized / np.where(norms > 0, norms, 1.0)).astype(np.float32)
+
+    def update(self, features):
+        """Fingerprint rows of features that are new or changed; returns how many there were."""
+        stamps = list(zip(features['size'].tolist(), features['mtime_ns'].tolist())) \
+            if {'size', 'mtime_ns'} <= set(features.columns) else [None] * len(features)
+        changed = [position for position, (key, stamp) in enumerate(zip(features.index, stamps))
+                   if key not in self._rows or self._stamps.get(key) != stamp]
+        if not changed:
+            return 0
+        fingerprints = self.fingerprint(raw_fingerprints(features.iloc[changed]))
+        with self._lock:
+            new_keys = [features.index[position] for position in changed if features.index[position] not in self._rows]
+            needed = self._size + len(new_keys)
+            if needed > len(self._matrix):
+                # Grown by doubling, so adding files one at a time stays cheap
+                grown = np.empty((max(needed, 2 * len(self._matrix)), self._matrix.shape[1]), dtype=np.float32)
+                grown[:self._size] = self._matrix[:self._size]
+                self._matrix = grown
+            for fingerprint, position in zip(fingerprints, changed):
+                key = features.index[position]
+                row = self._rows.get(key)
+                if row is None:
+                    row = self._rows[key] = len(self.keys)
+                    self.keys.append(key)
+                self._matrix[row] = fingerprint
+                self._stamps[key] = stamps[position]
+            self._size = len(self.keys)
+        return len(changed)
+
+    def similar(self, key, count=10, exclude=()):
+        """[(midi_filename, similarity)] of the count performances closest to key, best first."""
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                return []
+            matrix = self.matrix
+            scores = matrix @ matrix[row]
+        # keys only ever grows, rows past len(matrix) are never looked up
+        skip = {row} | {self._rows[other] for other in exclude if other in self._rows}
+        return self._top(scores, self.keys, count, skip)
+
+    def similar_to_many(self, keys, count=10):
+        """similar() for several performances at once, as {key: [(midi_filename, similarity)]}."""
+        with self._lock:
+            rows = [self._rows[key] for key in keys if key in self._rows]
+            matrix = self.matrix
+        all_keys = self.keys
+        results = {}
+        for start in range(0, len(rows), BLOCK_QUERIES):
+            block = rows[start:start + BLOCK_QUERIES]
+            # One matrix product scores the whole block against the catalog
+            for row, scores in zip(block, matrix[block] @ matrix.T):
+                results[all_keys[row]] = self._top(scores, all_keys, count, {row})
+        return results
+
+    @staticmethod
+    def _top(scores, keys, count, skip):
+        count = min(count + len(skip), len(scores))
+        if count <= 0:
+            return []
+        best = np.argpartition(-scores, count - 1)[:count]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(keys[row], float(scores[row])) for row in best if row not in skip][:count - len(skip)]
+
+
+def load_similarity_index(metadata):
+    """A SimilarityIndex over the features saved by features.py, or None if it has not been run."""
+    features = load_features(metadata)
+    if features is None or not len(features):
+        return None
+    return SimilarityIndex(features)
@@ -0,0 +1,291 @@
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex
+
+from instrumentation import metrics
+
+
+def column_values(series):
+    # Categoricals keep their small integer codes plus one label per category
+    if str(series.dtype) == 'category':
+        # A missing value has code -1, which picks the trailing 'nan' label
+        labels = [str(label) for label in series.cat.categories] + ['nan']
+        return series.cat.codes.to_numpy(), labels
+    return series.to_numpy(), None
+
+
+class PandasTableModel(QAbstractTableModel):
+    # Rows are handed to the view in batches as it scrolls (see fetchMore)
+    BATCH_SIZE = 1000
+    # Number of formatted cells kept around for repaints
+    CACHE_SIZE = 20000
+
+    def __init__(self, data):
+        super().__init__()  # Properly initialize the parent class
+        self._data = data
+        # Snapshot the frame into one NumPy array per column, so painting a
+        # cell is a plain array lookup instead of DataFrame.iloc
+        self._columns = [str(column) for column in data.columns]
+        self._values = [column_values(data[column]) for column in data.columns]
+        self._row_labels = data.index.to_numpy()
+        self._rows = len(data)
+        self._loaded_rows = min(self._rows, self.BATCH_SIZE)
+        self._cache = OrderedDict()
+        self._ranks = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self._loaded_rows
+
+    def total_rows(self):
+        return self._rows
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._columns)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._loaded_rows < self._rows
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        count = min(self.BATCH_SIZE, self._rows - self._loaded_rows)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._loaded_rows, self._loaded_rows + count - 1)
+        self._loaded_rows += count
+        self.endInsertRows()
+
+    def cell_text(self, row, column):
+        key = (row, column)
+        text = self._cache.get(key)
+        if text is not None:
+            self._cache.move_to_end(key)
+            return text
+        values, labels = self._values[column]
+        if labels is None:
+            text = str(values[row])
+        else:
+            text = labels[values[row]]
+        self._cache[key] = text
+        if len(self._cache) > self.CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return text
+
+    def sort_ranks(self, column):
+        """Position of every row when sorted by column, computed once per column."""
+        ranks = self._ranks.get(column)
+        if ranks is None:
+            values, labels = self._values[column]
+            if labels is not None:
+                # Categories are stored sorted, missing values (-1) go last
+                keys = np.where(values < 0, len(labels), values)
+            else:
+                keys = values
+            try:
+                order = np.argsort(keys, kind='stable')
+            except TypeError:
+                # Mixed object column, e.g. strings and NaN
+                order = np.argsort(np.asarray(keys, dtype=str), kind='stable')
+            ranks = np.empty(len(order), dtype=np.int64)
+            ranks[order] = np.arange(len(order))
+            self._ranks[column] = ranks
+        return ranks
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if index.isValid() and role == Qt.ItemDataRole.DisplayRole:
+            start = time.perf_counter()
+            text = self.cell_text(index.row(), index.column())
+            # Timed but not traced: a repaint makes hundreds of these calls
+            metrics.record('table.data', time.perf_counter() - start)
+            return text
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole:
+            if orientation == Qt.Orientation.Horizontal:
+                return self._columns[section]
+            elif orientation == Qt.Orientation.Vertical:
+                return str(self._row_labels[section])
+        return None
+
+
+class StoreTableModel(PandasTableModel):
+    """PandasTableModel over a CsvStore that is still being filled.
+
+    refresh() picks up the rows appended since the last call; only the
+    row count and the column arrays change, painted cells come straight
+    from the store (memory-mapped when it is spilled to disk).
+    """
+
+    def __init__(self, store):
+        QAbstractTableModel.__init__(self)
+        self._store = store
+        self._data = None
+        self._columns = [str(column) for column in store.columns]
+        self._values = []
+        self._rows = 0
+        self._loaded_rows = 0
+        self._cache = OrderedDict()
+        self._ranks = {}
+        self.refresh()
+
+    def store(self):
+        return self._store
+
+    def refresh(self):
+        self._values = [self._store.values(column) for column in range(len(self._columns))]
+        self._rows = self._store.rows
+        # A column may have been widened, e.g. int to float on its first NaN
+        self._cache.clear()
+        self._ranks = {}
+        if self._loaded_rows < self.BATCH_SIZE and self._rows > self._loaded_rows:
+            self.fetchMore()
+
+    def sort_ranks(self, column):
+        values, labels = self._values[column]
+        if labels is None or column in self._ranks:
+            return super().sort_ranks(column)
+        # Codes follow the order labels turned up in the file, not label order;
+        # the trailing 'nan' label (code -1) ranks last
+        label_ranks = np.empty(len(labels), dtype=np.int64)
+        label_ranks[np.argsort(np.asarray(labels[:-1], dtype=str), kind='stable')] = np.arange(len(labels) - 1)
+        label_ranks[-1] = len(labels) - 1
+        order = np.argsort(label_ranks[values], kind='stable')
+        ranks = np.empty(len(order), dtype=np.int64)
+        ranks[order] = np.arange(len(order))
+        self._ranks[column] = ranks
+        return ranks
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Vertical:
+            return str(section)
+        return super().headerData(section, orientation, role)
+
+
+class RowFilterModel(QAbstractTableModel):
+    """Shows a subset of a PandasTableModel's rows, in a given order.
+
+    The source model is built once; a search only hands over the matching
+    source row positions, so applying a filter costs O(matches).
+    """
+
+    BATCH_SIZE = PandasTableModel.BATCH_SIZE
+
+    def __init__(self, source):
+        super().__init__()
+        self._source = source
+        self._rows = None  # None means every source row, in source order
+        self._unsorted = None  # The rows as set_rows() got them, shown again when sorting is turned off
+        self._positions = None
+        self._sort = None  # (column, order) picked in the header
+        self._loaded_rows = min(self._total(), self.BATCH_SIZE)
+
+    def source_model(self):
+        return self._source
+
+    def set_rows(self, rows):
+        """Show only these source rows (None shows all of them), in this order unless a column is sorted."""
+        self._unsorted = rows
+        self._reset()
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        # Column -1 turns sorting off: back to catalog order, or search ranking
+        self._sort = (column, order) if column >= 0 else None
+        self._reset()
+
+    def _reset(self):
+        self.beginResetModel()
+        self._rows = self._sorted(self._unsorted)
+        self._positions = None
+        self._loaded_rows = min(self._total(), self.BATCH_SIZE)
+        self.endResetModel()
+
+    def _sorted(self, rows):
+        if self._sort is None:
+            return rows
+        column, order = self._sort
+        rows = np.arange(self._source.total_rows()) if rows is None else np.asarray(rows, dtype=np.int64)
+        # Sorting by precomputed ranks is an integer sort of just these rows
+        rows = rows[np.argsort(self._source.sort_ranks(column)[rows], kind='stable')]
+        return rows[::-1] if order == Qt.SortOrder.DescendingOrder else rows
+
+    def _total(self):
+        return self._source.total_rows() if self._rows is None else len(self._rows)
+
+    def source_rows(self):
+        """Every source row shown, in display order."""
+        return list(range(self._source.total_rows())) if self._rows is None else list(self._rows)
+
+    def source_row(self, row):
+        return row if self._rows is None else self._rows[row]
+
+    def proxy_row(self, source_row):
+        """Row showing source_row, or None if it is filtered out."""
+        if self._rows is None:
+            return source_row if 0 <= source_row < self._total() else None
+        if self._positions is None:
+            self._positions = {row: position for position, row in enumerate(self._rows)}
+        return self._positions.get(source_row)
+
+    def source_grew(self):
+        """The source gained rows (see StoreTableModel.refresh): fill the first batch."""
+        if self._loaded_rows < self.BATCH_SIZE:
+            self.fetchMore()
+
+    def ensure_loaded(self, row):
+        if row >= self._loaded_rows and row < self._total():
+            self.beginInsertRows(QModelIndex(), self._loaded_rows, row)
+            self._loaded_rows = row + 1
+            self.endInsertRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self._loaded_rows
+
+    def columnCount(self, parent=QModelIndex()):
+        return self._source.columnCount(parent)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._loaded_rows < self._total()
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        count = min(self.BATCH_SIZE, self._total() - self._loaded_rows)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._loaded_rows, self._loaded_rows + count - 1)
+        self._loaded_rows += count
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if index.isValid() and role == Qt.ItemDataRole.DisplayRole:
+            return self._source.cell_text(self.source_row(index.row()), index.column())
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Vertical:
+            section = self.source_row(section)
+        return self._source.headerData(section, orientation, role)
+
+
+def resize_columns_from_sample(view, model, sample_size=200, max_width=400):
+    """Size columns from an evenly spaced sample of rows instead of all of them."""
+    source = model.source_model() if isinstance(model, RowFilterModel) else model
+    fm = view.fontMetrics()
+    total = source.total_rows()
+    step = max(1, total // sample_size)
+    sample = range(0, total, step)
+    for column in range(source.columnCount()):
+        texts = [source.headerData(column, Qt.Orientation.Horizontal)]
+        texts.extend(source.cell_text(row, column) for row in sample)
+        width = max(fm.horizontalAdvance(text) for text in texts)
+        view.setColumnWidth(column, min(width + 16, max_width))
@@ -3,9 +3,17 @@ from PyQt6.QtCore import Qt, QAbstractTableModel, pyqtSignal, QUrl
 from PyQt6.QtGui import QDesktopServices
 import pandas as pd
 import mido
+import logging
 import os
 import sys
 
+from catalog import load_catalog
+from dataset_index import load_dataset_index
+from instrumentation import start_logging
+from playback import volume_messages
+
+log = logging.getLogger(__name__)
+
 class IntroductionPage(QWidget):
     def __init__(self):
         super().__init__()
@@ -21,6 +29,7 @@ class MusicPage(QWidget):
         self.initUI()
         self.midi_output_port = None
         self.mid = None
+        self.volume = 1.0
 
     def initUI(self):
         layout = QVBoxLayout(self)
@@ -52,23 +61,15 @@ class MusicPage(QWidget):
 
     def changeValue(self, value):
         self.label.setText(f'Volume: {value}')
-        if self.mid:
-            # Adjust volume of all MIDI messages
-            for track in self.mid.tracks:
-                for msg in track:
-                    if msg.type in ('note_on', 'note_off'):
-                        msg.velocity = int(value / 100 * 127)
+        # Sent as channel volume when playing, the file's velocities are left alone
+        self.volume = value / 100
 
     def playMidiFile(self):
         # Ensure that the selected_midi_file attribute is set by the selection changed method
         midi_file_path = self.selected_midi_file
 
         if midi_file_path is None:
-            print("MIDI file has not been selected.")
-            return
-
-        if not os.path.exists(midi_file_path):
-            print(f"MIDI file does not exist: {midi_file_path}")
+            log.info("MIDI file has not been selected.")
             return
 
         try:
@@ -76,12 +77,14 @@ class MusicPage(QWidget):
             self.mid = mido.MidiFile(midi_file_path)
             # You need to choose an available port
             with mido.open_output() as port:
+                for msg in volume_messages(self.volume):
+                    port.send(msg)
                 for msg in self.mid.play():
                     port.send(msg)
                     if msg.type == 'note_on':
-                        print(f"Playing note: {msg.note}")
+                        log.debug("Playing note: %d", msg.note)
         except Exception as e:
-            print(f"Error playing MIDI file: {e}")
+            log.error("Error playing MIDI file: %s", e)
             # Here, the audio playback will be asynchronous. You might want to keep track of the playback state.
 
     def stopMidiFile(self):
@@ -105,7 +108,8 @@ class SearchPage(QWidget):
         self.dataset_path = dataset_path
         self.metadata = metadata
 
-        self.df = pd.read_csv(metadata)  # Load the metadata CSV
+        self.df = load_catalog(metadata).df  # Shared, cached copy of the metadata CSV
+        self.dataset_index = load_dataset_index(dataset_path, metadata)  # Catalog filename -> path on disk
         self.selected_midi_file = None  # To store the path of the selected MIDI file
         self.initUI()
 
@@ -139,17 +143,20 @@ class SearchPage(QWidget):
             selected_row = indexes[0].row()
             # Assuming 'midi_filename' column contains the MIDI file names
             midi_filename = self.df.iloc[selected_row]['midi_filename']
-            self.selected_midi_file = os.path.join(self.dataset_path, midi_filename)
+            self.selected_midi_file = self.dataset_index.path(midi_filename)
+            if self.selected_midi_file is None:
+                log.warning("MIDI file is not in the dataset folder: %s", midi_filename)
+                return
             # Emit a signal to inform other components (e.g., MusicPage) about the selected MIDI file
             self.midi_file_selected.emit(self.selected_midi_file)  # Emit this signal
-            print(f"Selected MIDI file: {self.selected_midi_file}")  # Debugging
+            log.debug("Selected MIDI file: %s", self.selected_midi_file)
 
             # Open the WAV file with the default application
             wav_file_path = os.path.splitext(self.selected_midi_file)[0] + ".wav"
             try:
                 QDesktopServices.openUrl(QUrl.fromLocalFile(wav_file_path))
             except Exception as e:
-                print(f"Error opening WAV file: {e}")
+                log.error("Error opening WAV file: %s", e)
 
     def set_dataframe(self, df):
         """Call this method to set the DataFrame with your data."""
@@ -249,20 +256,15 @@ class PandasTableModel(QAbstractTableModel):
                 return str(self._data.index[section])
         return None
 
-def organize_audio_files_by_year(dataset_path, metadata_path):
-    df = pd.read_csv(metadata_path)
-    audio_files = {}
-    for _, row in df.iterrows():
-        year = row['year']
-        midi_filename = row['midi_filename']
-        audio_files.setdefault(year, []).append(os.path.join(dataset_path, midi_filename))
-    return audio_files
-
 if __name__ == "__main__":
     dataset_path = 'C:/Users/carla/maestro-v3.0.0/'  # Adjust the dataset path accordingly
     metadata = 'C:/Users/carla/maestro-v3.0.0/maestro-v3.0.0.csv'  # Adjust the metadata path accordingly
 
-    audio_files = organize_audio_files_by_year(dataset_path, metadata)
+    start_logging()
+    # One scan of the dataset folder up front; missing files are reported here, not at play time
+    missing = [name for name in load_dataset_index(dataset_path, metadata).missing() if name.endswith('.midi')]
+    if missing:
+        log.warning("%d MIDI files from the catalog are missing, e.g. %s", len(missing), missing[0])
 
     app = QApplication(sys.argv)
     main_window = MainWindow(dataset_path, metadata)
@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import csv_store  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    # Spilled columns go under CACHE_DIR/csv
+    monkeypatch.setattr(csv_store, 'CACHE_DIR', str(tmp_path / 'cache'))
+
+
+def load(path, spill, **kwargs):
+    for store, _, _ in csv_store.load_csv(str(path), spill=spill, **kwargs):
+        pass
+    return store
+
+
+def cells(store, column):
+    values, labels = store.values(column)
+    if labels is not None:
+        return [labels[code] for code in values]
+    return [str(values[row]) for row in range(store.rows)]
+
+
+@pytest.mark.parametrize('spill', [False, True])
+def test_missing_text_value(tmp_path, spill):
+    path = tmp_path / 'pieces.csv'
+    path.write_text('title,rating\nNocturne,1\n,2\nEtude,3\n')
+    store = load(path, spill)
+    try:
+        assert cells(store, 0) == ['Nocturne', 'nan', 'Etude']
+    finally:
+        store.close()
+
+
+@pytest.mark.parametrize('spill', [False, True])
+def test_numeric_column_turns_into_text(tmp_path, spill, monkeypatch):
+    infer_dtypes = csv_store.infer_dtypes
+    monkeypatch.setattr(csv_store, 'infer_dtypes', lambda path: infer_dtypes(path, sample_rows=100))
+    # An int column with a gap (parsed as float) and, past the sample, a value that is not a number
+    path = tmp_path / 'numbers.csv'
+    rows = ['' if row == 5 else 'n12b' if row == 250 else str(row) for row in range(300)]
+    path.write_text('row,value\n' + ''.join(f'{row},{value}\n' for row, value in enumerate(rows)))
+    store = load(path, spill, chunk_rows=100)
+    try:
+        values = cells(store, 1)
+        assert values[4] == '4' and values[5] == 'nan' and values[12] == '12'
+        assert values[250] == 'n12b' and values[299] == '299'
+    finally:
+        store.close()
@@ -2,10 +2,18 @@ from PyQt6.QtWidgets import QApplication, QMainWindow, QWidget, QPushButton, QVB
 from PyQt6.QtCore import Qt, QAbstractTableModel, pyqtSignal, QUrl
 from PyQt6.QtGui import QDesktopServices
 import pandas as pd
-import mido
+import logging
 import os
 import sys
-from midi2audio import FluidSynth
+
+from audio_backend import AudioBackend
+from catalog import load_catalog
+from dataset_index import load_dataset_index
+from instrumentation import start_logging
+from render_cache import RenderCache
+from settings import SOUND_FONT
+
+log = logging.getLogger(__name__)
 
 class IntroductionPage(QWidget):
     def __init__(self):
@@ -17,8 +25,10 @@ class IntroductionPage(QWidget):
         self.setLayout(layout)
 
 class MusicPage(QWidget):
-    def __init__(self):
+    def __init__(self, audio_backend, render_cache=None):
         super().__init__()
+        self.audio_backend = audio_backend
+        self.render_cache = render_cache  # WAVs rendered in the background when a row is selected
         self.initUI()
         self.midi_output_port = None
         self.mid = None
@@ -64,19 +74,25 @@ class MusicPage(QWidget):
         midi_file_path = self.selected_midi_file
 
         if midi_file_path is None:
-            print("MIDI file has not been selected.")
+            log.info("MIDI file has not been selected.")
             return
 
-        if not os.path.exists(midi_file_path):
-            print(f"MIDI file does not exist: {midi_file_path}")
-            return
+        if self.render_cache is not None:
+            # Rendered already (or at least its first seconds): open the WAV straight away
+            wav_file_path = self.render_cache.cached(midi_file_path)
+            if wav_file_path is None:
+                wav_file_path = self.render_cache.cached(midi_file_path, preview=True)
+                if wav_file_path is not None:
+                    log.info("Playing the first seconds, the rest is still rendering")
+            if wav_file_path is not None:
+                QDesktopServices.openUrl(QUrl.fromLocalFile(wav_file_path))
+                return
 
         try:
-            # Use FluidSynth to play the MIDI file
-            fs = FluidSynth()
-            fs.play_midi(midi_file_path)
+            # Use the shared FluidSynth to play the MIDI file
+            self.audio_backend.synth().play_midi(midi_file_path)
         except Exception as e:
-            print(f"Error playing MIDI file: {e}")
+            log.error("Error playing MIDI file: %s", e)
 
 
     def stopMidiFile(self):
@@ -95,12 +111,14 @@ class MusicPage(QWidget):
 class SearchPage(QWidget):
     midi_file_selected = pyqtSignal(str)  # Define a signal to emit the selected MIDI file path
 
-    def __init__(self, dataset_path, metadata):
+    def __init__(self, dataset_path, metadata, render_cache=None):
         super().__init__()
         self.dataset_path = dataset_path
         self.metadata = metadata
+        self.render_cache = render_cache
 
-        self.df = pd.read_csv(metadata)  # Load the metadata CSV
+        self.df = load_catalog(metadata).df  # Shared, cached copy of the metadata CSV
+        self.dataset_index = load_dataset_index(dataset_path, metadata)  # Catalog filename -> path on disk
         self.selected_midi_file = None  # To store the path of the selected MIDI file
         self.initUI()
 
@@ -133,20 +151,19 @@ class SearchPage(QWidget):
             selected_row = indexes[0].row()
             # Assuming 'midi_filename' column contains the MIDI file names
             midi_filename = self.df.iloc[selected_row]['midi_filename']
-            # Construct the file path using os.path.join()
-            midi_file_path = os.path.join(self.dataset_path, midi_filename)
+            # Look the file up in the dataset index built at startup
+            midi_file_path = self.dataset_index.path(midi_filename)
+            if midi_file_path is None:
+                log.warning("MIDI file is not in the dataset folder: %s", midi_filename)
+                return
             # Emit a signal to inform other components (e.g., MusicPage) about the selected MIDI file
             self.midi_file_selected.emit(midi_file_path)  # Emit this signal
-            print(f"Selected MIDI file: {midi_file_path}")  # Debugging
+            log.debug("Selected MIDI file: %s", midi_file_path)
 
-            # Check if the selected file is not a MIDI file
-            if not midi_filename.endswith('.midi'):
-                # Open the WAV file with the default application
-                wav_file_path = os.path.splitext(midi_file_path)[0] + ".wav"
-                try:
-                    QDesktopServices.openUrl(QUrl.fromLocalFile(wav_file_path))
-                except Exception as e:
-                    print(f"Error opening WAV file: {e}")
+            # The dataset's WAVs are often not downloaded: start rendering one now, so it is
+            # ready (or its first seconds are) by the time Play is pressed
+            if self.render_cache is not None:
+                self.render_cache.request(midi_file_path)
 
 
     def set_dataframe(self, df):
@@ -175,7 +192,12 @@ class SearchPage(QWidget):
 class MainWindow(QMainWindow):
     def __init__(self, dataset_path, metadata):
         super().__init__()
-        self.search_page = SearchPage(dataset_path, metadata)
+        # Shared by every play, started now so the SoundFont is loaded before the first one
+        self.audio_backend = AudioBackend(sound_font=SOUND_FONT)
+        self.audio_backend.start_background()
+        # Renders are kept between runs, so a piece played before opens instantly
+        self.render_cache = RenderCache(self.audio_backend.sound_font, self.audio_backend.sample_rate)
+        self.search_page = SearchPage(dataset_path, metadata, self.render_cache)
         self.setWindowTitle("Main Application")
         self.setGeometry(300, 300, 600, 400)
 
@@ -204,7 +226,7 @@ class MainWindow(QMainWindow):
 
         self.stacked_widget = QStackedWidget()
         self.stacked_widget.addWidget(IntroductionPage())
-        self.stacked_widget.addWidget(MusicPage())
+        self.stacked_widget.addWidget(MusicPage(self.audio_backend, self.render_cache))
         self.stacked_widget.addWidget(self.search_page)  # Pass metadata to SearchPage
         #self.stacked_widget.addWidget(ChangeModePage())
 
@@ -218,6 +240,11 @@ class MainWindow(QMainWindow):
     def switch_page(self, page_index):
         self.stacked_widget.setCurrentIndex(page_index)
 
+    def closeEvent(self, event):
+        self.render_cache.close()
+        self.audio_backend.close()
+        super().closeEvent(event)
+
     def set_music_page_midi_file(self, midi_file):
         music_page = self.stacked_widget.widget(1)
         # Construct the file path using os.path.join()
@@ -249,20 +276,15 @@ class PandasTableModel(QAbstractTableModel):
                 return str(self._data.index[section])
         return None
 
-def organize_audio_files_by_year(dataset_path, metadata_path):
-    df = pd.read_csv(metadata_path)
-    audio_files = {}
-    for _, row in df.iterrows():
-        year = row['year']
-        midi_filename = row['midi_filename']
-        audio_files.setdefault(year, []).append(os.path.join(dataset_path, midi_filename))
-    return audio_files
-
 if __name__ == "__main__":
     dataset_path = r"C:/Users/carla/OneDrive/Desktop/maestro-v3.0.0/"
     metadata =  r"C:/Users/carla/OneDrive/Desktop/maestro-v3.0.0/maestro-v3.0.0.csv"
 
-    audio_files = organize_audio_files_by_year(dataset_path, metadata)
+    start_logging()
+    # One scan of the dataset folder up front; missing files are reported here, not at play time
+    missing = [name for name in load_dataset_index(dataset_path, metadata).missing() if name.endswith('.midi')]
+    if missing:
+        log.warning("%d MIDI files from the catalog are missing, e.g. %s", len(missing), missing[0])
     
     app = QApplication(sys.argv)
     main_window = MainWindow(dataset_path, metadata)